@@ -0,0 +1,547 @@
+"""Bảng thống kê chẩn đoán được cập nhật dần bằng trigger
+
+/stats đọc các bảng nhỏ này thay vì COUNT(*) / GROUP BY trên toàn bộ
+bảng diagnoses. rebuild() tính lại từ dữ liệu gốc, check() so sánh hai bên.
+/stats/timeseries đọc bảng rollup theo giờ / ngày (DiagnosisRollups).
+"""
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from pagination import sqlite_time
+
+# Số ngày giữ rollup theo giờ; cũ hơn chỉ còn rollup theo ngày
+ROLLUP_HOURLY_RETENTION_DAYS = int(os.getenv("ROLLUP_HOURLY_RETENTION_DAYS", 14))
+ROLLUP_PRUNE_INTERVAL = float(os.getenv("ROLLUP_PRUNE_INTERVAL", 3600))
+
+SQLITE_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS diagnosis_stats_type (
+        type TEXT PRIMARY KEY,
+        total INTEGER NOT NULL DEFAULT 0,
+        successful INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS diagnosis_stats_disease (
+        label TEXT PRIMARY KEY,
+        count INTEGER NOT NULL DEFAULT 0
+    )
+    '''
+]
+
+SQLITE_TRIGGERS = [
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_diagnoses_stats_insert AFTER INSERT ON diagnoses
+    BEGIN
+        INSERT INTO diagnosis_stats_type (type, total, successful)
+        VALUES (COALESCE(NEW.type, 'unknown'), 1, CASE WHEN {new_success} THEN 1 ELSE 0 END)
+        ON CONFLICT (type) DO UPDATE SET
+            total = total + 1,
+            successful = successful + excluded.successful;
+
+        INSERT INTO diagnosis_stats_disease (label, count)
+        SELECT NEW.{label}, 1 WHERE ({new_success}) AND NEW.{label} IS NOT NULL
+        ON CONFLICT (label) DO UPDATE SET count = count + 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_diagnoses_stats_delete AFTER DELETE ON diagnoses
+    BEGIN
+        UPDATE diagnosis_stats_type SET
+            total = total - 1,
+            successful = successful - CASE WHEN {old_success} THEN 1 ELSE 0 END
+        WHERE type = COALESCE(OLD.type, 'unknown');
+
+        UPDATE diagnosis_stats_disease SET count = count - 1
+        WHERE label = OLD.{label} AND ({old_success});
+    END
+    '''
+]
+
+POSTGRES_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS diagnosis_stats_type (
+        type TEXT PRIMARY KEY,
+        total BIGINT NOT NULL DEFAULT 0,
+        successful BIGINT NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS diagnosis_stats_disease (
+        label TEXT PRIMARY KEY,
+        count BIGINT NOT NULL DEFAULT 0
+    )
+    '''
+]
+
+POSTGRES_TRIGGERS = [
+    '''
+    CREATE OR REPLACE FUNCTION diagnoses_stats_trigger() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            INSERT INTO diagnosis_stats_type (type, total, successful)
+            VALUES (COALESCE(NEW.type, 'unknown'), 1, CASE WHEN {new_success} THEN 1 ELSE 0 END)
+            ON CONFLICT (type) DO UPDATE SET
+                total = diagnosis_stats_type.total + 1,
+                successful = diagnosis_stats_type.successful + EXCLUDED.successful;
+            IF ({new_success}) AND NEW.{label} IS NOT NULL THEN
+                INSERT INTO diagnosis_stats_disease (label, count) VALUES (NEW.{label}, 1)
+                ON CONFLICT (label) DO UPDATE SET count = diagnosis_stats_disease.count + 1;
+            END IF;
+            RETURN NEW;
+        ELSIF TG_OP = 'DELETE' THEN
+            UPDATE diagnosis_stats_type SET
+                total = total - 1,
+                successful = successful - CASE WHEN {old_success} THEN 1 ELSE 0 END
+            WHERE type = COALESCE(OLD.type, 'unknown');
+            IF ({old_success}) AND OLD.{label} IS NOT NULL THEN
+                UPDATE diagnosis_stats_disease SET count = count - 1 WHERE label = OLD.{label};
+            END IF;
+            RETURN OLD;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    ''',
+    'DROP TRIGGER IF EXISTS trg_diagnoses_stats ON diagnoses',
+    '''
+    CREATE TRIGGER trg_diagnoses_stats AFTER INSERT OR DELETE ON diagnoses
+    FOR EACH ROW EXECUTE FUNCTION diagnoses_stats_trigger()
+    '''
+]
+
+
+class DiagnosisStats:
+    """Thống kê tổng, số thành công, theo loại và theo bệnh của bảng diagnoses
+
+    success_expr: biểu thức xác định chẩn đoán thành công, {row} được thay
+    bằng NEW / OLD / diagnoses. label_column: cột dùng để đếm theo bệnh.
+    """
+
+    def __init__(self, dialect='sqlite', label_column='disease', success_expr='{row}.success'):
+        self.dialect = dialect
+        self.label_column = label_column
+        self.success_expr = success_expr
+
+    def _success(self, row):
+        expr = self.success_expr.format(row=row)
+        if self.dialect == 'sqlite':
+            return f'COALESCE({expr}, 0)'
+        return f'COALESCE({expr}, false)'
+
+    def _format(self, sql):
+        return sql.format(
+            label=self.label_column,
+            new_success=self._success('NEW'),
+            old_success=self._success('OLD')
+        )
+
+    def install(self, conn):
+        """Tạo bảng thống kê + trigger; tính lại từ đầu nếu bảng vừa được tạo"""
+        tables = SQLITE_TABLES if self.dialect == 'sqlite' else POSTGRES_TABLES
+        triggers = SQLITE_TRIGGERS if self.dialect == 'sqlite' else POSTGRES_TRIGGERS
+        cursor = conn.cursor()
+        for sql in tables:
+            cursor.execute(sql)
+        for sql in triggers:
+            cursor.execute(self._format(sql))
+        conn.commit()
+
+        cursor.execute('SELECT COUNT(*) FROM diagnosis_stats_type')
+        empty = cursor.fetchone()[0] == 0
+        cursor.execute('SELECT EXISTS (SELECT 1 FROM diagnoses)')
+        if empty and cursor.fetchone()[0]:
+            self.rebuild(conn)
+
+    def read(self, conn, top=10):
+        cursor = conn.cursor()
+        cursor.execute('SELECT type, total, successful FROM diagnosis_stats_type WHERE total > 0')
+        rows = cursor.fetchall()
+        by_type = {row[0]: row[1] for row in rows}
+        total = sum(row[1] for row in rows)
+        successful = sum(row[2] for row in rows)
+
+        cursor.execute(f'''
+            SELECT label, count FROM diagnosis_stats_disease
+            WHERE count > 0
+            ORDER BY count DESC
+            LIMIT {int(top)}
+        ''')
+        top_diseases = [{"disease": row[0], "count": row[1]} for row in cursor.fetchall()]
+
+        return {
+            "total": total,
+            "successful": successful,
+            "by_type": by_type,
+            "top_diseases": top_diseases
+        }
+
+    def _fresh(self, cursor):
+        success = self._success('diagnoses')
+        cursor.execute(f'''
+            SELECT COALESCE(type, 'unknown'), COUNT(*), SUM(CASE WHEN {success} THEN 1 ELSE 0 END)
+            FROM diagnoses
+            GROUP BY COALESCE(type, 'unknown')
+        ''')
+        by_type = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+        cursor.execute(f'''
+            SELECT {self.label_column}, COUNT(*)
+            FROM diagnoses
+            WHERE {success} AND {self.label_column} IS NOT NULL
+            GROUP BY {self.label_column}
+        ''')
+        by_label = dict(cursor.fetchall())
+        return by_type, by_label
+
+    def _lock(self, cursor):
+        # Chặn ghi vào diagnoses trong lúc tính lại
+        if self.dialect == 'sqlite':
+            cursor.execute('BEGIN IMMEDIATE')
+        else:
+            cursor.execute('LOCK TABLE diagnoses IN SHARE MODE')
+
+    def rebuild(self, conn):
+        """Tính lại toàn bộ bảng thống kê từ bảng diagnoses"""
+        cursor = conn.cursor()
+        self._lock(cursor)
+        by_type, by_label = self._fresh(cursor)
+        cursor.execute('DELETE FROM diagnosis_stats_type')
+        cursor.execute('DELETE FROM diagnosis_stats_disease')
+        placeholder = '?' if self.dialect == 'sqlite' else '%s'
+        cursor.executemany(
+            f'INSERT INTO diagnosis_stats_type (type, total, successful) VALUES ({placeholder}, {placeholder}, {placeholder})',
+            [(type_plant, total, successful) for type_plant, (total, successful) in by_type.items()]
+        )
+        cursor.executemany(
+            f'INSERT INTO diagnosis_stats_disease (label, count) VALUES ({placeholder}, {placeholder})',
+            list(by_label.items())
+        )
+        conn.commit()
+        return {"types": len(by_type), "diseases": len(by_label)}
+
+    def check(self, conn):
+        """So sánh bảng thống kê với dữ liệu gốc, trả về các khác biệt"""
+        cursor = conn.cursor()
+        self._lock(cursor)
+        by_type, by_label = self._fresh(cursor)
+        cursor.execute('SELECT type, total, successful FROM diagnosis_stats_type')
+        stored_type = {row[0]: (row[1], row[2]) for row in cursor.fetchall() if row[1] != 0}
+        cursor.execute('SELECT label, count FROM diagnosis_stats_disease')
+        stored_label = {row[0]: row[1] for row in cursor.fetchall() if row[1] != 0}
+        conn.rollback()
+
+        differences = []
+        for key in sorted(set(by_type) | set(stored_type)):
+            if by_type.get(key) != stored_type.get(key):
+                differences.append({"type": key, "actual": by_type.get(key), "stored": stored_type.get(key)})
+        for key in sorted(set(by_label) | set(stored_label), key=str):
+            if by_label.get(key) != stored_label.get(key):
+                differences.append({"disease": key, "actual": by_label.get(key), "stored": stored_label.get(key)})
+
+        return {"consistent": not differences, "differences": differences}
+
+
+GRANULARITIES = ('hour', 'day')
+
+SQLITE_ROLLUP_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS diagnosis_rollup_{granularity} (
+        bucket TEXT NOT NULL,
+        type TEXT NOT NULL,
+        label TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        confidence_sum REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket, type, label)
+    )
+    '''
+]
+
+# Đầu giờ / đầu ngày, cùng định dạng với CURRENT_TIMESTAMP
+SQLITE_BUCKETS = {
+    'hour': "strftime('%Y-%m-%d %H:00:00', {row}.timestamp)",
+    'day': "strftime('%Y-%m-%d 00:00:00', {row}.timestamp)"
+}
+
+SQLITE_ROLLUP_TRIGGERS = [
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_diagnoses_rollup_insert AFTER INSERT ON diagnoses
+    WHEN NEW.{label} IS NOT NULL
+    BEGIN
+        {inserts}
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_diagnoses_rollup_delete AFTER DELETE ON diagnoses
+    WHEN OLD.{label} IS NOT NULL
+    BEGIN
+        {deletes}
+    END
+    '''
+]
+
+SQLITE_ROLLUP_DROP_TRIGGERS = [
+    'DROP TRIGGER IF EXISTS trg_diagnoses_rollup_insert',
+    'DROP TRIGGER IF EXISTS trg_diagnoses_rollup_delete'
+]
+
+# Cột đang dùng làm nhãn rollup, để tính lại khi đổi cột
+ROLLUP_META_TABLE = '''
+    CREATE TABLE IF NOT EXISTS diagnosis_rollup_meta (
+        name TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )
+'''
+
+SQLITE_ROLLUP_INSERT = '''
+        INSERT INTO diagnosis_rollup_{granularity} (bucket, type, label, count, confidence_sum)
+        VALUES ({bucket}, COALESCE(NEW.type, 'unknown'), NEW.{label}, 1, COALESCE(NEW.confidence, 0))
+        ON CONFLICT (bucket, type, label) DO UPDATE SET
+            count = count + 1,
+            confidence_sum = confidence_sum + excluded.confidence_sum;
+'''
+
+SQLITE_ROLLUP_DELETE = '''
+        UPDATE diagnosis_rollup_{granularity} SET
+            count = count - 1,
+            confidence_sum = confidence_sum - COALESCE(OLD.confidence, 0)
+        WHERE bucket = {bucket} AND type = COALESCE(OLD.type, 'unknown') AND label = OLD.{label};
+'''
+
+POSTGRES_ROLLUP_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS diagnosis_rollup_{granularity} (
+        bucket TIMESTAMP NOT NULL,
+        type TEXT NOT NULL,
+        label TEXT NOT NULL,
+        count BIGINT NOT NULL DEFAULT 0,
+        confidence_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket, type, label)
+    )
+    '''
+]
+
+POSTGRES_BUCKETS = {
+    'hour': "date_trunc('hour', {row}.timestamp)",
+    'day': "date_trunc('day', {row}.timestamp)"
+}
+
+POSTGRES_ROLLUP_TRIGGERS = [
+    '''
+    CREATE OR REPLACE FUNCTION diagnoses_rollup_trigger() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            IF NEW.{label} IS NOT NULL THEN
+                {inserts}
+            END IF;
+            RETURN NEW;
+        ELSIF TG_OP = 'DELETE' THEN
+            IF OLD.{label} IS NOT NULL THEN
+                {deletes}
+            END IF;
+            RETURN OLD;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    ''',
+    'DROP TRIGGER IF EXISTS trg_diagnoses_rollup ON diagnoses',
+    '''
+    CREATE TRIGGER trg_diagnoses_rollup AFTER INSERT OR DELETE ON diagnoses
+    FOR EACH ROW EXECUTE FUNCTION diagnoses_rollup_trigger()
+    '''
+]
+
+POSTGRES_ROLLUP_INSERT = '''
+                INSERT INTO diagnosis_rollup_{granularity} (bucket, type, label, count, confidence_sum)
+                VALUES ({bucket}, COALESCE(NEW.type, 'unknown'), NEW.{label}, 1, COALESCE(NEW.confidence, 0))
+                ON CONFLICT (bucket, type, label) DO UPDATE SET
+                    count = diagnosis_rollup_{granularity}.count + 1,
+                    confidence_sum = diagnosis_rollup_{granularity}.confidence_sum + EXCLUDED.confidence_sum;
+'''
+
+POSTGRES_ROLLUP_DELETE = '''
+                UPDATE diagnosis_rollup_{granularity} SET
+                    count = count - 1,
+                    confidence_sum = confidence_sum - COALESCE(OLD.confidence, 0)
+                WHERE bucket = {bucket} AND type = COALESCE(OLD.type, 'unknown') AND label = OLD.{label};
+'''
+
+
+class DiagnosisRollups:
+    """Số chẩn đoán và tổng confidence theo (giờ | ngày, loại, bệnh)
+
+    Trigger cập nhật cả hai bảng khi ghi; rollup theo giờ chỉ giữ
+    hourly_retention_days ngày gần nhất (prune()), phần cũ hơn vẫn còn
+    trong rollup theo ngày.
+    """
+
+    def __init__(self, dialect='sqlite', label_column='disease',
+                 hourly_retention_days=ROLLUP_HOURLY_RETENTION_DAYS, prune_interval=ROLLUP_PRUNE_INTERVAL):
+        self.dialect = dialect
+        self.label_column = label_column
+        self.hourly_retention = timedelta(days=hourly_retention_days)
+        self.prune_interval = prune_interval
+        self.placeholder = '?' if dialect == 'sqlite' else '%s'
+        self._buckets = SQLITE_BUCKETS if dialect == 'sqlite' else POSTGRES_BUCKETS
+        self._last_prune = 0
+
+    def _bucket(self, granularity, row):
+        return self._buckets[granularity].format(row=row)
+
+    def _time(self, value):
+        # SQLite lưu timestamp dạng chuỗi UTC, Postgres so sánh trực tiếp với datetime
+        if self.dialect == 'sqlite':
+            return sqlite_time(value)
+        return value
+
+    def _cutoff(self):
+        """(biểu thức SQL, params) của mốc cũ nhất còn giữ rollup theo giờ
+
+        SQLite: timestamp do ứng dụng ghi theo UTC. Postgres: cột timestamp mặc
+        định CURRENT_TIMESTAMP lưu theo múi giờ của session nên mốc được tính
+        bằng LOCALTIMESTAMP cùng múi giờ, không lệch khi server không chạy UTC.
+        """
+        if self.dialect == 'sqlite':
+            cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - self.hourly_retention
+            return self.placeholder, [self._time(cutoff)]
+        return (f"LOCALTIMESTAMP - {self.placeholder} * INTERVAL '1 second'",
+                [self.hourly_retention.total_seconds()])
+
+    def install(self, conn):
+        """Tạo bảng rollup + trigger; tính lại từ đầu nếu bảng vừa được tạo"""
+        if self.dialect == 'sqlite':
+            tables, triggers = SQLITE_ROLLUP_TABLES, SQLITE_ROLLUP_TRIGGERS
+            insert, delete = SQLITE_ROLLUP_INSERT, SQLITE_ROLLUP_DELETE
+        else:
+            tables, triggers = POSTGRES_ROLLUP_TABLES, POSTGRES_ROLLUP_TRIGGERS
+            insert, delete = POSTGRES_ROLLUP_INSERT, POSTGRES_ROLLUP_DELETE
+
+        inserts = ''.join(
+            insert.format(granularity=g, bucket=self._bucket(g, 'NEW'), label=self.label_column)
+            for g in GRANULARITIES
+        )
+        deletes = ''.join(
+            delete.format(granularity=g, bucket=self._bucket(g, 'OLD'), label=self.label_column)
+            for g in GRANULARITIES
+        )
+
+        cursor = conn.cursor()
+        for granularity in GRANULARITIES:
+            for sql in tables:
+                cursor.execute(sql.format(granularity=granularity))
+        cursor.execute(ROLLUP_META_TABLE)
+        cursor.execute("SELECT value FROM diagnosis_rollup_meta WHERE name = 'label_column'")
+        stored = cursor.fetchone()
+        relabel = stored is None or stored[0] != self.label_column
+        if relabel and self.dialect == 'sqlite':
+            # Trigger SQLite tạo bằng IF NOT EXISTS, phải xoá để đổi cột nhãn
+            for sql in SQLITE_ROLLUP_DROP_TRIGGERS:
+                cursor.execute(sql)
+        for sql in triggers:
+            cursor.execute(sql.format(label=self.label_column, inserts=inserts, deletes=deletes))
+        conn.commit()
+
+        if relabel:
+            # Bảng rollup cũ (nếu có) được tính theo cột nhãn khác hoặc không rõ cột nào
+            self.rebuild(conn)
+            cursor.execute(f'''
+                INSERT INTO diagnosis_rollup_meta (name, value) VALUES ('label_column', {self.placeholder})
+                ON CONFLICT (name) DO UPDATE SET value = excluded.value
+            ''', (self.label_column,))
+            conn.commit()
+        else:
+            cursor.execute('SELECT EXISTS (SELECT 1 FROM diagnosis_rollup_day)')
+            empty = not cursor.fetchone()[0]
+            cursor.execute(f'SELECT EXISTS (SELECT 1 FROM diagnoses WHERE {self.label_column} IS NOT NULL)')
+            if empty and cursor.fetchone()[0]:
+                self.rebuild(conn)
+        self.prune(conn)
+
+    def rebuild(self, conn):
+        """Tính lại rollup theo ngày (toàn bộ) và theo giờ (trong thời gian giữ lại)"""
+        cursor = conn.cursor()
+        if self.dialect == 'sqlite':
+            cursor.execute('BEGIN IMMEDIATE')
+        else:
+            cursor.execute('LOCK TABLE diagnoses IN SHARE MODE')
+
+        cutoff, cutoff_params = self._cutoff()
+        rows = {}
+        for granularity in GRANULARITIES:
+            bucket = self._bucket(granularity, 'diagnoses')
+            where = f'WHERE {self.label_column} IS NOT NULL'
+            params = []
+            if granularity == 'hour':
+                where += f' AND timestamp >= {cutoff}'
+                params.extend(cutoff_params)
+            cursor.execute(f'DELETE FROM diagnosis_rollup_{granularity}')
+            cursor.execute(f'''
+                INSERT INTO diagnosis_rollup_{granularity} (bucket, type, label, count, confidence_sum)
+                SELECT {bucket}, COALESCE(type, 'unknown'), {self.label_column}, COUNT(*), COALESCE(SUM(confidence), 0)
+                FROM diagnoses
+                {where}
+                GROUP BY {bucket}, COALESCE(type, 'unknown'), {self.label_column}
+            ''', params)
+            rows[granularity] = cursor.rowcount
+        conn.commit()
+        return rows
+
+    def prune(self, conn):
+        """Xoá rollup theo giờ cũ hơn thời gian giữ lại và các dòng đã về 0"""
+        cutoff, params = self._cutoff()
+        cursor = conn.cursor()
+        cursor.execute(f'DELETE FROM diagnosis_rollup_hour WHERE bucket < {cutoff}', params)
+        removed = cursor.rowcount
+        for granularity in GRANULARITIES:
+            cursor.execute(f'DELETE FROM diagnosis_rollup_{granularity} WHERE count <= 0')
+        conn.commit()
+        self._last_prune = time.monotonic()
+        return removed
+
+    def maybe_prune(self, conn):
+        if time.monotonic() - self._last_prune >= self.prune_interval:
+            self.prune(conn)
+
+    def query(self, conn, granularity='hour', since=None, until=None, type_plant=None, disease=None):
+        """Chuỗi thời gian [since, until) đọc từ bảng rollup, không đụng tới diagnoses"""
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+
+        conditions = []
+        params = []
+        if since is not None:
+            conditions.append(f'bucket >= {self.placeholder}')
+            params.append(self._time(since))
+        if until is not None:
+            conditions.append(f'bucket < {self.placeholder}')
+            params.append(self._time(until))
+        if type_plant is not None:
+            conditions.append(f'type = {self.placeholder}')
+            params.append(type_plant)
+        if disease is not None:
+            conditions.append(f'label = {self.placeholder}')
+            params.append(disease)
+        where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT bucket, label, SUM(count), SUM(confidence_sum)
+            FROM diagnosis_rollup_{granularity}
+            {where}
+            GROUP BY bucket, label
+            HAVING SUM(count) > 0
+            ORDER BY bucket, label
+        ''', params)
+
+        series = []
+        for bucket, label, count, confidence_sum in cursor.fetchall():
+            if hasattr(bucket, 'isoformat'):
+                bucket = bucket.isoformat(sep=' ')
+            series.append({
+                "bucket": bucket,
+                "disease": label,
+                "count": count,
+                "mean_confidence": confidence_sum / count
+            })
+        return series
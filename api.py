@@ -1,15 +1,30 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, Form, Header, Query, Request, Response, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import requests
 from PIL import Image
 import io
 import sqlite3
 import os
 from datetime import datetime
 from typing import List, Optional
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import batch
+import diagnosis
+import export
+import jsonrows
+import metrics
+import tracing
+import uploads
+import plants_bulk
+from aggregates import DiagnosisRollups, DiagnosisStats
+from catalog import CatalogError, PlantCatalog, etag_matches, parse_fields
+from db import SQLitePool
+from pagination import CursorError, diagnosis_filters, encode_cursor, sqlite_time
+from write_behind import DIAGNOSIS_WRITE_BEHIND, WriteBehindWriter, sqlite_timestamp
 
-app = FastAPI(title="Plant Disease Detection API with Database", version="1.0.0")
+app = FastAPI(title="Plant Disease Detection API with Database", version="1.0.0", default_response_class=metrics.TimedJSONResponse)
 
 # Pydantic models
 class PlantCreate(BaseModel):
@@ -33,6 +48,18 @@ class DiagnosisResponse(BaseModel):
     confidence: float
     timestamp: str
 
+# Cùng dạng với DiagnosisResponse, theo thứ tự cột của truy vấn /diagnoses
+DIAGNOSIS_ENCODER = jsonrows.RowEncoder([
+    ('id', 'int'), ('plant_name', 'str'), ('disease', 'str'), ('confidence', 'float'), ('timestamp', 'datetime')
+])
+
+# Giới hạn kích thước upload trước khi parse multipart
+app.add_middleware(uploads.BodySizeLimitMiddleware)
+# Thời gian, số request đang chạy theo route cho /metrics
+app.add_middleware(metrics.MetricsMiddleware, router=app.router)
+# Header Server-Timing cho /predict/* và trace lấy mẫu (TRACE_SAMPLE_RATE)
+app.add_middleware(tracing.TracingMiddleware)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -43,69 +70,107 @@ app.add_middleware(
 )
 
 # Database setup
+DATABASE_PATH = os.getenv("DATABASE_PATH", "plants.db")
+db_pool = SQLitePool(DATABASE_PATH)
+# Chẩn đoán chỉ được lưu khi thành công nên mọi dòng có disease đều thành công
+diagnosis_stats = DiagnosisStats(label_column='disease', success_expr='{row}.disease IS NOT NULL')
+diagnosis_rollups = DiagnosisRollups(label_column='disease')
+plant_catalog = PlantCatalog(db_pool)
+
 def init_db():
-    conn = sqlite3.connect('plants.db')
-    cursor = conn.cursor()
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
     
-    # Plants table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS plants (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL UNIQUE,
-            scientific_name TEXT,
-            description TEXT,
-            care_instructions TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+        # Plants table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS plants (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL UNIQUE,
+                scientific_name TEXT,
+                description TEXT,
+                care_instructions TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
     
-    # Diagnoses table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS diagnoses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            plant_id INTEGER,
-            disease TEXT,
-            confidence REAL,
-            type TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (plant_id) REFERENCES plants (id)
-        )
-    ''')
+        # Diagnoses table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS diagnoses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                plant_id INTEGER,
+                disease TEXT,
+                confidence REAL,
+                type TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (plant_id) REFERENCES plants (id)
+            )
+        ''')
+        
+        # Index cho lịch sử chẩn đoán (sắp xếp theo thời gian, lọc theo loại / bệnh)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_diagnoses_timestamp ON diagnoses (timestamp, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_diagnoses_type ON diagnoses (type, timestamp, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_diagnoses_disease ON diagnoses (disease, timestamp, id)')
     
-    # Insert default plants
-    default_plants = [
-        ('Táo', 'Malus domestica', 'Cây ăn quả phổ biến', 'Tưới nước đều đặn, cần ánh sáng'),
-        ('Cà chua', 'Solanum lycopersicum', 'Cây rau quả dễ trồng', 'Cần nhiều nước và ánh sáng'),
-        ('Lúa', 'Oryza sativa', 'Cây lương thực chính', 'Trồng trong môi trường ẩm ướt'),
-        ('Ngô', 'Zea mays', 'Cây ngũ cốc quan trọng', 'Cần đất tơi xốp và phân bón'),
-        ('Khoai tây', 'Solanum tuberosum', 'Cây củ dinh dưỡng', 'Trồng trong đất thoát nước tốt')
-    ]
+        # Insert default plants
+        default_plants = [
+            ('Táo', 'Malus domestica', 'Cây ăn quả phổ biến', 'Tưới nước đều đặn, cần ánh sáng'),
+            ('Cà chua', 'Solanum lycopersicum', 'Cây rau quả dễ trồng', 'Cần nhiều nước và ánh sáng'),
+            ('Lúa', 'Oryza sativa', 'Cây lương thực chính', 'Trồng trong môi trường ẩm ướt'),
+            ('Ngô', 'Zea mays', 'Cây ngũ cốc quan trọng', 'Cần đất tơi xốp và phân bón'),
+            ('Khoai tây', 'Solanum tuberosum', 'Cây củ dinh dưỡng', 'Trồng trong đất thoát nước tốt')
+        ]
     
-    cursor.executemany('''
-        INSERT OR IGNORE INTO plants (name, scientific_name, description, care_instructions)
-        VALUES (?, ?, ?, ?)
-    ''', default_plants)
+        cursor.executemany('''
+            INSERT OR IGNORE INTO plants (name, scientific_name, description, care_instructions)
+            VALUES (?, ?, ?, ?)
+        ''', default_plants)
     
-    conn.commit()
-    conn.close()
+        conn.commit()
+        
+        # Bảng thống kê cập nhật bằng trigger cho /stats
+        diagnosis_stats.install(conn)
+        diagnosis_rollups.install(conn)
 
 init_db()
 
-def call_plant_api(image_bytes):
-    """API chẩn đoán bệnh cây trồng tổng quát"""
-    url = "https://detect.roboflow.com/plantvillage-dataset/1"
-    params = {"api_key": "y0YKSebPyue0doYszJEU"}
+# Ghi chẩn đoán theo lô ở thread nền, id được cấp trước để trả về ngay
+diagnosis_writer = None
+if DIAGNOSIS_WRITE_BEHIND:
+    diagnosis_writer = WriteBehindWriter(db_pool, 'diagnoses', ('disease', 'confidence', 'type', 'timestamp'))
+
+@metrics.timed("db_write")
+def save_diagnosis(disease, confidence, type_plant):
+    if diagnosis_writer is not None:
+        return diagnosis_writer.submit((disease, confidence, type_plant, sqlite_timestamp()))
     
-    response = requests.post(url, params=params, files={"file": image_bytes})
-    return response.json()
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO diagnoses (disease, confidence, type)
+            VALUES (?, ?, ?)
+        ''', (disease, confidence, type_plant))
+        diagnosis_id = cursor.lastrowid
+        conn.commit()
+    return diagnosis_id
 
-def call_rice_api(image_bytes):
-    """API chẩn đoán bệnh lúa"""
-    url = "https://detect.roboflow.com/rice-diseases-qzjka/3"
-    params = {"api_key": "y0YKSebPyue0doYszJEU"}
+@metrics.timed("db_write")
+def save_diagnoses(rows):
+    """Lưu nhiều kết quả chẩn đoán (disease, confidence, type) trong một transaction"""
+    if diagnosis_writer is not None:
+        timestamp = sqlite_timestamp()
+        return diagnosis_writer.submit_many([row + (timestamp,) for row in rows])
     
-    response = requests.post(url, params=params, files={"file": image_bytes})
-    return response.json()
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+        diagnosis_ids = []
+        for row in rows:
+            cursor.execute('''
+                INSERT INTO diagnoses (disease, confidence, type)
+                VALUES (?, ?, ?)
+            ''', row)
+            diagnosis_ids.append(cursor.lastrowid)
+        conn.commit()
+    return diagnosis_ids
 
 def format_rice_disease(class_name):
     """Format tên bệnh lúa"""
@@ -123,51 +188,60 @@ def format_rice_disease(class_name):
     }
     return disease_map.get(class_name.lower(), class_name)
 
+@app.on_event("startup")
+async def startup():
+    await diagnosis.startup()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await diagnosis.shutdown()
+    tracing.trace_writer.close()
+    if diagnosis_writer is not None:
+        diagnosis_writer.close()
+    db_pool.close()
+
 @app.get("/")
 async def root():
     return {"message": "Plant Disease Detection API with Database", "version": "1.0.0"}
 
 # Plants CRUD endpoints
 @app.get("/plants", response_model=List[PlantResponse])
-async def get_plants():
-    """Lấy danh sách tất cả cây trồng"""
-    conn = sqlite3.connect('plants.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM plants ORDER BY name')
-    plants = cursor.fetchall()
-    conn.close()
-    
-    return [
-        PlantResponse(
-            id=plant[0],
-            name=plant[1],
-            scientific_name=plant[2],
-            description=plant[3],
-            care_instructions=plant[4],
-            created_at=plant[5]
-        )
-        for plant in plants
-    ]
+def get_plants(
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None)
+):
+    """Lấy danh sách cây trồng (có ETag, phân trang và chọn cột, vd. fields=id,name)"""
+    try:
+        selected = parse_fields(fields)
+    except CatalogError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    body, etag, total = plant_catalog.get(offset=offset, limit=limit, fields=selected)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "X-Total-Count": str(total)}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @app.post("/plants", response_model=PlantResponse)
-async def create_plant(plant: PlantCreate):
+def create_plant(plant: PlantCreate):
     """Thêm cây trồng mới"""
-    conn = sqlite3.connect('plants.db')
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute('''
-            INSERT INTO plants (name, scientific_name, description, care_instructions)
-            VALUES (?, ?, ?, ?)
-        ''', (plant.name, plant.scientific_name, plant.description, plant.care_instructions))
-        
-        plant_id = cursor.lastrowid
-        conn.commit()
-        
-        # Get created plant
-        cursor.execute('SELECT * FROM plants WHERE id = ?', (plant_id,))
-        created_plant = cursor.fetchone()
-        conn.close()
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO plants (name, scientific_name, description, care_instructions)
+                VALUES (?, ?, ?, ?)
+            ''', (plant.name, plant.scientific_name, plant.description, plant.care_instructions))
+            
+            plant_id = cursor.lastrowid
+            conn.commit()
+            plant_catalog.invalidate()
+            
+            # Get created plant
+            cursor.execute('SELECT * FROM plants WHERE id = ?', (plant_id,))
+            created_plant = cursor.fetchone()
         
         return PlantResponse(
             id=created_plant[0],
@@ -179,17 +253,68 @@ async def create_plant(plant: PlantCreate):
         )
         
     except sqlite3.IntegrityError:
-        conn.close()
         raise HTTPException(status_code=400, detail="Plant name already exists")
 
+@app.post("/plants/bulk")
+async def bulk_create_plants(
+    request: Request,
+    on_conflict: str = "skip",
+    errors_only: bool = False
+):
+    """Nhập nhiều cây trồng (mảng JSON hoặc NDJSON), ghi theo từng khối transaction
+
+    on_conflict=skip bỏ qua tên đã tồn tại, upsert cập nhật thông tin.
+    Body NDJSON thì kết quả cũng trả về dạng NDJSON.
+    """
+    if on_conflict not in plants_bulk.CONFLICT_MODES:
+        raise HTTPException(status_code=400, detail="on_conflict must be 'skip' or 'upsert'")
+    ndjson = plants_bulk.is_ndjson(request.headers.get("content-type"))
+
+    outcomes = []
+    chunk = []
+
+    async def flush():
+        # Parse, validate và ghi đều chạy trong threadpool, không chặn event loop
+        outcomes.extend(await run_in_threadpool(plants_bulk.import_chunk, db_pool, list(chunk), on_conflict, PlantCreate))
+        chunk.clear()
+
+    try:
+        async for index, record in plants_bulk.read_records(request.stream(), ndjson):
+            if index >= plants_bulk.PLANTS_BULK_MAX_RECORDS:
+                raise plants_bulk.BulkImportError(f"Import exceeds {plants_bulk.PLANTS_BULK_MAX_RECORDS} records")
+            chunk.append((index, record))
+            if len(chunk) >= plants_bulk.PLANTS_BULK_CHUNK_SIZE:
+                await flush()
+        if chunk:
+            await flush()
+    except (plants_bulk.BulkImportError, uploads.UploadTooLarge) as e:
+        # Các khối trước đó đã được ghi; báo lỗi kèm số dòng đã xử lý
+        if not outcomes:
+            if isinstance(e, HTTPException):
+                raise
+            raise HTTPException(status_code=400, detail=str(e))
+        outcomes.append({"index": None, "status": "failed", "error": str(getattr(e, "detail", e))})
+    finally:
+        if any(outcome["status"] in ("inserted", "updated") for outcome in outcomes):
+            plant_catalog.invalidate()
+
+    outcomes.sort(key=lambda outcome: -1 if outcome["index"] is None else outcome["index"])
+    summary = plants_bulk.summarize(outcomes)
+    results = [o for o in outcomes if o["status"] == "failed"] if errors_only else outcomes
+
+    if ndjson:
+        lines = [batch.ndjson_line(outcome) for outcome in results]
+        lines.append(batch.ndjson_line({"done": True, **summary}))
+        return Response(content="".join(lines), media_type="application/x-ndjson")
+    return {**summary, "results": results}
+
 @app.get("/plants/{plant_id}", response_model=PlantResponse)
-async def get_plant(plant_id: int):
+def get_plant(plant_id: int):
     """Lấy thông tin cây trồng theo ID"""
-    conn = sqlite3.connect('plants.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM plants WHERE id = ?', (plant_id,))
-    plant = cursor.fetchone()
-    conn.close()
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM plants WHERE id = ?', (plant_id,))
+        plant = cursor.fetchone()
     
     if not plant:
         raise HTTPException(status_code=404, detail="Plant not found")
@@ -204,18 +329,17 @@ async def get_plant(plant_id: int):
     )
 
 @app.delete("/plants/{plant_id}")
-async def delete_plant(plant_id: int):
+def delete_plant(plant_id: int):
     """Xóa cây trồng"""
-    conn = sqlite3.connect('plants.db')
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM plants WHERE id = ?', (plant_id,))
-    
-    if cursor.rowcount == 0:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Plant not found")
-    
-    conn.commit()
-    conn.close()
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM plants WHERE id = ?', (plant_id,))
+        
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Plant not found")
+        
+        conn.commit()
+    plant_catalog.invalidate()
     return {"message": "Plant deleted successfully"}
 
 @app.post("/predict/plant")
@@ -226,25 +350,17 @@ async def predict_plant_disease(file: UploadFile = File(...)):
         if not file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="File must be an image")
         
-        # Read image
-        image_bytes = await file.read()
+        # Read image (theo từng khối, giới hạn kích thước)
+        image = await uploads.read_upload(file)
         
         # Call API
-        result = call_plant_api(image_bytes)
+        result = await diagnosis.diagnose_plant(image)
         
         if 'predictions' in result and result['predictions']:
             pred = result['predictions'][0]
             
             # Save to database
-            conn = sqlite3.connect('plants.db')
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO diagnoses (disease, confidence, type)
-                VALUES (?, ?, ?)
-            ''', (pred['class'], pred['confidence'], 'plant'))
-            diagnosis_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
+            diagnosis_id = await run_in_threadpool(save_diagnosis, pred['class'], pred['confidence'], 'plant')
             
             return {
                 "success": True,
@@ -260,8 +376,10 @@ async def predict_plant_disease(file: UploadFile = File(...)):
                 "message": "No disease detected"
             }
             
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=diagnosis.error_status(e), detail=str(e))
 
 @app.post("/predict/rice")
 async def predict_rice_disease(file: UploadFile = File(...)):
@@ -271,25 +389,17 @@ async def predict_rice_disease(file: UploadFile = File(...)):
         if not file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="File must be an image")
         
-        # Read image
-        image_bytes = await file.read()
+        # Read image (theo từng khối, giới hạn kích thước)
+        image = await uploads.read_upload(file)
         
         # Call API
-        result = call_rice_api(image_bytes)
+        result = await diagnosis.diagnose_rice(image)
         
         if 'predictions' in result and result['predictions']:
             best_pred = max(result['predictions'], key=lambda x: x['confidence'])
             
             # Save to database
-            conn = sqlite3.connect('plants.db')
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO diagnoses (disease, confidence, type)
-                VALUES (?, ?, ?)
-            ''', (best_pred['class'], best_pred['confidence'], 'rice'))
-            diagnosis_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
+            diagnosis_id = await run_in_threadpool(save_diagnosis, best_pred['class'], best_pred['confidence'], 'rice')
             
             return {
                 "success": True,
@@ -306,62 +416,263 @@ async def predict_rice_disease(file: UploadFile = File(...)):
                 "message": "No rice disease detected"
             }
             
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=diagnosis.error_status(e), detail=str(e))
+
+@app.post("/predict/batch")
+async def predict_batch(files: List[UploadFile] = File(...), type_plant: str = Form("plant", alias="type")):
+    """Chẩn đoán nhiều ảnh hoặc file zip, trả từng kết quả dạng NDJSON khi có"""
+    if type_plant not in diagnosis.backends:
+        raise HTTPException(status_code=400, detail="Type must be 'plant' or 'rice'")
+    try:
+        images = batch.collect_images(files)
+    except batch.BatchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def diagnose_one(image):
+        return await diagnosis.diagnose(type_plant, image)
+
+    async def stream():
+        rows = []
+        async for index, filename, result, error in batch.run_batch(images, diagnose_one):
+            if error is not None:
+                yield batch.ndjson_line({"index": index, "filename": filename, "success": False, "message": str(error)})
+                continue
+
+            pred = diagnosis.best_prediction(type_plant, result)
+            if pred is None:
+                yield batch.ndjson_line({"index": index, "filename": filename, "success": False, "message": "No disease detected"})
+                continue
+
+            rows.append((index, (pred['class'], pred['confidence'], type_plant)))
+            line = {
+                "index": index,
+                "filename": filename,
+                "success": True,
+                "disease": pred['class'],
+                "confidence": pred['confidence'],
+                "type": type_plant
+            }
+            if type_plant == "rice":
+                line["disease_vietnamese"] = format_rice_disease(pred['class'])
+            yield batch.ndjson_line(line)
+
+        # Ghi toàn bộ kết quả trong một transaction khi batch kết thúc
+        diagnosis_ids = await asyncio.to_thread(save_diagnoses, [row for _, row in rows])
+        yield batch.ndjson_line({
+            "done": True,
+            "total": len(images),
+            "successful": len(rows),
+            "diagnosis_ids": [
+                {"index": index, "diagnosis_id": diagnosis_id}
+                for (index, _), diagnosis_id in zip(rows, diagnosis_ids)
+            ],
+            "timestamp": datetime.now().isoformat()
+        })
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
 
 @app.get("/diagnoses", response_model=List[DiagnosisResponse])
-async def get_diagnoses(limit: int = 50):
-    """Lấy lịch sử chẩn đoán"""
-    conn = sqlite3.connect('plants.db')
-    cursor = conn.cursor()
-    cursor.execute('''
+def get_diagnoses(
+    limit: int = Query(50, ge=1, le=jsonrows.LIST_MAX_LIMIT),
+    type_plant: Optional[str] = Query(None, alias="type"),
+    disease: Optional[str] = None,
+    min_confidence: Optional[float] = None,
+    max_confidence: Optional[float] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None
+):
+    """Lấy lịch sử chẩn đoán, phân trang bằng cursor (header X-Next-Cursor)"""
+    try:
+        where, params = diagnosis_filters(
+            prefix='d.', type_plant=type_plant, disease=disease,
+            min_confidence=min_confidence, max_confidence=max_confidence,
+            since=sqlite_time(since), until=sqlite_time(until), cursor=cursor
+        )
+    except CursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Header phải gửi trước body: dòng cuối trang (và dòng kế tiếp, nếu có) được
+    # đọc trước bằng index (timestamp, id), cùng snapshot với truy vấn chính
+    probe = (f'''
+        SELECT d.timestamp, d.id
+        FROM diagnoses d
+        {where}
+        ORDER BY d.timestamp DESC, d.id DESC
+        LIMIT 2 OFFSET ?
+    ''', params + [limit - 1])
+    # Đọc dần theo khối, connection được giữ đến khi stream xong
+    diagnoses = db_pool.stream(f'''
         SELECT d.id, p.name, d.disease, d.confidence, d.timestamp
         FROM diagnoses d
         LEFT JOIN plants p ON d.plant_id = p.id
-        ORDER BY d.timestamp DESC
+        {where}
+        ORDER BY d.timestamp DESC, d.id DESC
         LIMIT ?
-    ''', (limit,))
-    
-    diagnoses = cursor.fetchall()
-    conn.close()
-    
-    return [
-        DiagnosisResponse(
-            id=diag[0],
-            plant_name=diag[1],
-            disease=diag[2],
-            confidence=diag[3],
-            timestamp=diag[4]
+    ''', params + [limit], batch_size=jsonrows.JSON_STREAM_CHUNK_ROWS, probe=probe)
+
+    # Chỉ trả cursor khi còn trang sau
+    cursor = encode_cursor(*diagnoses.probe[0]) if len(diagnoses.probe) == 2 else None
+    headers = {"X-Next-Cursor": cursor} if cursor is not None else None
+
+    # Encode thẳng từ tuple, danh sách lớn được stream theo khối
+    return jsonrows.list_response(
+        DIAGNOSIS_ENCODER, diagnoses, stream=limit > jsonrows.JSON_STREAM_THRESHOLD, headers=headers
+    )
+
+# Cột của /diagnoses/export (tên, kiểu)
+EXPORT_COLUMNS = [
+    ('id', 'int'), ('timestamp', 'datetime'), ('type', 'str'), ('disease', 'str'),
+    ('confidence', 'float'), ('plant_name', 'str')
+]
+
+@app.get("/diagnoses/export")
+def export_diagnoses(
+    export_format: str = Query("csv", alias="format"),
+    type_plant: Optional[str] = Query(None, alias="type"),
+    disease: Optional[str] = None,
+    min_confidence: Optional[float] = None,
+    max_confidence: Optional[float] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+):
+    """Xuất lịch sử chẩn đoán ra CSV / Parquet (format=csv|parquet)
+
+    Bộ lọc được đưa vào câu SQL; dữ liệu được đọc và gửi theo từng khối
+    EXPORT_BATCH_ROWS dòng nên bộ nhớ không tăng theo số dòng.
+    """
+    try:
+        export.check_format(export_format)
+        export.acquire_slot()
+    except export.ExportBusy as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except export.ExportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    where, params = diagnosis_filters(
+        prefix='d.', type_plant=type_plant, disease=disease,
+        min_confidence=min_confidence, max_confidence=max_confidence,
+        since=sqlite_time(since), until=sqlite_time(until)
+    )
+    # Connection riêng ngoài pool, đọc từng khối bằng keyset (transaction đọc ngắn)
+    try:
+        rows = db_pool.keyset_batches(
+            '''
+            SELECT d.id, d.timestamp, d.type, d.disease, d.confidence, p.name
+            FROM diagnoses d
+            LEFT JOIN plants p ON d.plant_id = p.id
+            ''',
+            where, params, key=('d.timestamp', 'd.id'), key_indexes=(1, 0), batch_size=export.EXPORT_BATCH_ROWS
         )
-        for diag in diagnoses
-    ]
+    except Exception:
+        export.release_slot()
+        raise
+
+    def release():
+        try:
+            rows.close()
+        finally:
+            export.release_slot()
+
+    return export.export_response(export_format, EXPORT_COLUMNS, rows.batches(), release=release)
+
+@app.get("/backends")
+async def get_backends():
+    """Backend chẩn đoán đang dùng cho từng loại"""
+    return diagnosis.backend_info()
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """Thống kê cache dự đoán"""
+    return diagnosis.cache_stats()
+
+# Các thống kê sẵn có được xuất thêm thành gauge plant_api_stats
+metrics.register_stats("cache", diagnosis.cache_stats)
+metrics.register_stats("backends", diagnosis.backend_info)
+metrics.register_stats("plant_catalog", plant_catalog.stats)
+metrics.register_stats("db_pool", db_pool.stats)
+if diagnosis_writer is not None:
+    metrics.register_stats("write_behind", diagnosis_writer.stats)
+
+@app.get("/metrics")
+def get_metrics():
+    """Metrics dạng Prometheus"""
+    body, content_type = metrics.render_latest()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/plants/cache/stats")
+def get_plant_catalog_stats():
+    """Thống kê cache danh mục cây trồng"""
+    return plant_catalog.stats()
+
+@app.get("/db/stats")
+def get_db_stats():
+    """Thống kê connection pool và hàng đợi ghi"""
+    return {
+        "pool": db_pool.stats(),
+        "write_behind": diagnosis_writer.stats() if diagnosis_writer is not None else None
+    }
 
 @app.get("/stats")
-async def get_stats():
+def get_stats():
     """Thống kê hệ thống"""
-    conn = sqlite3.connect('plants.db')
-    cursor = conn.cursor()
-    
-    # Total plants
-    cursor.execute('SELECT COUNT(*) FROM plants')
-    total_plants = cursor.fetchone()[0]
-    
-    # Total diagnoses
-    cursor.execute('SELECT COUNT(*) FROM diagnoses')
-    total_diagnoses = cursor.fetchone()[0]
-    
-    # Diagnoses by type
-    cursor.execute('SELECT type, COUNT(*) FROM diagnoses GROUP BY type')
-    by_type = dict(cursor.fetchall())
-    
-    conn.close()
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+        
+        # Total plants
+        cursor.execute('SELECT COUNT(*) FROM plants')
+        total_plants = cursor.fetchone()[0]
+        
+        # Diagnoses: đọc từ bảng thống kê thay vì quét bảng diagnoses
+        stats = diagnosis_stats.read(conn)
     
     return {
         "total_plants": total_plants,
-        "total_diagnoses": total_diagnoses,
-        "diagnoses_by_type": by_type
+        "total_diagnoses": stats["total"],
+        "diagnoses_by_type": stats["by_type"]
     }
 
+@app.get("/stats/check")
+def check_stats():
+    """Kiểm tra bảng thống kê có khớp với bảng diagnoses không"""
+    if diagnosis_writer is not None:
+        diagnosis_writer.flush()
+    with db_pool.connection() as conn:
+        return diagnosis_stats.check(conn)
+
+@app.post("/stats/rebuild")
+def rebuild_stats():
+    """Tính lại bảng thống kê từ bảng diagnoses"""
+    if diagnosis_writer is not None:
+        diagnosis_writer.flush()
+    with db_pool.connection() as conn:
+        result = diagnosis_stats.rebuild(conn)
+        result["rollups"] = diagnosis_rollups.rebuild(conn)
+        return result
+
+@app.get("/stats/timeseries")
+def get_timeseries(
+    granularity: str = "hour",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    type_plant: Optional[str] = Query(None, alias="type"),
+    disease: Optional[str] = None
+):
+    """Số chẩn đoán và confidence trung bình theo giờ / ngày, đọc từ bảng rollup"""
+    with db_pool.connection() as conn:
+        diagnosis_rollups.maybe_prune(conn)
+        try:
+            series = diagnosis_rollups.query(
+                conn, granularity=granularity, since=since, until=until,
+                type_plant=type_plant, disease=disease
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return {"granularity": granularity, "series": series}
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
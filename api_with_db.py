@@ -1,14 +1,34 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, Form, Query, Response, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-import requests
+from fastapi.responses import StreamingResponse
 from PIL import Image
 import io
 import os
 from datetime import datetime
-import sqlite3
 import json
+from typing import List, Optional
+import asyncio
+import batch
+import diagnosis
+import export
+import jsonrows
+import metrics
+import tracing
+import uploads
+from aggregates import DiagnosisRollups, DiagnosisStats
+from db import SQLitePool
+from pagination import CursorError, diagnosis_filters, encode_cursor, sqlite_time
+from write_behind import DIAGNOSIS_WRITE_BEHIND, WriteBehindWriter, sqlite_timestamp
+from starlette.concurrency import run_in_threadpool
 
-app = FastAPI(title="Plant Disease Detection API with Database", version="1.0.0")
+app = FastAPI(title="Plant Disease Detection API with Database", version="1.0.0", default_response_class=metrics.TimedJSONResponse)
+
+# Giới hạn kích thước upload trước khi parse multipart
+app.add_middleware(uploads.BodySizeLimitMiddleware)
+# Thời gian, số request đang chạy theo route cho /metrics
+app.add_middleware(metrics.MetricsMiddleware, router=app.router)
+# Header Server-Timing cho /predict/* và trace lấy mẫu (TRACE_SAMPLE_RATE)
+app.add_middleware(tracing.TracingMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,49 +39,84 @@ app.add_middleware(
 )
 
 # Database setup
+DATABASE_PATH = os.getenv("DATABASE_PATH", "diagnoses.db")
+db_pool = SQLitePool(DATABASE_PATH)
+diagnosis_stats = DiagnosisStats(label_column='disease_vietnamese')
+# Nhãn rollup là tên bệnh gốc, dùng lại được làm bộ lọc disease của /history
+diagnosis_rollups = DiagnosisRollups(label_column='disease')
+
 def init_db():
-    conn = sqlite3.connect('diagnoses.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS diagnoses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            type TEXT NOT NULL,
-            disease TEXT,
-            disease_vietnamese TEXT,
-            confidence REAL,
-            success BOOLEAN,
-            raw_result TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS diagnoses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                type TEXT NOT NULL,
+                disease TEXT,
+                disease_vietnamese TEXT,
+                confidence REAL,
+                success BOOLEAN,
+                raw_result TEXT
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_diagnoses_timestamp ON diagnoses (timestamp, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_diagnoses_type ON diagnoses (type, timestamp, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_diagnoses_disease ON diagnoses (disease, timestamp, id)')
+        conn.commit()
+
+        # Bảng thống kê cập nhật bằng trigger cho /stats
+        diagnosis_stats.install(conn)
+        diagnosis_rollups.install(conn)
 
 init_db()
 
+# Ghi chẩn đoán theo lô ở thread nền, id được cấp trước để trả về ngay
+diagnosis_writer = None
+if DIAGNOSIS_WRITE_BEHIND:
+    diagnosis_writer = WriteBehindWriter(
+        db_pool, 'diagnoses',
+        ('type', 'disease', 'disease_vietnamese', 'confidence', 'success', 'raw_result', 'timestamp')
+    )
+
+@metrics.timed("db_write")
 def save_diagnosis(type_plant, disease, disease_vn, confidence, success, raw_result):
-    conn = sqlite3.connect('diagnoses.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO diagnoses (type, disease, disease_vietnamese, confidence, success, raw_result)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (type_plant, disease, disease_vn, confidence, success, json.dumps(raw_result)))
-    diagnosis_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    if diagnosis_writer is not None:
+        return diagnosis_writer.submit(
+            (type_plant, disease, disease_vn, confidence, success, json.dumps(raw_result), sqlite_timestamp())
+        )
+
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO diagnoses (type, disease, disease_vietnamese, confidence, success, raw_result)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (type_plant, disease, disease_vn, confidence, success, json.dumps(raw_result)))
+        diagnosis_id = cursor.lastrowid
+        conn.commit()
     return diagnosis_id
 
-def call_plant_api(image_bytes):
-    url = "https://detect.roboflow.com/plantvillage-dataset/1"
-    params = {"api_key": "y0YKSebPyue0doYszJEU"}
-    response = requests.post(url, params=params, files={"file": image_bytes})
-    return response.json()
+@metrics.timed("db_write")
+def save_diagnoses(rows):
+    """Lưu nhiều kết quả chẩn đoán trong một transaction"""
+    if diagnosis_writer is not None:
+        timestamp = sqlite_timestamp()
+        return diagnosis_writer.submit_many([
+            (type_plant, disease, disease_vn, confidence, success, json.dumps(raw_result), timestamp)
+            for type_plant, disease, disease_vn, confidence, success, raw_result in rows
+        ])
 
-def call_rice_api(image_bytes):
-    url = "https://detect.roboflow.com/rice-diseases-qzjka/3"
-    params = {"api_key": "y0YKSebPyue0doYszJEU"}
-    response = requests.post(url, params=params, files={"file": image_bytes})
-    return response.json()
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+        diagnosis_ids = []
+        for type_plant, disease, disease_vn, confidence, success, raw_result in rows:
+            cursor.execute('''
+                INSERT INTO diagnoses (type, disease, disease_vietnamese, confidence, success, raw_result)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (type_plant, disease, disease_vn, confidence, success, json.dumps(raw_result)))
+            diagnosis_ids.append(cursor.lastrowid)
+        conn.commit()
+    return diagnosis_ids
 
 def format_rice_disease(class_name):
     disease_map = {
@@ -78,6 +133,18 @@ def format_rice_disease(class_name):
     }
     return disease_map.get(class_name.lower(), class_name)
 
+@app.on_event("startup")
+async def startup():
+    await diagnosis.startup()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await diagnosis.shutdown()
+    tracing.trace_writer.close()
+    if diagnosis_writer is not None:
+        diagnosis_writer.close()
+    db_pool.close()
+
 @app.get("/")
 async def root():
     return {"message": "Plant Disease Detection API with Database", "version": "1.0.0"}
@@ -88,12 +155,12 @@ async def predict_plant_disease(file: UploadFile = File(...)):
         if not file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="File must be an image")
         
-        image_bytes = await file.read()
-        result = call_plant_api(image_bytes)
+        image = await uploads.read_upload(file)
+        result = await diagnosis.diagnose_plant(image)
         
         if 'predictions' in result and result['predictions']:
             pred = result['predictions'][0]
-            diagnosis_id = save_diagnosis("plant", pred['class'], pred['class'], pred['confidence'], True, result)
+            diagnosis_id = await run_in_threadpool(save_diagnosis, "plant", pred['class'], pred['class'], pred['confidence'], True, result)
             
             return {
                 "success": True,
@@ -104,15 +171,17 @@ async def predict_plant_disease(file: UploadFile = File(...)):
                 "timestamp": datetime.now().isoformat()
             }
         else:
-            diagnosis_id = save_diagnosis("plant", None, None, 0, False, result)
+            diagnosis_id = await run_in_threadpool(save_diagnosis, "plant", None, None, 0, False, result)
             return {
                 "success": False,
                 "diagnosis_id": diagnosis_id,
                 "message": "No disease detected"
             }
             
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=diagnosis.error_status(e), detail=str(e))
 
 @app.post("/predict/rice")
 async def predict_rice_disease(file: UploadFile = File(...)):
@@ -120,14 +189,14 @@ async def predict_rice_disease(file: UploadFile = File(...)):
         if not file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="File must be an image")
         
-        image_bytes = await file.read()
-        result = call_rice_api(image_bytes)
+        image = await uploads.read_upload(file)
+        result = await diagnosis.diagnose_rice(image)
         
         if 'predictions' in result and result['predictions']:
             best_pred = max(result['predictions'], key=lambda x: x['confidence'])
             disease_vn = format_rice_disease(best_pred['class'])
             
-            diagnosis_id = save_diagnosis("rice", best_pred['class'], disease_vn, best_pred['confidence'], True, result)
+            diagnosis_id = await run_in_threadpool(save_diagnosis, "rice", best_pred['class'], disease_vn, best_pred['confidence'], True, result)
             
             return {
                 "success": True,
@@ -139,84 +208,260 @@ async def predict_rice_disease(file: UploadFile = File(...)):
                 "timestamp": datetime.now().isoformat()
             }
         else:
-            diagnosis_id = save_diagnosis("rice", None, None, 0, False, result)
+            diagnosis_id = await run_in_threadpool(save_diagnosis, "rice", None, None, 0, False, result)
             return {
                 "success": False,
                 "diagnosis_id": diagnosis_id,
                 "message": "No rice disease detected"
             }
             
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=diagnosis.error_status(e), detail=str(e))
+
+@app.post("/predict/batch")
+async def predict_batch(files: List[UploadFile] = File(...), type_plant: str = Form("plant", alias="type")):
+    """Chẩn đoán nhiều ảnh hoặc file zip, trả từng kết quả dạng NDJSON khi có"""
+    if type_plant not in diagnosis.backends:
+        raise HTTPException(status_code=400, detail="Type must be 'plant' or 'rice'")
+    try:
+        images = batch.collect_images(files)
+    except batch.BatchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def diagnose_one(image):
+        return await diagnosis.diagnose(type_plant, image)
+
+    async def stream():
+        rows = []
+        async for index, filename, result, error in batch.run_batch(images, diagnose_one):
+            if error is not None:
+                yield batch.ndjson_line({"index": index, "filename": filename, "success": False, "message": str(error)})
+                continue
+
+            pred = diagnosis.best_prediction(type_plant, result)
+            if pred is None:
+                rows.append((index, (type_plant, None, None, 0, False, result)))
+                yield batch.ndjson_line({"index": index, "filename": filename, "success": False, "message": "No disease detected"})
+                continue
+
+            disease_vn = format_rice_disease(pred['class']) if type_plant == "rice" else pred['class']
+            rows.append((index, (type_plant, pred['class'], disease_vn, pred['confidence'], True, result)))
+            line = {
+                "index": index,
+                "filename": filename,
+                "success": True,
+                "disease": pred['class'],
+                "confidence": pred['confidence'],
+                "type": type_plant
+            }
+            if type_plant == "rice":
+                line["disease_vietnamese"] = disease_vn
+            yield batch.ndjson_line(line)
+
+        # Ghi toàn bộ kết quả trong một transaction khi batch kết thúc
+        diagnosis_ids = await asyncio.to_thread(save_diagnoses, [row for _, row in rows])
+        yield batch.ndjson_line({
+            "done": True,
+            "total": len(images),
+            "successful": sum(1 for _, row in rows if row[4]),
+            "diagnosis_ids": [
+                {"index": index, "diagnosis_id": diagnosis_id}
+                for (index, _), diagnosis_id in zip(rows, diagnosis_ids)
+            ],
+            "timestamp": datetime.now().isoformat()
+        })
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+# Dòng của truy vấn /history, encode thẳng thành JSON
+HISTORY_ENCODER = jsonrows.RowEncoder([
+    ('id', 'int'), ('timestamp', 'datetime'), ('type', 'str'), ('disease', 'str'),
+    ('disease_vietnamese', 'str'), ('confidence', 'float'), ('success', 'bool')
+])
+
+def history_response(rows, limit):
+    """{"history": [...], "total": n, "next_cursor": ...}, stream khi limit lớn"""
+    def suffix(count, last):
+        cursor = encode_cursor(last[1], last[0]) if count == limit else None
+        return jsonrows.encode_fields(total=count, next_cursor=cursor)
+    return jsonrows.list_response(
+        HISTORY_ENCODER, rows, stream=limit > jsonrows.JSON_STREAM_THRESHOLD,
+        prefix='{"history":', suffix=suffix
+    )
 
 @app.get("/history")
-async def get_diagnosis_history(limit: int = 50):
-    """Lấy lịch sử chẩn đoán"""
-    conn = sqlite3.connect('diagnoses.db')
-    cursor = conn.cursor()
-    cursor.execute('''
+def get_diagnosis_history(
+    limit: int = Query(50, ge=1, le=jsonrows.LIST_MAX_LIMIT),
+    type_plant: Optional[str] = Query(None, alias="type"),
+    disease: Optional[str] = None,
+    min_confidence: Optional[float] = None,
+    max_confidence: Optional[float] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None
+):
+    """Lấy lịch sử chẩn đoán, trang tiếp theo lấy bằng next_cursor"""
+    try:
+        where, params = diagnosis_filters(
+            type_plant=type_plant, disease=disease,
+            min_confidence=min_confidence, max_confidence=max_confidence,
+            since=sqlite_time(since), until=sqlite_time(until), cursor=cursor
+        )
+    except CursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Đọc dần theo khối, connection được giữ đến khi stream xong
+    rows = db_pool.stream(f'''
         SELECT id, timestamp, type, disease, disease_vietnamese, confidence, success
         FROM diagnoses 
-        ORDER BY timestamp DESC 
+        {where}
+        ORDER BY timestamp DESC, id DESC 
         LIMIT ?
-    ''', (limit,))
-    
-    results = cursor.fetchall()
-    conn.close()
-    
-    history = []
-    for row in results:
-        history.append({
-            "id": row[0],
-            "timestamp": row[1],
-            "type": row[2],
-            "disease": row[3],
-            "disease_vietnamese": row[4],
-            "confidence": row[5],
-            "success": bool(row[6])
-        })
-    
-    return {"history": history, "total": len(history)}
+    ''', params + [limit], batch_size=jsonrows.JSON_STREAM_CHUNK_ROWS)
+    return history_response(rows, limit)
+
+# Cột của /diagnoses/export (tên, kiểu)
+EXPORT_COLUMNS = [
+    ('id', 'int'), ('timestamp', 'datetime'), ('type', 'str'), ('disease', 'str'),
+    ('disease_vietnamese', 'str'), ('confidence', 'float'), ('success', 'bool')
+]
+
+@app.get("/diagnoses/export")
+def export_diagnoses(
+    export_format: str = Query("csv", alias="format"),
+    type_plant: Optional[str] = Query(None, alias="type"),
+    disease: Optional[str] = None,
+    min_confidence: Optional[float] = None,
+    max_confidence: Optional[float] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+):
+    """Xuất lịch sử chẩn đoán ra CSV / Parquet (format=csv|parquet)
+
+    Bộ lọc được đưa vào câu SQL; dữ liệu được đọc và gửi theo từng khối
+    EXPORT_BATCH_ROWS dòng nên bộ nhớ không tăng theo số dòng.
+    """
+    try:
+        export.check_format(export_format)
+        export.acquire_slot()
+    except export.ExportBusy as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except export.ExportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    where, params = diagnosis_filters(
+        type_plant=type_plant, disease=disease,
+        min_confidence=min_confidence, max_confidence=max_confidence,
+        since=sqlite_time(since), until=sqlite_time(until)
+    )
+    # Connection riêng ngoài pool, đọc từng khối bằng keyset (transaction đọc ngắn)
+    try:
+        rows = db_pool.keyset_batches(
+            '''
+            SELECT id, timestamp, type, disease, disease_vietnamese, confidence, success
+            FROM diagnoses
+            ''',
+            where, params, key=('timestamp', 'id'), key_indexes=(1, 0), batch_size=export.EXPORT_BATCH_ROWS
+        )
+    except Exception:
+        export.release_slot()
+        raise
+
+    def release():
+        try:
+            rows.close()
+        finally:
+            export.release_slot()
+
+    return export.export_response(export_format, EXPORT_COLUMNS, rows.batches(), release=release)
+
+@app.get("/backends")
+async def get_backends():
+    """Backend chẩn đoán đang dùng cho từng loại"""
+    return diagnosis.backend_info()
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """Thống kê cache dự đoán"""
+    return diagnosis.cache_stats()
+
+# Các thống kê sẵn có được xuất thêm thành gauge plant_api_stats
+metrics.register_stats("cache", diagnosis.cache_stats)
+metrics.register_stats("backends", diagnosis.backend_info)
+metrics.register_stats("db_pool", db_pool.stats)
+if diagnosis_writer is not None:
+    metrics.register_stats("write_behind", diagnosis_writer.stats)
+
+@app.get("/metrics")
+def get_metrics():
+    """Metrics dạng Prometheus"""
+    body, content_type = metrics.render_latest()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/db/stats")
+def get_db_stats():
+    """Thống kê connection pool và hàng đợi ghi"""
+    return {
+        "pool": db_pool.stats(),
+        "write_behind": diagnosis_writer.stats() if diagnosis_writer is not None else None
+    }
 
 @app.get("/stats")
-async def get_stats():
+def get_stats():
     """Thống kê chẩn đoán"""
-    conn = sqlite3.connect('diagnoses.db')
-    cursor = conn.cursor()
-    
-    # Tổng số chẩn đoán
-    cursor.execute('SELECT COUNT(*) FROM diagnoses')
-    total = cursor.fetchone()[0]
-    
-    # Thành công
-    cursor.execute('SELECT COUNT(*) FROM diagnoses WHERE success = 1')
-    successful = cursor.fetchone()[0]
-    
-    # Theo loại
-    cursor.execute('SELECT type, COUNT(*) FROM diagnoses GROUP BY type')
-    by_type = dict(cursor.fetchall())
-    
-    # Top bệnh
-    cursor.execute('''
-        SELECT disease_vietnamese, COUNT(*) as count 
-        FROM diagnoses 
-        WHERE success = 1 AND disease_vietnamese IS NOT NULL
-        GROUP BY disease_vietnamese 
-        ORDER BY count DESC 
-        LIMIT 10
-    ''')
-    top_diseases = [{"disease": row[0], "count": row[1]} for row in cursor.fetchall()]
-    
-    conn.close()
-    
+    with db_pool.connection() as conn:
+        stats = diagnosis_stats.read(conn, top=10)
+
+    total = stats["total"]
+    successful = stats["successful"]
     return {
         "total_diagnoses": total,
         "successful_diagnoses": successful,
         "success_rate": successful/total if total > 0 else 0,
-        "by_type": by_type,
-        "top_diseases": top_diseases
+        "by_type": stats["by_type"],
+        "top_diseases": stats["top_diseases"]
     }
 
+@app.get("/stats/check")
+def check_stats():
+    """Kiểm tra bảng thống kê có khớp với bảng diagnoses không"""
+    if diagnosis_writer is not None:
+        diagnosis_writer.flush()
+    with db_pool.connection() as conn:
+        return diagnosis_stats.check(conn)
+
+@app.post("/stats/rebuild")
+def rebuild_stats():
+    """Tính lại bảng thống kê từ bảng diagnoses"""
+    if diagnosis_writer is not None:
+        diagnosis_writer.flush()
+    with db_pool.connection() as conn:
+        result = diagnosis_stats.rebuild(conn)
+        result["rollups"] = diagnosis_rollups.rebuild(conn)
+        return result
+
+@app.get("/stats/timeseries")
+def get_timeseries(
+    granularity: str = "hour",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    type_plant: Optional[str] = Query(None, alias="type"),
+    disease: Optional[str] = None
+):
+    """Số chẩn đoán và confidence trung bình theo giờ / ngày, đọc từ bảng rollup"""
+    with db_pool.connection() as conn:
+        diagnosis_rollups.maybe_prune(conn)
+        try:
+            series = diagnosis_rollups.query(
+                conn, granularity=granularity, since=since, until=until,
+                type_plant=type_plant, disease=disease
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return {"granularity": granularity, "series": series}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,359 @@
+import asyncio
+import io
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from microbatch import MICROBATCH_MAX_SIZE, MICROBATCH_WINDOW_MS, MicroBatcher
+from preupload import UPSTREAM_JPEG_QUALITY, UPSTREAM_MAX_SIDE, downscale_image
+from resilience import ResilientCaller
+from upstream import PLANT_MODEL, RICE_MODEL, client as upstream_client
+
+# Số thread chạy inference cho model cục bộ
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", 2))
+INFERENCE_TOP_K = int(os.getenv("INFERENCE_TOP_K", 5))
+# Số thread của mỗi interpreter TFLite; chạy nhiều worker thì để 1
+TFLITE_THREADS = int(os.getenv("TFLITE_THREADS", 1))
+# Giữ trọng số trong file mmap dùng chung giữa các process (tắt XNNPACK)
+TFLITE_SHARE_WEIGHTS = os.getenv("TFLITE_SHARE_WEIGHTS", "1") == "1"
+
+ROBOFLOW_MODELS = {"plant": PLANT_MODEL, "rice": RICE_MODEL}
+DEFAULT_MODEL_PATHS = {"plant": "plant_disease_model.h5", "rice": "rice_disease_model.h5"}
+
+
+class InferenceBackend:
+    """Giao diện chung cho các backend chẩn đoán
+
+    predict() trả về JSON cùng dạng với Roboflow: {"predictions": [{"class", "confidence"}, ...]}.
+    model_id dùng làm khóa cache nên phải khác nhau giữa các model.
+    """
+
+    name = None
+    model_id = None
+
+    async def startup(self):
+        pass
+
+    async def predict(self, image_bytes):
+        raise NotImplementedError
+
+    async def shutdown(self):
+        pass
+
+    def info(self):
+        return {"backend": self.name, "model_id": self.model_id}
+
+
+class RoboflowBackend(InferenceBackend):
+    """Gọi model hosted trên Roboflow, có thể thu nhỏ ảnh trước khi gửi (max_side > 0)
+
+    Mỗi lần gọi có deadline, hedge và circuit breaker (resilience.ResilientCaller).
+    Khi Roboflow lỗi hoặc breaker đang mở, dùng fallback (model local) nếu có.
+    """
+
+    name = "roboflow"
+
+    def __init__(self, model_id, client=upstream_client, max_side=UPSTREAM_MAX_SIDE,
+                 quality=UPSTREAM_JPEG_QUALITY, caller=None, fallback=None):
+        self.model_id = model_id
+        self.client = client
+        self.max_side = max_side
+        self.quality = quality
+        self.caller = caller if caller is not None else ResilientCaller(
+            on_error=lambda kind: metrics.upstream_error(model_id, kind),
+            limiter=client.semaphore
+        )
+        self.fallback = fallback
+        self.fallbacks = 0
+
+    async def startup(self):
+        if self.fallback is not None:
+            await self.fallback.startup()
+
+    async def predict(self, image_bytes):
+        if self.max_side > 0:
+            with metrics.stage("downscale", model=self.model_id):
+                image_bytes = await asyncio.to_thread(downscale_image, image_bytes, self.max_side, self.quality)
+        try:
+            # Caller giữ semaphore của client (limiter) thì gọi post() để không giữ hai lần
+            send = self.client.post if self.caller.limiter is self.client.semaphore else self.client.predict
+            return await self.caller.call(send, self.model_id, image_bytes, self.caller.attempt_timeout)
+        except Exception:
+            if self.fallback is None:
+                raise
+        self.fallbacks += 1
+        result = await self.fallback.predict(image_bytes)
+        # Đánh dấu để không cache kết quả fallback dưới model_id của Roboflow
+        return dict(result, fallback=self.fallback.model_id)
+
+    async def shutdown(self):
+        await self.client.aclose()
+        if self.fallback is not None:
+            await self.fallback.shutdown()
+
+    def info(self):
+        info = super().info()
+        info.update({
+            "max_side": self.max_side,
+            "jpeg_quality": self.quality,
+            "resilience": self.caller.stats(),
+            "fallback": self.fallback.info() if self.fallback is not None else None,
+            "fallbacks": self.fallbacks
+        })
+        return info
+
+
+class KerasBackend(InferenceBackend):
+    """Chạy model Keras cục bộ (model.PlantDiseaseModel hoặc KaggleInspiredPlantModel)
+
+    Model được load một lần lúc khởi động, inference chạy trong thread pool
+    để không chặn event loop. Các request đồng thời được gom thành batch
+    (MicroBatcher) trừ khi max_batch_size <= 1.
+    """
+
+    name = "keras"
+
+    def __init__(self, model_path, architecture="cnn", class_names=None,
+                 workers=INFERENCE_WORKERS, top_k=INFERENCE_TOP_K,
+                 max_batch_size=MICROBATCH_MAX_SIZE, window_ms=MICROBATCH_WINDOW_MS):
+        self.model_path = model_path
+        self.architecture = architecture
+        self.class_names = class_names
+        self.workers = workers
+        self.top_k = top_k
+        self.model_id = f"local/{os.path.basename(model_path)}"
+        self.plant_model = None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        self.batcher = None
+        if max_batch_size > 1:
+            self.batcher = MicroBatcher(self.predict_many, self._executor,
+                                        max_batch_size=max_batch_size, window_ms=window_ms,
+                                        workers=workers)
+
+    def load(self):
+        # Import lười: chỉ cần TensorFlow khi dùng backend cục bộ
+        from model import PlantDiseaseModel
+
+        plant_model = PlantDiseaseModel()
+        if self.architecture == "kaggle":
+            from model_kaggle_inspired import KaggleInspiredPlantModel
+            kaggle_model = KaggleInspiredPlantModel()
+            plant_model.model = kaggle_model.load_model(self.model_path)
+        else:
+            plant_model.load_model(self.model_path)
+        if self.class_names:
+            plant_model.class_names = self.class_names
+            plant_model.num_classes = len(self.class_names)
+        check_class_count(self.model_path, plant_model.model.output_shape[-1], plant_model.class_names)
+        self.plant_model = plant_model
+
+    async def startup(self):
+        if self.plant_model is None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self.load)
+        if self.batcher is not None:
+            self.batcher.start()
+
+    def predict_sync(self, image_bytes):
+        images = self.plant_model.preprocess_bytes(image_bytes)
+        return {"predictions": self.plant_model.predict_batch(images, self.top_k)[0]}
+
+    def predict_many(self, images):
+        """Một forward pass cho nhiều ảnh đã tiền xử lý (mỗi ảnh shape (1, H, W, 3))"""
+        import numpy as np
+        return self.plant_model.predict_batch(np.concatenate(images, axis=0), self.top_k)
+
+    async def predict(self, image_bytes):
+        if self.plant_model is None:
+            raise RuntimeError("Model chưa được load")
+        loop = asyncio.get_running_loop()
+        if self.batcher is None:
+            return await loop.run_in_executor(self._executor, self.predict_sync, image_bytes)
+
+        images = await loop.run_in_executor(self._executor, self.plant_model.preprocess_bytes, image_bytes)
+        return {"predictions": await self.batcher.submit(images)}
+
+    async def shutdown(self):
+        if self.batcher is not None:
+            await self.batcher.stop()
+        self._executor.shutdown(wait=False)
+
+    def info(self):
+        info = super().info()
+        info.update({"model_path": self.model_path, "architecture": self.architecture, "workers": self.workers})
+        if self.batcher is not None:
+            info["microbatch"] = self.batcher.stats()
+        return info
+
+
+class TFLiteBackend(InferenceBackend):
+    """Chạy model đã export sang TFLite (export_tflite.py)
+
+    Interpreter đọc trọng số trực tiếp từ file .tflite được mmap, nên nhiều
+    worker (serve.py) cùng dùng một bản trọng số trong page cache thay vì mỗi
+    process giữ một bản Keras riêng. XNNPACK đóng gói lại trọng số vào bộ nhớ
+    riêng của từng process, vì vậy mặc định tắt (TFLITE_SHARE_WEIGHTS=1).
+    Interpreter không thread-safe: mỗi thread inference có một interpreter.
+    """
+
+    name = "tflite"
+
+    def __init__(self, model_path, class_names=None, workers=INFERENCE_WORKERS, top_k=INFERENCE_TOP_K,
+                 threads=TFLITE_THREADS, share_weights=TFLITE_SHARE_WEIGHTS):
+        self.model_path = model_path
+        self.class_names = class_names
+        self.workers = workers
+        self.top_k = top_k
+        self.threads = threads
+        self.share_weights = share_weights
+        self.model_id = f"local/{os.path.basename(model_path)}"
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+
+    def _interpreter(self):
+        interpreter = getattr(self._local, "interpreter", None)
+        if interpreter is None:
+            try:
+                from tflite_runtime.interpreter import Interpreter, OpResolverType
+            except ImportError:
+                import tensorflow as tf
+                Interpreter, OpResolverType = tf.lite.Interpreter, tf.lite.experimental.OpResolverType
+
+            resolver = OpResolverType.AUTO
+            if self.share_weights:
+                resolver = OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+            interpreter = Interpreter(model_path=self.model_path, num_threads=self.threads,
+                                      experimental_op_resolver_type=resolver)
+            interpreter.allocate_tensors()
+            self._local.interpreter = interpreter
+        return interpreter
+
+    def load(self):
+        if self.class_names is None:
+            self.class_names = _load_class_names(tflite_class_names_path(self.model_path))
+        interpreter = self._interpreter()
+        check_class_count(self.model_path, interpreter.get_output_details()[0]["shape"][-1], self.class_names)
+
+    async def startup(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self.load)
+
+    def predict_sync(self, image_bytes):
+        import numpy as np
+        from PIL import Image
+
+        interpreter = self._interpreter()
+        input_detail = interpreter.get_input_details()[0]
+        _, height, width, _ = input_detail["shape"]
+        image = Image.open(io.BytesIO(image_bytes))
+        image.draft('RGB', (width, height))
+        image = image.convert('RGB').resize((width, height))
+        images = np.expand_dims(np.asarray(image, dtype='float32') / 255.0, axis=0)
+
+        interpreter.set_tensor(input_detail["index"], images.astype(input_detail["dtype"]))
+        interpreter.invoke()
+        probs = interpreter.get_tensor(interpreter.get_output_details()[0]["index"])[0]
+        top = np.argsort(probs)[::-1][:self.top_k]
+        return {"predictions": [
+            {"class": self.class_names[i], "confidence": float(probs[i])} for i in top
+        ]}
+
+    async def predict(self, image_bytes):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.predict_sync, image_bytes)
+
+    async def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def info(self):
+        info = super().info()
+        info.update({
+            "model_path": self.model_path,
+            "workers": self.workers,
+            "threads": self.threads,
+            "share_weights": self.share_weights
+        })
+        return info
+
+
+def check_class_count(model_path, outputs, class_names):
+    """Dừng lúc khởi động nếu số tên lớp không khớp số đầu ra của model"""
+    if class_names is None or int(outputs) != len(class_names):
+        count = "no" if class_names is None else len(class_names)
+        raise ValueError(f"{model_path} has {int(outputs)} outputs but {count} class names were given")
+
+
+def tflite_class_names_path(model_path):
+    """File tên lớp đi kèm model .tflite, do export_tflite.py ghi ra"""
+    return os.path.splitext(model_path)[0] + ".classes.json"
+
+
+def _load_class_names(path):
+    if not path:
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith('.json'):
+            return json.load(f)
+        return [line.strip() for line in f if line.strip()]
+
+
+def default_tflite_path(type_plant):
+    return os.path.splitext(DEFAULT_MODEL_PATHS[type_plant])[0] + ".tflite"
+
+
+def shared_model_paths():
+    """File model TFLite các worker sẽ mmap, để serve.py nạp trước vào page cache"""
+    paths = []
+    for type_plant in ROBOFLOW_MODELS:
+        prefix = type_plant.upper()
+        if os.getenv(f"{prefix}_BACKEND", "roboflow") == "tflite":
+            paths.append(os.getenv(f"{prefix}_MODEL_PATH", default_tflite_path(type_plant)))
+    return paths
+
+
+def _class_names(type_plant):
+    """Tên lớp từ {TYPE}_CLASS_NAMES (file .json hoặc mỗi dòng một tên)
+
+    Model cây trồng mặc định dùng 38 lớp PlantVillage của model.py; các loại
+    khác (lúa) bắt buộc phải có, nếu không chỉ số đầu ra sẽ bị gán nhầm tên
+    lớp PlantVillage.
+    """
+    prefix = type_plant.upper()
+    class_names = _load_class_names(os.getenv(f"{prefix}_CLASS_NAMES"))
+    if class_names is None and type_plant != "plant":
+        raise ValueError(f"{prefix}_CLASS_NAMES is required for a local {type_plant} model")
+    return class_names
+
+
+def create_backend(type_plant):
+    """Tạo backend cho loại chẩn đoán theo biến môi trường, vd PLANT_BACKEND=keras hoặc tflite"""
+    prefix = type_plant.upper()
+    kind = os.getenv(f"{prefix}_BACKEND", "roboflow")
+    if kind == "roboflow":
+        # Model local dùng khi Roboflow lỗi, vd PLANT_FALLBACK_MODEL_PATH=plant_disease_model.h5
+        fallback = None
+        fallback_path = os.getenv(f"{prefix}_FALLBACK_MODEL_PATH")
+        if fallback_path:
+            fallback = KerasBackend(
+                fallback_path,
+                architecture=os.getenv(f"{prefix}_MODEL_ARCH", "cnn"),
+                class_names=_class_names(type_plant)
+            )
+        return RoboflowBackend(
+            os.getenv(f"{prefix}_ROBOFLOW_MODEL", ROBOFLOW_MODELS[type_plant]),
+            fallback=fallback
+        )
+    if kind == "keras":
+        return KerasBackend(
+            os.getenv(f"{prefix}_MODEL_PATH", DEFAULT_MODEL_PATHS[type_plant]),
+            architecture=os.getenv(f"{prefix}_MODEL_ARCH", "cnn"),
+            class_names=_class_names(type_plant)
+        )
+    if kind == "tflite":
+        return TFLiteBackend(
+            os.getenv(f"{prefix}_MODEL_PATH", default_tflite_path(type_plant)),
+            class_names=_load_class_names(os.getenv(f"{prefix}_CLASS_NAMES"))
+        )
+    raise ValueError(f"Unknown inference backend for {type_plant}: {kind}")
@@ -0,0 +1,108 @@
+import asyncio
+import json
+import os
+import zipfile
+
+import uploads
+
+# Số ảnh chẩn đoán song song trong một batch
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 16))
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", 500))
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp', '.tif', '.tiff')
+ZIP_CONTENT_TYPES = ('application/zip', 'application/x-zip-compressed')
+
+
+class BatchError(ValueError):
+    pass
+
+
+def _is_zip(upload):
+    if upload.content_type in ZIP_CONTENT_TYPES or (upload.filename or '').lower().endswith('.zip'):
+        return True
+    return False
+
+
+def _upload_loader(upload):
+    def load():
+        return uploads.prepare_file(upload.file, filename=upload.filename)
+    return load
+
+
+def _zip_loader(archive, info):
+    def load():
+        # Kiểm tra kích thước khai báo trước, rồi vẫn đếm khi giải nén (zip bomb)
+        if info.file_size > uploads.UPLOAD_MAX_BYTES:
+            raise uploads.UploadTooLarge(uploads.UPLOAD_MAX_BYTES)
+        with archive.open(info) as member:
+            image = uploads.spool_stream(member, filename=info.filename)
+        try:
+            return image.inspect()
+        except Exception:
+            image.close()
+            raise
+    return load
+
+
+def collect_images(uploads):
+    """Trả về danh sách (tên file, loader); ảnh chỉ được đọc khi tới lượt xử lý
+
+    loader trả về uploads.UploadedImage (đã hash, nội dung nằm trong file tạm).
+    """
+    images = []
+    for upload in uploads:
+        if _is_zip(upload):
+            try:
+                archive = zipfile.ZipFile(upload.file)
+            except zipfile.BadZipFile:
+                raise BatchError(f"Invalid zip file: {upload.filename}")
+            for info in archive.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                images.append((info.filename, _zip_loader(archive, info)))
+        elif upload.content_type and upload.content_type.startswith('image/'):
+            images.append((upload.filename, _upload_loader(upload)))
+        else:
+            raise BatchError(f"File must be an image or zip: {upload.filename}")
+
+    if not images:
+        raise BatchError("No images in batch")
+    if len(images) > BATCH_MAX_IMAGES:
+        raise BatchError(f"Batch exceeds {BATCH_MAX_IMAGES} images")
+    return images
+
+
+async def run_batch(images, diagnose_fn, concurrency=BATCH_CONCURRENCY):
+    """Chẩn đoán song song (tối đa `concurrency` ảnh), trả kết quả theo thứ tự hoàn thành
+
+    Yield (index, filename, result, error).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(index, filename, load):
+        async with semaphore:
+            image = None
+            try:
+                image = await asyncio.to_thread(load)
+                return index, filename, await diagnose_fn(image), None
+            except Exception as e:
+                return index, filename, None, e
+            finally:
+                if image is not None:
+                    image.close()
+
+    tasks = [
+        asyncio.ensure_future(run_one(index, filename, load))
+        for index, (filename, load) in enumerate(images)
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Client ngắt kết nối giữa chừng: hủy các ảnh chưa xử lý
+        for task in tasks:
+            task.cancel()
+
+
+def ndjson_line(payload):
+    return json.dumps(payload, ensure_ascii=False) + "\n"
@@ -0,0 +1,115 @@
+"""Benchmark kiểm tra ảnh trước khi chẩn đoán (uploads.inspect_image)
+
+So sánh thời gian kiểm tra header (magic bytes + PIL header) với thời gian
+giải mã toàn bộ ảnh, và xác nhận các payload xấu bị từ chối.
+
+Sử dụng:
+    python benchmark_image_check.py --repeats 2000 --output image_check.json
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import struct
+import time
+import zlib
+
+from PIL import Image
+
+from uploads import InvalidImage, inspect_image
+
+
+def encode(image, image_format, **options):
+    output = io.BytesIO()
+    image.save(output, format=image_format, **options)
+    return output.getvalue()
+
+
+def png_bomb(width, height):
+    """PNG 1-bit rất nhỏ nhưng khai báo width x height pixel"""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    header = struct.pack('>IIBBBBB', width, height, 1, 0, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(b'')) + chunk(b'IEND', b'')
+
+
+def make_samples():
+    photo = Image.new('RGB', (4000, 3000), (60, 140, 60))
+    small = Image.new('RGB', (640, 480), (200, 80, 40))
+    jpeg = encode(photo, 'JPEG', quality=90)
+    return {
+        "jpeg_12mp": (jpeg, True),
+        "png_640": (encode(small, 'PNG'), True),
+        "webp_640": (encode(small, 'WEBP'), True),
+        "truncated_jpeg": (jpeg[:200], False),
+        "text_as_image": (b'hello, this is not an image' * 10, False),
+        "zero_size_gif": (b'GIF89a\x00\x00\x00\x00\x00\x00\x00,' + b'\x00' * 20, False),
+        "png_bomb": (png_bomb(100000, 100000), False)
+    }
+
+
+def time_call(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def check(payload):
+    try:
+        return inspect_image(io.BytesIO(payload))
+    except InvalidImage as e:
+        return e.detail
+
+
+def decode(payload):
+    try:
+        with Image.open(io.BytesIO(payload)) as image:
+            image.load()
+    except Exception:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo chi phí kiểm tra header ảnh so với giải mã đầy đủ")
+    parser.add_argument("--repeats", type=int, default=1000)
+    parser.add_argument("--decode-repeats", type=int, default=5)
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file")
+    args = parser.parse_args()
+
+    report = {}
+    for name, (payload, valid) in make_samples().items():
+        outcome = check(payload)
+        accepted = isinstance(outcome, tuple)
+        timings = time_call(lambda: check(payload), args.repeats)
+        entry = {
+            "bytes": len(payload),
+            "expected_valid": valid,
+            "accepted": accepted,
+            "result": list(outcome) if accepted else outcome,
+            "check_p50_us": statistics.median(timings) * 1e6,
+            "check_max_us": max(timings) * 1e6
+        }
+        if valid:
+            entry["decode_p50_ms"] = statistics.median(time_call(lambda: decode(payload), args.decode_repeats)) * 1000
+        report[name] = entry
+
+        mark = "✅" if accepted == valid else "❌"
+        line = f"{mark} {name:15s} {entry['check_p50_us']:7.1f}µs"
+        if valid:
+            line += f"  (giải mã đầy đủ {entry['decode_p50_ms']:.1f}ms)"
+        else:
+            line += f"  -> {outcome}"
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"💾 Đã lưu kết quả: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""Benchmark serialize danh sách lớn: pydantic / dict + json.dumps so với jsonrows.RowEncoder
+
+Seed database tạm với N dòng, rồi đo thời gian response (TestClient) và bộ
+nhớ cấp phát đỉnh (tracemalloc) cho:
+  - /diagnoses?limit=N (api.py): handler cũ dựng DiagnosisResponse từng dòng
+  - /history?limit=N (api_with_db.py): handler cũ dựng dict từng dòng
+  - danh mục /plants khi cache trống: dict + json.dumps so với RowEncoder
+
+Sử dụng:
+    python benchmark_json.py --rows 10000 --repeats 20 --output json_bench.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import List
+
+DISEASES = ["Tomato___Late_blight", "Apple___healthy", "Potato___Early_blight", "Corn___Common_rust", "brown spot"]
+
+
+def seed_rows(count):
+    start = datetime(2026, 1, 1)
+    return [
+        (
+            (start + timedelta(seconds=i * 7)).strftime('%Y-%m-%d %H:%M:%S'),
+            random.choice(("plant", "rice")),
+            random.choice(DISEASES),
+            random.random()
+        )
+        for i in range(count)
+    ]
+
+
+def measure(fn, repeats):
+    """Thời gian (ms) mỗi lần và bộ nhớ cấp phát đỉnh (MB) của một lần chạy"""
+    fn()
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    timings.sort()
+    return {
+        "mean_ms": statistics.fmean(timings),
+        "p50_ms": timings[len(timings) // 2],
+        "p95_ms": timings[min(len(timings) - 1, int(0.95 * len(timings)))],
+        "peak_alloc_mb": peak / 1024 / 1024
+    }
+
+
+def fetch(client, url, expected):
+    def run():
+        response = client.get(url)
+        assert response.status_code == 200, response.text[:200]
+        assert len(response.content) > 0
+        return response
+    # Kiểm tra trước số dòng trả về
+    body = run().json()
+    items = body["history"] if isinstance(body, dict) else body
+    assert len(items) == expected, f"{url}: {len(items)} != {expected}"
+    return run
+
+
+def bench_api(rows, repeats, workdir):
+    os.environ["DATABASE_PATH"] = os.path.join(workdir, "plants.db")
+    os.environ["DIAGNOSIS_WRITE_BEHIND"] = "0"
+    from fastapi.testclient import TestClient
+
+    import api
+    from catalog import PLANT_ENCODER, PLANT_FIELDS
+
+    with api.db_pool.connection() as conn:
+        conn.executemany(
+            'INSERT INTO diagnoses (timestamp, type, disease, confidence) VALUES (?, ?, ?, ?)',
+            seed_rows(rows)
+        )
+        conn.executemany(
+            'INSERT OR IGNORE INTO plants (name, scientific_name, description, care_instructions) VALUES (?, ?, ?, ?)',
+            [(f"Cây {i}", f"Plantae {i}", "Mô tả \"có dấu\" và ký tự đặc biệt", "Tưới nước") for i in range(rows)]
+        )
+        conn.commit()
+
+    def old_get_diagnoses(limit: int = 50):
+        # Handler /diagnoses trước khi dùng RowEncoder
+        with api.db_pool.connection() as conn:
+            diagnoses = conn.execute('''
+                SELECT d.id, p.name, d.disease, d.confidence, d.timestamp
+                FROM diagnoses d
+                LEFT JOIN plants p ON d.plant_id = p.id
+                ORDER BY d.timestamp DESC, d.id DESC
+                LIMIT ?
+            ''', [limit]).fetchall()
+        return [
+            api.DiagnosisResponse(id=d[0], plant_name=d[1], disease=d[2], confidence=d[3], timestamp=d[4])
+            for d in diagnoses
+        ]
+
+    api.app.add_api_route("/_bench/diagnoses_old", old_get_diagnoses,
+                          response_model=List[api.DiagnosisResponse], methods=["GET"])
+
+    results = {}
+    with TestClient(api.app) as client:
+        results["diagnoses_pydantic"] = measure(
+            fetch(client, f"/_bench/diagnoses_old?limit={rows}", rows), repeats)
+        results["diagnoses_rowencoder"] = measure(fetch(client, f"/diagnoses?limit={rows}", rows), repeats)
+
+        with api.db_pool.connection() as conn:
+            plant_rows = conn.execute(f"SELECT {', '.join(PLANT_FIELDS)} FROM plants ORDER BY name").fetchall()
+
+        def old_catalog():
+            page = [dict(zip(PLANT_FIELDS, row)) for row in plant_rows]
+            json.dumps(page, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+        results["plants_body_json_dumps"] = measure(old_catalog, repeats)
+        results["plants_body_rowencoder"] = measure(lambda: PLANT_ENCODER.array(plant_rows), repeats)
+
+        def cold_plants():
+            api.plant_catalog.invalidate()
+            client.get("/plants")
+        results["plants_http_cold"] = measure(cold_plants, repeats)
+        results["plants_http_cached"] = measure(lambda: client.get("/plants"), repeats)
+    return results
+
+
+def bench_history(rows, repeats, workdir):
+    os.environ["DATABASE_PATH"] = os.path.join(workdir, "diagnoses.db")
+    from fastapi.testclient import TestClient
+
+    import api_with_db
+
+    with api_with_db.db_pool.connection() as conn:
+        conn.executemany(
+            'INSERT INTO diagnoses (timestamp, type, disease, disease_vietnamese, confidence, success) '
+            'VALUES (?, ?, ?, ?, ?, 1)',
+            [(ts, kind, disease, f"Bệnh {disease}", conf) for ts, kind, disease, conf in seed_rows(rows)]
+        )
+        conn.commit()
+
+    def old_history(limit: int = 50):
+        # Handler /history trước khi dùng RowEncoder
+        with api_with_db.db_pool.connection() as conn:
+            results = conn.execute('''
+                SELECT id, timestamp, type, disease, disease_vietnamese, confidence, success
+                FROM diagnoses ORDER BY timestamp DESC, id DESC LIMIT ?
+            ''', [limit]).fetchall()
+        history = [{
+            "id": row[0], "timestamp": row[1], "type": row[2], "disease": row[3],
+            "disease_vietnamese": row[4], "confidence": row[5], "success": bool(row[6])
+        } for row in results]
+        return {"history": history, "total": len(history), "next_cursor": None}
+
+    api_with_db.app.add_api_route("/_bench/history_old", old_history, methods=["GET"])
+
+    with TestClient(api_with_db.app) as client:
+        return {
+            "history_dicts": measure(fetch(client, f"/_bench/history_old?limit={rows}", rows), repeats),
+            "history_rowencoder_stream": measure(fetch(client, f"/history?limit={rows}", rows), repeats)
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark serialize danh sách lớn")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--output", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+    random.seed(42)
+
+    os.environ.setdefault("LIST_MAX_LIMIT", str(max(args.rows, 10000)))
+    os.environ["TRACE_SAMPLE_RATE"] = "0"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    with tempfile.TemporaryDirectory(prefix="plant_json_") as workdir:
+        results = bench_api(args.rows, args.repeats, workdir)
+        results.update(bench_history(args.rows, args.repeats, workdir))
+
+    print(f"📊 {args.rows} dòng, {args.repeats} lần mỗi phép đo")
+    print(f"{'':28s} {'mean':>9s} {'p50':>9s} {'p95':>9s} {'alloc':>9s}")
+    for name, stat in results.items():
+        print(f"{name:28s} {stat['mean_ms']:8.1f}ms {stat['p50_ms']:8.1f}ms {stat['p95_ms']:8.1f}ms "
+              f"{stat['peak_alloc_mb']:7.1f}MB")
+    for old, new in (("diagnoses_pydantic", "diagnoses_rowencoder"), ("history_dicts", "history_rowencoder_stream"),
+                     ("plants_body_json_dumps", "plants_body_rowencoder")):
+        print(f"⚡ {new}: nhanh hơn x{results[old]['p50_ms'] / results[new]['p50_ms']:.1f} so với {old}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"rows": args.rows, "repeats": args.repeats, "results": results}, f, indent=2)
+        print(f"💾 Đã ghi kết quả vào {args.output}")
+
+
+if __name__ == "__main__":
+    main()
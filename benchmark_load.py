@@ -0,0 +1,371 @@
+"""Load test API qua HTTP với server Roboflow giả lập (fake_upstream.py)
+
+Script tự khởi động fake_upstream và API (uvicorn) trên cổng local, seed
+dữ liệu cây trồng, rồi bắn request vào /predict/plant, /predict/rice, /plants
+và /stats ở từng mức concurrency. Kết quả (throughput, p50/p95/p99, tỉ lệ lỗi
+theo endpoint) ghi ra JSON để so sánh giữa các commit.
+
+Sử dụng:
+    python benchmark_load.py --concurrency 1 8 32 --duration 20 --output load.json
+    python benchmark_load.py --latency-ms 120 --slow-rate 0.02 --mix predict_plant=3,plants=1
+    python benchmark_load.py --compare load_main.json --output load.json
+    python benchmark_load.py --target http://localhost:8000   # dùng API đang chạy sẵn
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+from PIL import Image
+
+ENDPOINTS = {
+    "predict_plant": ("POST", "/predict/plant"),
+    "predict_rice": ("POST", "/predict/rice"),
+    "plants": ("GET", "/plants"),
+    "stats": ("GET", "/stats")
+}
+DEFAULT_MIX = "predict_plant=4,predict_rice=2,plants=3,stats=1"
+UPSTREAM_SETTINGS = ("latency_ms", "jitter_ms", "slow_rate", "slow_ms", "error_rate")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Endpoint không hợp lệ: {name} (chọn trong {', '.join(ENDPOINTS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def synthetic_images(count, size=(640, 480)):
+    """Ảnh JPEG khác nhau; số ảnh quyết định tỉ lệ trúng cache dự đoán"""
+    images = []
+    for i in range(count):
+        noise = Image.effect_noise(size, 30 + i % 50)
+        color = Image.new('RGB', size, (40 + i % 200, 120, 60 + (i * 7) % 180))
+        image = Image.blend(color, Image.merge('RGB', (noise, noise, noise)), 0.3)
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=85)
+        images.append(output.getvalue())
+    return images
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def latency_summary(latencies):
+    if not latencies:
+        return None
+    ordered = sorted(latencies)
+    return {
+        "mean": statistics.fmean(ordered) * 1000,
+        "p50": percentile(ordered, 0.5) * 1000,
+        "p95": percentile(ordered, 0.95) * 1000,
+        "p99": percentile(ordered, 0.99) * 1000,
+        "max": ordered[-1] * 1000
+    }
+
+
+class Servers:
+    """Khởi động fake_upstream + API dưới dạng tiến trình con, tắt khi xong"""
+
+    def __init__(self, args):
+        self.args = args
+        self.processes = []
+        self.workdir = tempfile.TemporaryDirectory(prefix="plant_load_")
+        self.upstream_url = None
+        self.api_url = None
+
+    def _spawn(self, command, env=None):
+        process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        self.processes.append(process)
+        return process
+
+    def start(self):
+        args = self.args
+        upstream_port = free_port()
+        command = [sys.executable, "fake_upstream.py", "--port", str(upstream_port)]
+        for key in UPSTREAM_SETTINGS:
+            command += [f"--{key.replace('_', '-')}", str(getattr(args, key))]
+        upstream = self._spawn(command)
+        self.upstream_url = f"http://127.0.0.1:{upstream_port}"
+        wait_ready(f"{self.upstream_url}/_control", upstream)
+
+        api_port = free_port()
+        env = dict(
+            os.environ,
+            ROBOFLOW_URL=self.upstream_url,
+            DATABASE_PATH=os.path.join(self.workdir.name, "plants.db"),
+            TRACE_SAMPLE_RATE="0",
+            TRACE_FILE=os.path.join(self.workdir.name, "traces.jsonl"),
+            PREDICTION_CACHE_DB=""
+        )
+        env.update(kv.split("=", 1) for kv in args.env)
+        api = self._spawn([sys.executable, "-m", "uvicorn", args.app, "--host", "127.0.0.1",
+                           "--port", str(api_port), "--log-level", "warning",
+                           "--workers", str(args.workers)], env=env)
+        self.api_url = f"http://127.0.0.1:{api_port}"
+        wait_ready(f"{self.api_url}/", api)
+
+    def stop(self):
+        for process in reversed(self.processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.workdir.cleanup()
+
+
+def wait_ready(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Tiến trình thoát sớm: {process.stderr.read().decode(errors='replace')[-2000:]}")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Hết thời gian chờ {url}")
+
+
+async def seed_plants(client, count):
+    plants = [
+        {
+            "name": f"Cây thử nghiệm {i}",
+            "scientific_name": f"Plantae loadtest {i}",
+            "description": "Dữ liệu seed cho load test",
+            "care_instructions": "Tưới nước hằng ngày"
+        }
+        for i in range(count)
+    ]
+    response = await client.post("/plants/bulk", json=plants, timeout=120)
+    if response.status_code != 200:
+        print(f"⚠️  Không seed được cây trồng: HTTP {response.status_code}")
+
+
+async def send(client, name, images):
+    method, path = ENDPOINTS[name]
+    if method == "POST":
+        files = {"file": ("leaf.jpg", random.choice(images), "image/jpeg")}
+        return await client.post(path, files=files)
+    if name == "plants":
+        return await client.get(path, params={"limit": 50})
+    return await client.get(path)
+
+
+async def run_level(base_url, concurrency, duration, warmup, mix, images, timeout):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = {name: [] for name in names}
+    statuses = {name: {} for name in names}
+    errors = {name: 0 for name in names}
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        measuring = False
+        stop_at = time.monotonic() + warmup + duration
+
+        async def worker():
+            while time.monotonic() < stop_at:
+                name = random.choices(names, weights)[0]
+                started = time.perf_counter()
+                try:
+                    response = await send(client, name, images)
+                    status = str(response.status_code)
+                    failed = response.status_code >= 400
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                    failed = True
+                elapsed = time.perf_counter() - started
+                if not measuring:
+                    continue
+                samples[name].append(elapsed)
+                statuses[name][status] = statuses[name].get(status, 0) + 1
+                if failed:
+                    errors[name] += 1
+
+        tasks = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        await asyncio.sleep(warmup)
+        measuring = True
+        measure_started = time.perf_counter()
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - measure_started
+
+    endpoints = {}
+    for name in names:
+        count = len(samples[name])
+        endpoints[name] = {
+            "requests": count,
+            "errors": errors[name],
+            "error_rate": errors[name] / count if count else 0,
+            "throughput_rps": count / elapsed,
+            "status": statuses[name],
+            "latency_ms": latency_summary(samples[name])
+        }
+    total = sum(len(values) for values in samples.values())
+    total_errors = sum(errors.values())
+    return {
+        "concurrency": concurrency,
+        "duration_s": elapsed,
+        "requests": total,
+        "errors": total_errors,
+        "error_rate": total_errors / total if total else 0,
+        "throughput_rps": total / elapsed,
+        "latency_ms": latency_summary([value for values in samples.values() for value in values]),
+        "endpoints": endpoints
+    }
+
+
+async def run(args, base_url, upstream_url):
+    mix = parse_mix(args.mix)
+    images = synthetic_images(args.images)
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        if args.seed_plants:
+            await seed_plants(client, args.seed_plants)
+
+    runs = []
+    for concurrency in args.concurrency:
+        print(f"🚀 concurrency={concurrency}: warmup {args.warmup}s, đo {args.duration}s...")
+        result = await run_level(base_url, concurrency, args.duration, args.warmup, mix, images, args.timeout)
+        runs.append(result)
+        print_run(result)
+
+    upstream = None
+    if upstream_url:
+        async with httpx.AsyncClient() as client:
+            upstream = (await client.get(f"{upstream_url}/_control")).json()
+    return runs, upstream
+
+
+def print_run(result):
+    overall = result["latency_ms"] or {}
+    print(f"   📊 {result['throughput_rps']:.1f} req/s, lỗi {result['error_rate'] * 100:.2f}%, "
+          f"p50 {overall.get('p50', 0):.1f}ms p95 {overall.get('p95', 0):.1f}ms p99 {overall.get('p99', 0):.1f}ms")
+    for name, stat in result["endpoints"].items():
+        latency = stat["latency_ms"] or {}
+        print(f"      {name:14s} {stat['throughput_rps']:8.1f} req/s  lỗi {stat['error_rate'] * 100:5.2f}%  "
+              f"p50 {latency.get('p50', 0):7.1f}  p95 {latency.get('p95', 0):7.1f}  p99 {latency.get('p99', 0):7.1f}")
+
+
+def compare(report, baseline_path):
+    """In thay đổi throughput / p95 so với một báo cáo trước đó"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {run["concurrency"]: run for run in baseline.get("runs", [])}
+    print(f"\n🔍 So với {baseline_path} (commit {baseline.get('meta', {}).get('commit')}):")
+    for run in report["runs"]:
+        old = previous.get(run["concurrency"])
+        if old is None:
+            continue
+        for name, stat in run["endpoints"].items():
+            old_stat = old["endpoints"].get(name)
+            if not old_stat or not old_stat["latency_ms"] or not stat["latency_ms"]:
+                continue
+            throughput = _change(stat["throughput_rps"], old_stat["throughput_rps"])
+            p95 = _change(stat["latency_ms"]["p95"], old_stat["latency_ms"]["p95"])
+            print(f"   c={run['concurrency']:<4d} {name:14s} throughput {throughput:+7.1f}%  p95 {p95:+7.1f}%")
+
+
+def _change(new, old):
+    return (new - old) / old * 100 if old else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test API với server Roboflow giả lập")
+    parser.add_argument("--app", default="api:app", help="Ứng dụng ASGI cho uvicorn")
+    parser.add_argument("--target", help="URL API đang chạy sẵn (không tự khởi động server)")
+    parser.add_argument("--workers", type=int, default=1, help="Số worker uvicorn")
+    parser.add_argument("--env", action="append", default=[], help="Biến môi trường thêm cho API, vd KEY=VALUE")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=15, help="Thời gian đo mỗi mức (giây)")
+    parser.add_argument("--warmup", type=float, default=3, help="Thời gian chạy trước khi đo (giây)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Trọng số endpoint, vd predict_plant=4,plants=1")
+    parser.add_argument("--images", type=int, default=200, help="Số ảnh khác nhau (ít ảnh thì trúng cache nhiều)")
+    parser.add_argument("--seed-plants", type=int, default=500, help="Số cây trồng seed trước khi đo")
+    parser.add_argument("--timeout", type=float, default=30, help="Timeout mỗi request (giây)")
+    parser.add_argument("--latency-ms", type=float, default=80)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--slow-rate", type=float, default=0.01)
+    parser.add_argument("--slow-ms", type=float, default=1500)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--compare", help="Báo cáo JSON trước đó để so sánh")
+    parser.add_argument("--output", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    servers = None
+    if args.target:
+        base_url, upstream_url = args.target.rstrip("/"), None
+    else:
+        servers = Servers(args)
+        print("🧪 Khởi động fake Roboflow và API...")
+        servers.start()
+        base_url, upstream_url = servers.api_url, servers.upstream_url
+
+    try:
+        runs, upstream = asyncio.run(run(args, base_url, upstream_url))
+    finally:
+        if servers is not None:
+            servers.stop()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "app": None if args.target else args.app,
+            "target": args.target,
+            "workers": args.workers,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "mix": parse_mix(args.mix),
+            "images": args.images,
+            "seed_plants": args.seed_plants,
+            "upstream": None if args.target else {key: getattr(args, key) for key in UPSTREAM_SETTINGS}
+        },
+        "runs": runs,
+        "upstream_counters": upstream["counters"] if upstream else None
+    }
+
+    if args.compare:
+        compare(report, args.compare)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Đã ghi kết quả vào {args.output}")
+    else:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
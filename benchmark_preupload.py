@@ -0,0 +1,148 @@
+"""Benchmark bước thu nhỏ ảnh trước khi gửi lên Roboflow
+
+Sử dụng:
+    python benchmark_preupload.py --images data/samples --max-side 640 1024
+    python benchmark_preupload.py --upstream    # đo thêm độ trễ gọi Roboflow thật
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import statistics
+import time
+
+from PIL import Image
+
+from preupload import downscale_image
+from upstream import PLANT_MODEL, UpstreamClient
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def load_images(directory, limit):
+    images = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(directory, name), 'rb') as f:
+                images.append((name, f.read()))
+        if len(images) >= limit:
+            break
+    return images
+
+
+def synthetic_images(count, size=(4000, 3000)):
+    """Ảnh giả lập cỡ ảnh điện thoại 12MP khi không có bộ ảnh mẫu"""
+    images = []
+    for i in range(count):
+        noise = Image.effect_noise(size, 40 + i)
+        gradient = Image.linear_gradient('L').resize(size)
+        image = Image.merge('RGB', (noise, gradient, Image.blend(noise, gradient, 0.5)))
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=92)
+        images.append((f"synthetic_{i}.jpg", output.getvalue()))
+    return images
+
+
+async def measure_upstream(images, repeats):
+    client = UpstreamClient()
+    latencies = []
+    try:
+        for _ in range(repeats):
+            for _, image_bytes in images:
+                started = time.perf_counter()
+                await client.predict(PLANT_MODEL, image_bytes)
+                latencies.append(time.perf_counter() - started)
+    finally:
+        await client.aclose()
+    return latencies
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run(args):
+    if args.images:
+        images = load_images(args.images, args.limit)
+    else:
+        images = synthetic_images(args.limit)
+    if not images:
+        print("❌ Không có ảnh để benchmark")
+        return None
+
+    original_bytes = sum(len(data) for _, data in images)
+    report = {
+        "images": len(images),
+        "original_bytes": original_bytes,
+        "bandwidth_mbps": args.bandwidth_mbps,
+        "quality": args.quality,
+        "results": []
+    }
+
+    baseline_latencies = None
+    if args.upstream:
+        baseline_latencies = asyncio.run(measure_upstream(images, args.repeats))
+        report["original_upstream_p50_ms"] = statistics.median(baseline_latencies) * 1000
+        report["original_upstream_p95_ms"] = percentile(baseline_latencies, 0.95) * 1000
+
+    for max_side in args.max_side:
+        prep_times = []
+        resized = []
+        for name, data in images:
+            started = time.perf_counter()
+            small = downscale_image(data, max_side, args.quality)
+            prep_times.append(time.perf_counter() - started)
+            resized.append((name, small))
+
+        resized_bytes = sum(len(data) for _, data in resized)
+        saved = original_bytes - resized_bytes
+        bytes_per_second = args.bandwidth_mbps * 1000000 / 8
+        result = {
+            "max_side": max_side,
+            "resized_bytes": resized_bytes,
+            "bytes_saved": saved,
+            "bytes_saved_ratio": saved / original_bytes,
+            "prep_mean_ms": statistics.mean(prep_times) * 1000,
+            "prep_p95_ms": percentile(prep_times, 0.95) * 1000,
+            # Thời gian upload ước tính ở băng thông đã cho, trên mỗi ảnh
+            "estimated_upload_saved_ms": saved / len(images) / bytes_per_second * 1000
+        }
+        if baseline_latencies is not None:
+            latencies = asyncio.run(measure_upstream(resized, args.repeats))
+            result["upstream_p50_ms"] = statistics.median(latencies) * 1000
+            result["upstream_p95_ms"] = percentile(latencies, 0.95) * 1000
+            result["upstream_p50_change_ms"] = result["upstream_p50_ms"] - report["original_upstream_p50_ms"]
+        report["results"].append(result)
+
+        print(f"📐 max_side={max_side}: {original_bytes / 1e6:.1f}MB → {resized_bytes / 1e6:.1f}MB "
+              f"(-{result['bytes_saved_ratio']:.0%}), xử lý {result['prep_mean_ms']:.1f}ms/ảnh, "
+              f"tiết kiệm ~{result['estimated_upload_saved_ms']:.0f}ms upload/ảnh @ {args.bandwidth_mbps}Mbps")
+        if baseline_latencies is not None:
+            print(f"    Roboflow p50: {report['original_upstream_p50_ms']:.0f}ms → {result['upstream_p50_ms']:.0f}ms")
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark thu nhỏ ảnh trước khi upload")
+    parser.add_argument("--images", help="Thư mục ảnh mẫu (mặc định: ảnh giả lập 12MP)")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--max-side", type=int, nargs='+', default=[640, 1024])
+    parser.add_argument("--quality", type=int, default=85)
+    parser.add_argument("--bandwidth-mbps", type=float, default=10)
+    parser.add_argument("--upstream", action="store_true", help="Đo độ trễ gọi Roboflow thật")
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file")
+    args = parser.parse_args()
+
+    report = run(args)
+    if report is not None and args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Đã lưu kết quả: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Benchmark truy cập SQLite: mở connection mỗi request (cũ) và pool + WAL (mới)
+
+Mô phỏng tải của api_with_db.py: nhiều thread cùng lúc ghi chẩn đoán
+(save_diagnosis) và đọc lịch sử (/history).
+
+Sử dụng:
+    python benchmark_sqlite.py --threads 16 --duration 5 --write-ratio 0.3
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from db import SQLitePool
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS diagnoses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        type TEXT NOT NULL,
+        disease TEXT,
+        disease_vietnamese TEXT,
+        confidence REAL,
+        success BOOLEAN,
+        raw_result TEXT
+    )
+'''
+INSERT = '''
+    INSERT INTO diagnoses (type, disease, disease_vietnamese, confidence, success, raw_result)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+SELECT = '''
+    SELECT id, timestamp, type, disease, disease_vietnamese, confidence, success
+    FROM diagnoses
+    ORDER BY id DESC
+    LIMIT 50
+'''
+DISEASES = ['brown spot disease', 'rice blast disease', 'Tomato___Late_blight', 'Apple___healthy']
+
+
+def make_row():
+    disease = random.choice(DISEASES)
+    raw = json.dumps({"predictions": [{"class": disease, "confidence": random.random()}]})
+    return ("rice", disease, disease, random.random(), True, raw)
+
+
+def prepare(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute(SCHEMA)
+    conn.executemany(INSERT, (make_row() for _ in range(rows)))
+    conn.commit()
+    conn.close()
+
+
+class ConnectPerRequest:
+    """Cách cũ: sqlite3.connect() / close() trong mỗi handler, rollback journal mặc định"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute(INSERT, make_row())
+        conn.commit()
+        conn.close()
+
+    def read(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute(SELECT).fetchall()
+        conn.close()
+
+    def close(self):
+        pass
+
+
+class Pooled:
+    def __init__(self, path, size):
+        self.pool = SQLitePool(path, size=size)
+
+    def write(self):
+        with self.pool.connection() as conn:
+            conn.execute(INSERT, make_row())
+            conn.commit()
+
+    def read(self):
+        with self.pool.connection() as conn:
+            conn.execute(SELECT).fetchall()
+
+    def close(self):
+        self.pool.close()
+
+
+def run_load(target, threads, duration, write_ratio):
+    latencies = {"read": [], "write": []}
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        local = {"read": [], "write": []}
+        local_errors = 0
+        while time.perf_counter() < deadline:
+            kind = "write" if random.random() < write_ratio else "read"
+            started = time.perf_counter()
+            try:
+                getattr(target, kind)()
+            except sqlite3.Error:
+                local_errors += 1
+                continue
+            local[kind].append(time.perf_counter() - started)
+        with lock:
+            latencies["read"].extend(local["read"])
+            latencies["write"].extend(local["write"])
+            errors[0] += local_errors
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    def summary(values):
+        if not values:
+            return {"count": 0}
+        ordered = sorted(values)
+        return {
+            "count": len(values),
+            "p50_ms": statistics.median(ordered) * 1000,
+            "p99_ms": ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))] * 1000
+        }
+
+    total = len(latencies["read"]) + len(latencies["write"])
+    return {
+        "requests_per_second": total / elapsed,
+        "errors": errors[0],
+        "read": summary(latencies["read"]),
+        "write": summary(latencies["write"])
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="So sánh connection-per-request và pool WAL cho SQLite")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--write-ratio", type=float, default=0.3)
+    parser.add_argument("--rows", type=int, default=10000, help="Số bản ghi có sẵn trong bảng")
+    parser.add_argument("--pool-size", type=int, default=8)
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file")
+    args = parser.parse_args()
+
+    report = {"threads": args.threads, "duration": args.duration, "write_ratio": args.write_ratio}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, factory in (
+            ("before", lambda path: ConnectPerRequest(path)),
+            ("after", lambda path: Pooled(path, args.pool_size))
+        ):
+            path = os.path.join(tmp, f"{name}.db")
+            prepare(path, args.rows)
+            target = factory(path)
+            try:
+                report[name] = run_load(target, args.threads, args.duration, args.write_ratio)
+            finally:
+                target.close()
+            result = report[name]
+            print(f"{'🐢' if name == 'before' else '🚀'} {name:6s}: {result['requests_per_second']:8.0f} req/s, "
+                  f"read p99 {result['read'].get('p99_ms', 0):.2f}ms, "
+                  f"write p99 {result['write'].get('p99_ms', 0):.2f}ms, lỗi {result['errors']}")
+
+    report["speedup"] = report["after"]["requests_per_second"] / max(report["before"]["requests_per_second"], 1e-9)
+    print(f"📈 Tăng tốc: x{report['speedup']:.1f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Đã lưu kết quả: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
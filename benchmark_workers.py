@@ -0,0 +1,218 @@
+"""Benchmark serve.py theo số worker: bộ nhớ mỗi worker và throughput
+
+Với mỗi số worker, khởi động serve.py (cùng fake_upstream.py nếu dùng
+backend roboflow), bắn request /predict/plant với cache dự đoán tắt để mọi
+request đều phải giải mã ảnh / chạy model, rồi đo:
+  - RSS, PSS và USS của từng worker (/proc/<pid>/smaps_rollup, chỉ Linux).
+    PSS chia phần bộ nhớ dùng chung (thư viện import sẵn, file model mmap)
+    cho các process, nên PSS giảm khi trọng số được chia sẻ.
+  - throughput, p50/p95/p99 như benchmark_load.py.
+
+Sử dụng:
+    python benchmark_workers.py --workers 1 2 4 8 --output workers.json
+    python benchmark_workers.py --backend tflite --model-path plant_disease_model.tflite
+    python benchmark_workers.py --backend keras --model-path plant_disease_model.h5   # mỗi worker một bản
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from benchmark_load import free_port, git_commit, run_level, synthetic_images, wait_ready
+
+
+def memory_usage(pid):
+    """RSS / PSS / USS (MB) của một process, đọc từ smaps_rollup"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup", 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                values[parts[0][:-1]] = int(parts[1])
+    uss = values.get("Private_Clean", 0) + values.get("Private_Dirty", 0)
+    return {
+        "rss_mb": values.get("Rss", 0) / 1024,
+        "pss_mb": values.get("Pss", 0) / 1024,
+        "uss_mb": uss / 1024
+    }
+
+
+def child_pids(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", 'r') as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def wait_workers(pid, count, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        children = child_pids(pid)
+        if len(children) >= count:
+            return children
+        time.sleep(0.2)
+    raise RuntimeError(f"Chỉ có {len(child_pids(pid))}/{count} worker sau {timeout}s")
+
+
+def cpu_seconds():
+    times = os.times()
+    return times.user + times.system
+
+
+def start_server(args, workers, upstream_url, workdir):
+    port = free_port()
+    env = dict(
+        os.environ,
+        DATABASE_PATH=os.path.join(workdir, f"plants_{workers}.db"),
+        TRACE_SAMPLE_RATE="0",
+        # Tắt cache để mọi request đều chạy giải mã ảnh / inference
+        PREDICTION_CACHE_TTL="0",
+        PREDICTION_CACHE_DB="",
+        PHASH_MAX_DISTANCE="0",
+        PLANT_BACKEND=args.backend
+    )
+    if upstream_url:
+        env["ROBOFLOW_URL"] = upstream_url
+        # Thu nhỏ ảnh trước khi gửi: phần việc CPU của backend roboflow
+        env["UPSTREAM_MAX_SIDE"] = "1024"
+    if args.model_path:
+        env["PLANT_MODEL_PATH"] = args.model_path
+    env.update(kv.split("=", 1) for kv in args.env)
+    process = subprocess.Popen(
+        [sys.executable, "serve.py", "--app", args.app, "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    wait_ready(f"{base_url}/", process, timeout=120)
+    return process, base_url
+
+
+def stop(process):
+    process.terminate()
+    try:
+        process.wait(timeout=20)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def measure(args, workers, upstream_url, images, workdir):
+    process, base_url = start_server(args, workers, upstream_url, workdir)
+    try:
+        pids = wait_workers(process.pid, workers)
+        concurrency = args.concurrency_per_worker * workers
+        print(f"🚀 {workers} worker, concurrency={concurrency}...")
+        cpu_started = cpu_seconds()
+        result = asyncio.run(run_level(base_url, concurrency, args.duration, args.warmup,
+                                       {"predict_plant": 1}, images, args.timeout))
+        client_cpu = (cpu_seconds() - cpu_started) / (args.duration + args.warmup)
+
+        memory = [memory_usage(pid) for pid in pids]
+        parent = memory_usage(process.pid)
+    finally:
+        stop(process)
+
+    summary = {
+        "workers": workers,
+        "concurrency": concurrency,
+        "throughput_rps": result["throughput_rps"],
+        "error_rate": result["error_rate"],
+        "latency_ms": result["latency_ms"],
+        # Client benchmark chạy một process: gần 100% nghĩa là client đã là nút thắt
+        "client_cpu_percent": client_cpu * 100,
+        "parent_memory": parent,
+        "worker_memory": memory,
+        "total_pss_mb": parent["pss_mb"] + sum(m["pss_mb"] for m in memory),
+        "total_rss_mb": parent["rss_mb"] + sum(m["rss_mb"] for m in memory),
+        "avg_worker_rss_mb": sum(m["rss_mb"] for m in memory) / len(memory),
+        "avg_worker_pss_mb": sum(m["pss_mb"] for m in memory) / len(memory),
+        "avg_worker_uss_mb": sum(m["uss_mb"] for m in memory) / len(memory)
+    }
+    latency = summary["latency_ms"] or {}
+    print(f"   📊 {summary['throughput_rps']:.1f} req/s, lỗi {summary['error_rate'] * 100:.2f}%, "
+          f"p95 {latency.get('p95', 0):.1f}ms, client CPU {summary['client_cpu_percent']:.0f}%")
+    print(f"   🧠 mỗi worker: RSS {summary['avg_worker_rss_mb']:.1f}MB, PSS {summary['avg_worker_pss_mb']:.1f}MB, "
+          f"USS {summary['avg_worker_uss_mb']:.1f}MB; tổng PSS {summary['total_pss_mb']:.1f}MB")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bộ nhớ và throughput theo số worker (serve.py)")
+    parser.add_argument("--app", default="api:app")
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument("--backend", choices=["roboflow", "tflite", "keras"], default="roboflow",
+                        help="roboflow dùng fake_upstream.py, phần CPU là giải mã / thu nhỏ ảnh")
+    parser.add_argument("--model-path", help="File model cho backend tflite / keras")
+    parser.add_argument("--env", action="append", default=[], help="Biến môi trường thêm cho API, vd KEY=VALUE")
+    parser.add_argument("--concurrency-per-worker", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--images", type=int, default=50)
+    parser.add_argument("--image-size", type=int, nargs=2, default=[1600, 1200], metavar=("W", "H"))
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--output", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    if not sys.platform.startswith("linux"):
+        print("❌ Cần Linux (/proc/<pid>/smaps_rollup) để đo bộ nhớ")
+        return
+
+    images = synthetic_images(args.images, tuple(args.image_size))
+    upstream = None
+    upstream_url = None
+    if args.backend == "roboflow":
+        port = free_port()
+        upstream = subprocess.Popen(
+            [sys.executable, "fake_upstream.py", "--port", str(port), "--latency-ms", str(args.latency_ms),
+             "--jitter-ms", "0"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+        upstream_url = f"http://127.0.0.1:{port}"
+        wait_ready(f"{upstream_url}/_control", upstream)
+
+    runs = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="plant_workers_") as workdir:
+            for workers in args.workers:
+                runs.append(measure(args, workers, upstream_url, images, workdir))
+    finally:
+        if upstream is not None:
+            stop(upstream)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "app": args.app,
+            "backend": args.backend,
+            "model_path": args.model_path,
+            "cpu_count": os.cpu_count(),
+            "duration_s": args.duration,
+            "image_size": args.image_size,
+            "upstream": {"latency_ms": args.latency_ms} if upstream_url else None
+        },
+        "runs": runs
+    }
+    base = runs[0]
+    print("\n📈 Tăng theo số worker:")
+    for run in runs:
+        speedup = run["throughput_rps"] / base["throughput_rps"] if base["throughput_rps"] else 0
+        print(f"   {run['workers']:3d} worker: {run['throughput_rps']:8.1f} req/s (x{speedup:.2f}), "
+              f"tổng PSS {run['total_pss_mb']:.0f}MB, tổng RSS {run['total_rss_mb']:.0f}MB")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Đã ghi kết quả vào {args.output}")
+
+
+if __name__ == "__main__":
+    main()
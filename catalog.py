@@ -0,0 +1,138 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from jsonrows import RowEncoder
+
+# Thời gian tối đa giữ danh mục trong bộ nhớ (giây); giới hạn độ trễ khi
+# chạy nhiều worker vì invalidate() chỉ có tác dụng trong process hiện tại
+PLANT_CATALOG_TTL = float(os.getenv("PLANT_CATALOG_TTL", 60))
+# Số biến thể (trang, fields) đã serialize được giữ lại
+PLANT_CATALOG_VARIANTS = int(os.getenv("PLANT_CATALOG_VARIANTS", 64))
+
+PLANT_FIELDS = ('id', 'name', 'scientific_name', 'description', 'care_instructions', 'created_at')
+PLANT_ENCODER = RowEncoder([
+    ('id', 'int'), ('name', 'str'), ('scientific_name', 'str'), ('description', 'str'),
+    ('care_instructions', 'str'), ('created_at', 'datetime')
+])
+
+
+class CatalogError(ValueError):
+    pass
+
+
+def parse_fields(fields):
+    """'id,name' -> ('id', 'name'); None -> tất cả các cột"""
+    if not fields:
+        return PLANT_FIELDS
+    selected = tuple(dict.fromkeys(field.strip() for field in fields.split(',') if field.strip()))
+    unknown = [field for field in selected if field not in PLANT_FIELDS]
+    if unknown or not selected:
+        raise CatalogError(f"Unknown fields: {', '.join(unknown)}; allowed: {', '.join(PLANT_FIELDS)}")
+    return selected
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # So sánh yếu: bỏ tiền tố W/
+    candidates = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return etag.removeprefix('W/') in candidates
+
+
+class PlantCatalog:
+    """Danh mục cây trồng giữ trong bộ nhớ, kèm body JSON đã serialize sẵn
+
+    Mỗi lần ghi (POST / DELETE /plants) gọi invalidate() để tăng version.
+    Mỗi biến thể (offset, limit, fields) được serialize một lần cùng ETag.
+    """
+
+    def __init__(self, pool, ttl=PLANT_CATALOG_TTL, max_variants=PLANT_CATALOG_VARIANTS):
+        self.pool = pool
+        self.ttl = ttl
+        self.max_variants = max_variants
+        self.version = 0
+        self._rows = None
+        self._loaded_at = 0
+        self._digest = None
+        self._variants = OrderedDict()
+        self._encoders = {PLANT_FIELDS: PLANT_ENCODER}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.loads = 0
+        self.invalidations = 0
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._rows = None
+            self._variants.clear()
+            self.invalidations += 1
+
+    def _load(self):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT {', '.join(PLANT_FIELDS)} FROM plants ORDER BY name")
+            rows = cursor.fetchall()
+        digest = hashlib.sha1(PLANT_ENCODER.array(rows)).hexdigest()[:16]
+        return rows, digest
+
+    def _current(self):
+        """(rows, digest) mới nhất, đọc lại từ database nếu cần"""
+        with self._lock:
+            if self._rows is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return self._rows, self._digest
+            version = self.version
+
+        rows, digest = self._load()
+        with self._lock:
+            self.loads += 1
+            # Bỏ qua kết quả nếu có ghi xen giữa lúc đang đọc
+            if version == self.version:
+                if digest != self._digest:
+                    self._variants.clear()
+                self._rows, self._digest, self._loaded_at = rows, digest, time.monotonic()
+        return rows, digest
+
+    def get(self, offset=0, limit=None, fields=PLANT_FIELDS):
+        """Trả về (body, etag, total) cho một trang với các cột đã chọn"""
+        rows, digest = self._current()
+        key = (offset, limit, fields)
+        with self._lock:
+            cached = self._variants.get(key)
+            if cached is not None and cached[1].startswith(f'"{digest}'):
+                self._variants.move_to_end(key)
+                self.hits += 1
+                return cached
+
+        encoder = self._encoders.get(fields)
+        if encoder is None:
+            encoder = self._encoders[fields] = PLANT_ENCODER.select(fields)
+        end = None if limit is None else offset + limit
+        body = encoder.array(rows[offset:end])
+        variant = hashlib.sha1(repr(key).encode()).hexdigest()[:8]
+        result = (body, f'"{digest}-{variant}"', len(rows))
+
+        with self._lock:
+            self._variants[key] = result
+            self._variants.move_to_end(key)
+            while len(self._variants) > self.max_variants:
+                self._variants.popitem(last=False)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "version": self.version,
+                "plants": len(self._rows) if self._rows is not None else None,
+                "variants": len(self._variants),
+                "hits": self.hits,
+                "loads": self.loads,
+                "invalidations": self.invalidations,
+                "ttl": self.ttl
+            }
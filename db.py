@@ -0,0 +1,246 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", 8))
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", 30))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+# Page cache cho mỗi connection (KB) và vùng mmap (byte)
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", 16 * 1024))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+SQLITE_CACHED_STATEMENTS = int(os.getenv("SQLITE_CACHED_STATEMENTS", 256))
+
+
+def configure_connection(conn, synchronous=SQLITE_SYNCHRONOUS, cache_size_kb=SQLITE_CACHE_SIZE_KB,
+                         mmap_size=SQLITE_MMAP_SIZE):
+    """WAL cho phép đọc song song với ghi; synchronous=NORMAL chỉ fsync lúc checkpoint"""
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f'PRAGMA synchronous={synchronous}')
+    conn.execute(f'PRAGMA cache_size=-{int(cache_size_kb)}')
+    conn.execute(f'PRAGMA mmap_size={int(mmap_size)}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return conn
+
+
+class SQLitePool:
+    """Pool connection SQLite dùng lại giữa các request
+
+    Mỗi connection giữ cache prepared statement riêng (cached_statements),
+    nên các câu SQL lặp lại không phải parse lại.
+    """
+
+    def __init__(self, path, size=SQLITE_POOL_SIZE, timeout=SQLITE_BUSY_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+        self.checkouts = 0
+        self.waits = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=SQLITE_CACHED_STATEMENTS
+        )
+        return configure_connection(conn)
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                self.waits += 1
+                conn = self._idle.get(timeout=self.timeout)
+        self.checkouts += 1
+        return conn
+
+    def release(self, conn):
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            # Rollback transaction còn dở (lỗi giữa chừng) trước khi trả về pool
+            if conn.in_transaction:
+                conn.rollback()
+            self.release(conn)
+
+    def stream(self, sql, params=(), batch_size=1000, probe=None):
+        """Chạy truy vấn ngay (lỗi SQL báo trước khi trả response), đọc dòng dần theo khối
+
+        probe=(sql, params): truy vấn nhỏ chạy trước trong cùng transaction đọc
+        (cùng snapshot với truy vấn chính), kết quả nằm trong RowStream.probe.
+        """
+        conn = self.acquire()
+        try:
+            probed = None
+            if probe is not None:
+                conn.execute('BEGIN')
+                probed = conn.execute(*probe).fetchall()
+            cursor = conn.execute(sql, params)
+        except Exception:
+            self._finish(conn)
+            raise
+        rows = RowStream(self, conn, cursor, batch_size)
+        rows.probe = probed
+        return rows
+
+    def reader(self):
+        """Connection riêng ngoài pool, chỉ đọc (cho export chạy lâu, không chiếm chỗ trong pool)"""
+        conn = self._connect()
+        conn.execute('PRAGMA query_only=1')
+        return conn
+
+    def keyset_batches(self, select, where, params, key, key_indexes, batch_size=1000):
+        """Đọc truy vấn lớn theo khối trên connection riêng, mỗi khối là một truy vấn keyset
+
+        select là phần SELECT ... FROM ..., where là mệnh đề WHERE (có thể rỗng),
+        key là các cột sắp xếp (duy nhất, vd ('timestamp', 'id')), key_indexes là
+        vị trí của chúng trong dòng. Mỗi khối là một transaction đọc ngắn nên
+        không giữ snapshot suốt quá trình export (WAL checkpoint vẫn chạy được).
+        Khối đầu tiên được đọc ngay để lỗi SQL báo trước khi trả response.
+        """
+        return KeysetReader(self.reader(), select, where, params, key, key_indexes, batch_size)
+
+    def _finish(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self.release(conn)
+
+    def close(self):
+        """Đóng các connection đang rảnh (pool vẫn dùng lại được sau đó)"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "size": self.size,
+            "open": self._created,
+            "idle": self._idle.qsize(),
+            "checkouts": self.checkouts,
+            "waits": self.waits
+        }
+
+
+class RowStream:
+    """Iterator dòng của một truy vấn, đọc bằng fetchmany
+
+    Giữ connection đến khi đọc hết hoặc close() (vd client ngắt kết nối giữa
+    chừng), sau đó trả connection về pool.
+    """
+
+    def __init__(self, pool, conn, cursor, batch_size):
+        self.pool = pool
+        self.conn = conn
+        self.cursor = cursor
+        self.batch_size = batch_size
+        self.probe = None
+        self._batch = iter(())
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            try:
+                return next(self._batch)
+            except StopIteration:
+                pass
+            if self.conn is None:
+                raise StopIteration
+            batch = self.cursor.fetchmany(self.batch_size)
+            if not batch:
+                self.close()
+                raise StopIteration
+            self._batch = iter(batch)
+
+    def batches(self):
+        """Đọc theo từng khối (list dòng) thay vì từng dòng"""
+        try:
+            while self.conn is not None:
+                batch = self.cursor.fetchmany(self.batch_size)
+                if not batch:
+                    break
+                yield batch
+        finally:
+            self.close()
+
+    def close(self):
+        if self.conn is not None:
+            conn, self.conn = self.conn, None
+            self.cursor.close()
+            self.pool._finish(conn)
+
+    def __del__(self):
+        self.close()
+
+
+class KeysetReader:
+    """Đọc theo khối bằng keyset trên connection riêng, đóng connection khi đọc xong hoặc close()"""
+
+    def __init__(self, conn, select, where, params, key, key_indexes, batch_size):
+        self.conn = conn
+        self.key_indexes = tuple(key_indexes)
+        self.batch_size = batch_size
+        order = ', '.join(key)
+        after = f"({order}) > ({', '.join('?' for _ in key)})"
+        self.params = list(params)
+        self.first_sql = f"{select} {where} ORDER BY {order} LIMIT ?"
+        self.next_sql = f"{select} {where + ' AND' if where else 'WHERE'} {after} ORDER BY {order} LIMIT ?"
+        try:
+            self._first = self._fetch(self.first_sql, self.params)
+        except Exception:
+            self.close()
+            raise
+
+    def _fetch(self, sql, params):
+        # fetchall trong một câu lệnh: transaction đọc kết thúc ngay sau khối
+        return self.conn.execute(sql, params + [self.batch_size]).fetchall()
+
+    def batches(self):
+        try:
+            batch, self._first = self._first, None
+            while batch:
+                yield batch
+                if len(batch) < self.batch_size:
+                    break
+                last = batch[-1]
+                batch = self._fetch(self.next_sql, self.params + [last[i] for i in self.key_indexes])
+        finally:
+            self.close()
+
+    def close(self):
+        if self.conn is not None:
+            conn, self.conn = self.conn, None
+            conn.close()
+
+    def __del__(self):
+        self.close()
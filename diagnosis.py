@@ -0,0 +1,138 @@
+import asyncio
+
+import httpx
+
+import metrics
+import tracing
+from backends import create_backend
+from phash_index import PHASH_INDEX_SIZE, NearDuplicateIndex
+from prediction_cache import PredictionCache, cache_key, image_digest
+from resilience import CircuitOpenError
+from singleflight import SingleFlight
+from upstream import UpstreamError
+
+# Backend cho từng loại chẩn đoán, cấu hình qua PLANT_BACKEND / RICE_BACKEND
+backends = {
+    "plant": create_backend("plant"),
+    "rice": create_backend("rice")
+}
+
+prediction_cache = PredictionCache()
+# Mục trong index được tra qua cả hai tầng cache nên kích thước không phụ
+# thuộc cache bộ nhớ (PHASH_INDEX_SIZE)
+near_duplicates = NearDuplicateIndex(capacity=PHASH_INDEX_SIZE)
+# Ảnh giống hệt đang được chẩn đoán thì chờ chung kết quả
+inflight = SingleFlight()
+
+
+async def _cached_result(key):
+    return await prediction_cache.get(key, record=False)
+
+
+async def diagnose(type_plant, image):
+    """Chẩn đoán ảnh với backend của loại cây, dùng lại kết quả đã cache nếu có
+
+    image là bytes hoặc uploads.UploadedImage (đã có sha256, nội dung chỉ
+    được đọc khi cache không có kết quả).
+    """
+    backend = backends[type_plant]
+    model_id = backend.model_id
+    metrics.current_model.set(model_id)
+    tracing.annotate(model=model_id)
+    if isinstance(image, (bytes, bytearray)):
+        image_bytes, digest = bytes(image), image_digest(image)
+    else:
+        image_bytes, digest = None, image.digest
+    key = cache_key(model_id, digest)
+    with metrics.stage("cache_lookup"):
+        result = await prediction_cache.get(key)
+    if result is not None:
+        tracing.annotate(cache="hit")
+        return result
+
+    if inflight.running(key):
+        # Ảnh giống hệt đang được chẩn đoán bởi request khác, không cần đọc upload
+        tracing.annotate(cache="coalesced")
+        with metrics.stage("coalesced_wait"):
+            return await inflight.do(key, lambda: _diagnose_uncached(backend, key, image_bytes))
+    tracing.annotate(cache="miss")
+    if image_bytes is None:
+        # Đọc trước khi bắt đầu task chung: task có thể chạy lâu hơn request
+        # này, còn file upload bị đóng khi request kết thúc
+        image_bytes = await image.read()
+    return await inflight.do(key, lambda: _diagnose_uncached(backend, key, image_bytes))
+
+
+async def _diagnose_uncached(backend, key, image_bytes):
+    model_id = backend.model_id
+
+    # Ảnh gửi lại sau khi bị resize / nén lại: tra theo hash cảm nhận
+    value_hash = None
+    result = None
+    if near_duplicates.enabled:
+        with metrics.stage("phash"):
+            value_hash = await asyncio.to_thread(near_duplicates.compute, image_bytes)
+            if value_hash is not None:
+                result = await near_duplicates.lookup(model_id, value_hash, resolve=_cached_result)
+    if result is not None:
+        prediction_cache.set(key, result)
+        return result
+
+    with metrics.stage("inference"):
+        result = await backend.predict(image_bytes)
+    # Chỉ cache phản hồi hợp lệ, không cache lỗi từ Roboflow hay kết quả fallback
+    if 'predictions' in result and 'fallback' not in result:
+        prediction_cache.set(key, result)
+        if value_hash is not None:
+            near_duplicates.add(model_id, value_hash, key)
+    return result
+
+
+async def diagnose_plant(image):
+    """Chẩn đoán bệnh cây trồng tổng quát"""
+    return await diagnose("plant", image)
+
+
+async def diagnose_rice(image):
+    """Chẩn đoán bệnh lúa"""
+    return await diagnose("rice", image)
+
+
+def best_prediction(type_plant, result):
+    """Dự đoán được chọn: kết quả đầu tiên với cây trồng, tin cậy cao nhất với lúa"""
+    if 'predictions' not in result or not result['predictions']:
+        return None
+    if type_plant == "rice":
+        return max(result['predictions'], key=lambda x: x['confidence'])
+    return result['predictions'][0]
+
+
+def error_status(error):
+    """Mã HTTP cho lỗi khi chẩn đoán: 503 khi circuit breaker đang mở, 502 khi Roboflow lỗi / quá hạn"""
+    if isinstance(error, CircuitOpenError):
+        return 503
+    if isinstance(error, (UpstreamError, httpx.HTTPError, asyncio.TimeoutError)):
+        return 502
+    return 500
+
+
+def cache_stats():
+    stats = prediction_cache.stats()
+    stats["near_duplicates"] = near_duplicates.stats()
+    stats["single_flight"] = inflight.stats()
+    return stats
+
+
+def backend_info():
+    return {type_plant: backend.info() for type_plant, backend in backends.items()}
+
+
+async def startup():
+    for backend in backends.values():
+        await backend.startup()
+
+
+async def shutdown():
+    for backend in backends.values():
+        await backend.shutdown()
+    prediction_cache.close()
@@ -0,0 +1,209 @@
+import csv
+import io
+import os
+import threading
+from datetime import datetime, timezone
+
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+# Số dòng mỗi lần đọc từ database, cũng là kích thước một row group Parquet
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", 10000))
+EXPORT_PARQUET_COMPRESSION = os.getenv("EXPORT_PARQUET_COMPRESSION", "zstd")
+# Số export chạy cùng lúc, mỗi export giữ một connection database đến khi client đọc xong
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", 2))
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet"
+}
+
+
+class ExportError(ValueError):
+    pass
+
+
+class ExportBusy(ExportError):
+    pass
+
+
+_export_slots = threading.BoundedSemaphore(max(1, EXPORT_MAX_CONCURRENT))
+
+
+def acquire_slot():
+    """Giữ một chỗ export, raise ExportBusy nếu đã đủ EXPORT_MAX_CONCURRENT export"""
+    if not _export_slots.acquire(blocking=False):
+        raise ExportBusy("Too many exports in progress, retry later")
+
+
+def release_slot():
+    _export_slots.release()
+
+
+def check_format(export_format):
+    """Kiểm tra định dạng trước khi mở truy vấn; Parquet cần pyarrow"""
+    if export_format not in EXPORT_FORMATS:
+        raise ExportError(f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    if export_format == "parquet":
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            raise ExportError("Parquet export requires pyarrow")
+
+
+def _csv_value(kind):
+    if kind == "bool":
+        return lambda value: '' if value is None else ('true' if value else 'false')
+    return None
+
+
+def csv_chunks(columns, batches):
+    """Header rồi mỗi khối dòng thành một đoạn CSV (bytes)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in columns])
+    yield buffer.getvalue().encode('utf-8')
+
+    converters = []
+    for i, (_, kind) in enumerate(columns):
+        convert = _csv_value(kind)
+        if convert is not None:
+            converters.append((i, convert))
+    for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        if converters:
+            batch = [list(row) for row in batch]
+            for row in batch:
+                for i, convert in converters:
+                    row[i] = convert(row[i])
+        writer.writerows(batch)
+        yield buffer.getvalue().encode('utf-8')
+
+
+class _ChunkSink(io.RawIOBase):
+    """File chỉ ghi cho ParquetWriter, giữ phần đã ghi cho đến khi take()"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _arrow_column(pa, kind, values):
+    if kind == "datetime":
+        if any(isinstance(value, str) for value in values):
+            # SQLite lưu timestamp dạng chuỗi 'YYYY-MM-DD HH:MM:SS'
+            return pa.array(values, pa.string()).cast(pa.timestamp('us'))
+        return pa.array(values, pa.timestamp('us'))
+    if kind == "bool":
+        return pa.array([None if value is None else bool(value) for value in values], pa.bool_())
+    types = {"int": pa.int64(), "float": pa.float64(), "str": pa.string()}
+    return pa.array(values, types[kind])
+
+
+def parquet_chunks(columns, batches, compression=EXPORT_PARQUET_COMPRESSION):
+    """Mỗi khối dòng thành một row group Parquet, gửi đi ngay sau khi ghi"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {"int": pa.int64(), "float": pa.float64(), "str": pa.string(),
+             "bool": pa.bool_(), "datetime": pa.timestamp('us')}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression=compression)
+    closed = False
+    try:
+        for batch in batches:
+            arrays = [
+                _arrow_column(pa, kind, [row[i] for row in batch])
+                for i, (_, kind) in enumerate(columns)
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.take()
+        # Footer chỉ được ghi khi đóng writer
+        writer.close()
+        closed = True
+        yield sink.take()
+    finally:
+        if not closed:
+            writer.close()
+
+
+class _ReleaseAfter:
+    """Iterator bọc các đoạn response, gọi release() đúng một lần khi hết, lỗi
+    hoặc bị thu gom (client ngắt trước khi đọc đoạn đầu tiên)"""
+
+    def __init__(self, chunks, release):
+        self.chunks = chunks
+        self.release = release
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.chunks)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self.release is not None:
+            release, self.release = self.release, None
+            try:
+                self.chunks.close()
+            finally:
+                release()
+
+    def __del__(self):
+        self.close()
+
+
+class ExportResponse(StreamingResponse):
+    """StreamingResponse gọi release() khi kết thúc gửi, kể cả khi client ngắt
+    trước khi đoạn đầu tiên được đọc (generator chưa bao giờ chạy)"""
+
+    def __init__(self, chunks, release=None, **kwargs):
+        self.release_after = _ReleaseAfter(chunks, release) if release is not None else None
+        super().__init__(self.release_after or chunks, **kwargs)
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.release_after is not None:
+                # Đóng cursor / connection có thể chặn, không chạy trên event loop
+                await run_in_threadpool(self.release_after.close)
+
+
+def export_response(export_format, columns, batches, name="diagnoses", release=None):
+    """StreamingResponse CSV / Parquet từ iterator các khối dòng (list tuple)
+
+    columns là [(tên cột, kind)] với kind thuộc int / float / str / bool / datetime.
+    release() (vd đóng connection + release_slot) được gọi đúng một lần khi
+    response gửi xong, lỗi hoặc client ngắt.
+    """
+    chunks = csv_chunks(columns, batches) if export_format == "csv" else parquet_chunks(columns, batches)
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')
+    return ExportResponse(
+        chunks,
+        release=release,
+        media_type=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{name}-{stamp}.{export_format}"'}
+    )
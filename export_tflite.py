@@ -0,0 +1,54 @@
+"""Export model Keras (.h5) sang TFLite để chạy nhiều worker dùng chung trọng số
+
+Ghi ra file .tflite và file tên lớp .classes.json bên cạnh, dùng với
+PLANT_BACKEND=tflite (backends.TFLiteBackend) và serve.py.
+
+Sử dụng:
+    python export_tflite.py --model plant_disease_model.h5
+    python export_tflite.py --model rice_disease_model.h5 --architecture kaggle --class-names rice_classes.txt
+"""
+import argparse
+import json
+import os
+
+from backends import _load_class_names, check_class_count, tflite_class_names_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export model Keras sang TFLite")
+    parser.add_argument("--model", default="plant_disease_model.h5", help="File model Keras (.h5)")
+    parser.add_argument("--output", help="File .tflite (mặc định cùng tên với model)")
+    parser.add_argument("--architecture", choices=["cnn", "kaggle"], default="cnn")
+    parser.add_argument("--class-names", help="File tên lớp (.json hoặc mỗi dòng một lớp)")
+    parser.add_argument("--float16", action="store_true", help="Lưu trọng số float16 (file nhỏ bằng một nửa)")
+    args = parser.parse_args()
+
+    import tensorflow as tf
+    from model import PlantDiseaseModel
+
+    plant_model = PlantDiseaseModel()
+    if args.architecture == "kaggle":
+        from model_kaggle_inspired import KaggleInspiredPlantModel
+        plant_model.model = KaggleInspiredPlantModel().load_model(args.model)
+    else:
+        plant_model.load_model(args.model)
+    class_names = _load_class_names(args.class_names) or plant_model.class_names
+    check_class_count(args.model, plant_model.model.output_shape[-1], class_names)
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(plant_model.model)
+    if args.float16:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    content = converter.convert()
+
+    output = args.output or os.path.splitext(args.model)[0] + ".tflite"
+    with open(output, 'wb') as f:
+        f.write(content)
+    with open(tflite_class_names_path(output), 'w', encoding='utf-8') as f:
+        json.dump(class_names, f, ensure_ascii=False, indent=2)
+
+    print(f"✅ Đã export {args.model} -> {output} ({len(content) / 1024 / 1024:.1f} MB, {len(class_names)} lớp)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Server giả lập Roboflow để thử nghiệm offline
+
+Độ trễ và lỗi có thể chỉnh bằng tham số dòng lệnh hoặc lúc đang chạy qua
+POST /_control, vd {"latency_ms": 200, "error_rate": 0.3}.
+
+Sử dụng:
+    python fake_upstream.py --port 9000 --latency-ms 80 --slow-rate 0.05 --slow-ms 2000
+    ROBOFLOW_URL=http://localhost:9000 uvicorn api:app
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from fastapi import FastAPI, File, Request, UploadFile
+from fastapi.responses import JSONResponse
+
+PLANT_CLASSES = ["Tomato___Late_blight", "Apple___healthy", "Potato___Early_blight", "Corn___Common_rust"]
+RICE_CLASSES = ["brown spot disease", "rice blast disease", "bacterial leaf blight disease", "healthy rice"]
+
+app = FastAPI(title="Fake Roboflow")
+
+settings = {
+    "latency_ms": 50.0,      # độ trễ trung bình
+    "jitter_ms": 10.0,       # độ lệch (phân phối chuẩn)
+    "slow_rate": 0.0,        # tỉ lệ request rơi vào đuôi chậm
+    "slow_ms": 2000.0,       # độ trễ của đuôi chậm
+    "error_rate": 0.0,       # tỉ lệ trả về 500
+    "hang_rate": 0.0         # tỉ lệ request không bao giờ trả lời
+}
+counters = {"requests": 0, "errors": 0, "slow": 0, "hangs": 0}
+
+
+def fake_predictions(model_id, size):
+    classes = RICE_CLASSES if "rice" in model_id else PLANT_CLASSES
+    # Cùng ảnh (cùng kích thước) luôn cho cùng kết quả
+    rng = random.Random(size)
+    scores = sorted((rng.random() for _ in classes), reverse=True)
+    total = sum(scores)
+    return [
+        {"class": name, "confidence": round(score / total, 4)}
+        for name, score in zip(rng.sample(classes, len(classes)), scores)
+    ]
+
+
+@app.post("/_control")
+async def control(request: Request):
+    settings.update({key: float(value) for key, value in (await request.json()).items() if key in settings})
+    return {"settings": settings, "counters": counters}
+
+
+@app.get("/_control")
+async def get_control():
+    return {"settings": settings, "counters": counters}
+
+
+@app.post("/{model_id:path}")
+async def infer(model_id: str, file: UploadFile = File(...), api_key: str = None):
+    started = time.perf_counter()
+    counters["requests"] += 1
+    image_bytes = await file.read()
+
+    if random.random() < settings["hang_rate"]:
+        counters["hangs"] += 1
+        await asyncio.sleep(3600)
+
+    delay = max(0.0, random.gauss(settings["latency_ms"], settings["jitter_ms"]))
+    if random.random() < settings["slow_rate"]:
+        counters["slow"] += 1
+        delay = settings["slow_ms"]
+    await asyncio.sleep(delay / 1000)
+
+    if random.random() < settings["error_rate"]:
+        counters["errors"] += 1
+        return JSONResponse(status_code=500, content={"message": "Injected upstream error"})
+
+    return {
+        "time": time.perf_counter() - started,
+        "image": {"size": len(image_bytes)},
+        "predictions": fake_predictions(model_id, len(image_bytes))
+    }
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Server giả lập Roboflow với độ trễ / lỗi tuỳ chỉnh")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    for key, value in settings.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=float, default=value)
+    args = parser.parse_args()
+    settings.update({key: getattr(args, key) for key in settings})
+
+    print(f"🧪 Fake Roboflow: http://{args.host}:{args.port} {settings}")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import json
+import math
+import os
+from json.encoder import encode_basestring
+
+from fastapi.responses import Response, StreamingResponse
+
+import metrics
+
+# Số dòng mỗi khối khi stream danh sách lớn
+JSON_STREAM_CHUNK_ROWS = int(os.getenv("JSON_STREAM_CHUNK_ROWS", 1000))
+# Danh sách nhiều hơn số dòng này thì trả về dạng stream thay vì một body
+JSON_STREAM_THRESHOLD = int(os.getenv("JSON_STREAM_THRESHOLD", 2000))
+# limit tối đa cho các endpoint danh sách (/diagnoses, /history)
+LIST_MAX_LIMIT = int(os.getenv("LIST_MAX_LIMIT", 10000))
+
+
+def _str(value):
+    return 'null' if value is None else encode_basestring(value)
+
+
+def _int(value):
+    return 'null' if value is None else str(int(value))
+
+
+def _float(value):
+    if value is None:
+        return 'null'
+    value = float(value)
+    # JSON không có NaN / Infinity
+    return repr(value) if math.isfinite(value) else 'null'
+
+
+def _bool(value):
+    if value is None:
+        return 'null'
+    return 'true' if value else 'false'
+
+
+def _datetime(value):
+    if value is None:
+        return 'null'
+    if isinstance(value, str):
+        return encode_basestring(value)
+    return '"' + value.isoformat() + '"'
+
+
+def _any(value):
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+CONVERTERS = {
+    "str": _str,
+    "int": _int,
+    "float": _float,
+    "bool": _bool,
+    "datetime": _datetime,
+    "any": _any
+}
+
+
+class RowEncoder:
+    """Encode dòng DB (tuple) thẳng thành JSON object, không qua dict / pydantic
+
+    columns là [(key, kind), ...] theo thứ tự cột trong dòng, kind thuộc
+    CONVERTERS. Hàm encode cho từng bộ cột được sinh code một lần: key đã
+    escape sẵn, mỗi giá trị chỉ qua một hàm chuyển đổi.
+    indexes chọn một phần các cột (vd fields=id,name), mặc định lấy tất cả.
+    """
+
+    def __init__(self, columns, indexes=None):
+        self.columns = tuple(columns)
+        if indexes is None:
+            indexes = range(len(self.columns))
+        self.indexes = tuple(indexes)
+        self.keys = tuple(self.columns[i][0] for i in self.indexes)
+
+        namespace = {}
+        parts = []
+        for position, index in enumerate(self.indexes):
+            key, kind = self.columns[index]
+            namespace[f"_c{index}"] = CONVERTERS[kind]
+            prefix = ('{' if position == 0 else ',') + encode_basestring(key) + ':'
+            parts.append(f"{prefix!r} + _c{index}(row[{index}])")
+        body = " + ".join(parts) + " + '}'" if parts else "'{}'"
+        source = f"def encode(row):\n    return {body}\n"
+        exec(compile(source, f"<RowEncoder {','.join(self.keys)}>", "exec"), namespace)
+        self.encode = namespace["encode"]
+
+    def select(self, keys):
+        """Encoder chỉ gồm các cột keys (giữ thứ tự keys)"""
+        positions = {key: i for i, (key, _) in enumerate(self.columns)}
+        return RowEncoder(self.columns, [positions[key] for key in keys])
+
+    def array(self, rows):
+        """Cả danh sách thành một body JSON (bytes)"""
+        encode = self.encode
+        return ('[' + ','.join([encode(row) for row in rows]) + ']').encode('utf-8')
+
+    def stream(self, rows, chunk_rows=JSON_STREAM_CHUNK_ROWS, prefix='', suffix=None):
+        """Sinh body JSON theo từng khối chunk_rows dòng: prefix + [ ... ] + suffix
+
+        suffix(count, last_row) trả về phần đuôi (vd các key còn lại của object),
+        được gọi sau khi đã đọc hết rows nên có thể dùng số dòng / dòng cuối.
+        """
+        encode = self.encode
+        count = 0
+        last = None
+        chunk = []
+        opening = prefix + '['
+        for row in rows:
+            chunk.append(encode(row))
+            count += 1
+            last = row
+            if len(chunk) >= chunk_rows:
+                yield (opening + ','.join(chunk)).encode('utf-8')
+                opening = ','
+                chunk.clear()
+        if chunk:
+            opening += ','.join(chunk)
+        elif count:
+            opening = ''
+        tail = ']' + (suffix(count, last) if suffix is not None else '')
+        yield (opening + tail).encode('utf-8')
+
+
+def encode_fields(**fields):
+    """Phần đuôi của object: ,"key":value,... (dùng làm suffix cho stream)"""
+    return ''.join(',' + encode_basestring(key) + ':' + _any(value) for key, value in fields.items()) + '}'
+
+
+def list_response(encoder, rows, stream, prefix='', suffix=None, headers=None):
+    """Response JSON cho danh sách dòng: stream theo khối nếu stream=True, không thì một body"""
+    if stream:
+        return StreamingResponse(encoder.stream(rows, prefix=prefix, suffix=suffix),
+                                 media_type="application/json", headers=headers)
+    with metrics.stage("serialize"):
+        body = b''.join(encoder.stream(rows, chunk_rows=LIST_MAX_LIMIT, prefix=prefix, suffix=suffix))
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,181 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from fastapi.responses import JSONResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess
+)
+from prometheus_client.core import GaugeMetricFamily
+from starlette.routing import Match
+
+import tracing
+
+# Chạy nhiều worker (serve.py đặt biến này): mỗi worker ghi số liệu ra file
+# trong thư mục, /metrics cộng gộp các file nên worker nào trả lời cũng như nhau
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
+
+# Endpoint / model của request hiện tại, dùng làm label cho các stage
+current_endpoint = ContextVar("current_endpoint", default="")
+current_model = ContextVar("current_model", default="")
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+REQUEST_LATENCY = Histogram(
+    "plant_api_request_seconds", "Thời gian xử lý request",
+    ["endpoint", "method", "status"], buckets=LATENCY_BUCKETS
+)
+STAGE_LATENCY = Histogram(
+    "plant_api_stage_seconds", "Thời gian từng bước trong request (đọc upload, gọi upstream, ghi DB...)",
+    ["endpoint", "model", "stage"], buckets=LATENCY_BUCKETS
+)
+IN_FLIGHT = Gauge("plant_api_in_flight_requests", "Số request đang xử lý", ["endpoint"],
+                  multiprocess_mode="livesum")
+UPSTREAM_ERRORS = Counter("plant_api_upstream_errors_total", "Lỗi khi gọi upstream", ["model", "kind"])
+
+
+# Cache child histogram theo bộ label, tránh labels() tra cứu + khoá mỗi lần
+_stage_children = {}
+
+
+def _stage_child(endpoint, model, name):
+    key = (endpoint, model, name)
+    child = _stage_children.get(key)
+    if child is None:
+        child = _stage_children[key] = STAGE_LATENCY.labels(endpoint, model, name)
+    return child
+
+
+@contextmanager
+def stage(name, model=None):
+    """Đo thời gian một bước, label endpoint / model lấy từ context nếu không truyền"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        _stage_child(
+            current_endpoint.get(), model if model is not None else current_model.get(), name
+        ).observe(elapsed)
+        tracing.record(name, elapsed)
+
+
+def timed(name):
+    """Decorator đo thời gian hàm đồng bộ như một stage"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def upstream_error(model, kind):
+    UPSTREAM_ERRORS.labels(model, kind).inc()
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse đo thời gian serialize body (stage "serialize")"""
+
+    def render(self, content):
+        with stage("serialize"):
+            return super().render(content)
+
+
+class StatsCollector:
+    """Xuất các dict thống kê sẵn có (cache, pool, write-behind...) thành gauge
+
+    Chỉ lấy giá trị số; dict lồng nhau được nối tên bằng dấu chấm. Khi chạy
+    nhiều worker, đây là số liệu của worker trả lời /metrics (label worker).
+    """
+
+    def __init__(self, worker=None):
+        self.sources = {}
+        self.worker = worker
+
+    def register(self, source, fn):
+        self.sources[source] = fn
+
+    def collect(self):
+        labels = ["source", "stat"] + (["worker"] if self.worker is not None else [])
+        extra = [self.worker] if self.worker is not None else []
+        family = GaugeMetricFamily("plant_api_stats", "Thống kê nội bộ (cache, pool, upstream)", labels=labels)
+        for source, fn in list(self.sources.items()):
+            try:
+                stats = fn()
+            except Exception:
+                continue
+            for stat, value in _flatten(stats):
+                family.add_metric([source, stat] + extra, value)
+        yield family
+
+
+def _flatten(value, prefix=""):
+    if isinstance(value, bool):
+        yield prefix, float(value)
+    elif isinstance(value, (int, float)):
+        yield prefix, value
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            yield from _flatten(item, f"{prefix}.{key}" if prefix else str(key))
+
+
+stats_collector = StatsCollector(os.getenv("SERVE_WORKER_ID", "0") if PROMETHEUS_MULTIPROC_DIR else None)
+REGISTRY.register(stats_collector)
+
+
+def register_stats(source, fn):
+    stats_collector.register(source, fn)
+
+
+def render_latest():
+    if PROMETHEUS_MULTIPROC_DIR:
+        # Registry mới mỗi lần: đọc file của tất cả worker (kể cả worker đã chết)
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(stats_collector)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    """Đo thời gian và số request đang chạy theo route (dạng /plants/{plant_id})"""
+
+    def __init__(self, app, router, exclude=("/metrics",)):
+        self.app = app
+        self.router = router
+        self.exclude = exclude
+
+    def _endpoint(self, scope):
+        for route in self.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = self._endpoint(scope)
+        token = current_endpoint.set(endpoint)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        in_flight = IN_FLIGHT.labels(endpoint)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            REQUEST_LATENCY.labels(endpoint, scope["method"], str(status[0])).observe(time.perf_counter() - started)
+            current_endpoint.reset(token)
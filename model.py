@@ -2,6 +2,7 @@ import tensorflow as tf
 from tensorflow.keras import layers, models
 import numpy as np
 import cv2
+import io
 from PIL import Image
 
 class PlantDiseaseModel:
@@ -54,6 +55,29 @@ class PlantDiseaseModel:
         image = image.astype('float32') / 255.0
         return np.expand_dims(image, axis=0)
     
+    def preprocess_bytes(self, image_bytes):
+        """Tiền xử lý ảnh từ bytes (ảnh upload) giống preprocess_image"""
+        image = Image.open(io.BytesIO(image_bytes))
+        image.draft('RGB', (224, 224))
+        image = image.convert('RGB').resize((224, 224))
+        image = np.asarray(image, dtype='float32') / 255.0
+        return np.expand_dims(image, axis=0)
+    
+    def predict_batch(self, images, top_k=5):
+        """Dự đoán cho một batch ảnh đã tiền xử lý, trả về top_k lớp cho mỗi ảnh"""
+        if self.model is None:
+            raise ValueError("Model chưa được tạo hoặc load")
+        
+        probabilities = np.asarray(self.model(images, training=False))
+        results = []
+        for probs in probabilities:
+            top = np.argsort(probs)[::-1][:top_k]
+            results.append([
+                {'class': self.class_names[i], 'confidence': float(probs[i])}
+                for i in top
+            ])
+        return results
+    
     def predict(self, image_path):
         if self.model is None:
             raise ValueError("Model chưa được tạo hoặc load")
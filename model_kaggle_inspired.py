@@ -129,6 +129,11 @@ class KaggleInspiredPlantModel:
         
         print("✅ Model unfrozen for fine-tuning")
     
+    def load_model(self, filepath):
+        """Load model đã train (không compile vì dùng FocalLoss tùy chỉnh)"""
+        self.model = tf.keras.models.load_model(filepath, compile=False)
+        return self.model
+    
     def predict_with_tta(self, image, tta_steps=5):
         """Test Time Augmentation như Kaggle"""
         if self.model is None:
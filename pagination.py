@@ -0,0 +1,81 @@
+import base64
+import json
+from datetime import timezone
+
+
+class CursorError(ValueError):
+    pass
+
+
+def encode_cursor(timestamp, row_id):
+    """Cursor mờ cho keyset pagination theo (timestamp, id) giảm dần"""
+    if hasattr(timestamp, 'isoformat'):
+        timestamp = timestamp.isoformat(sep=' ')
+    raw = json.dumps([timestamp, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return str(timestamp), int(row_id)
+    except Exception:
+        raise CursorError("Invalid cursor")
+
+
+def sqlite_time(value):
+    """datetime -> chuỗi cùng định dạng CURRENT_TIMESTAMP của SQLite (UTC)
+
+    datetime có múi giờ (vd since=2026-01-01T07:00:00+07:00) được đổi sang UTC
+    trước, datetime không múi giờ được coi là UTC.
+    """
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def diagnosis_filters(placeholder='?', prefix='', type_plant=None, disease=None, min_confidence=None,
+                      max_confidence=None, since=None, until=None, cursor=None):
+    """Sinh mệnh đề WHERE cho danh sách chẩn đoán
+
+    since/until đã được chuyển sang kiểu mà database so sánh được với cột
+    timestamp. Trả về (sql, params), sql rỗng nếu không có điều kiện.
+    """
+    conditions = []
+    params = []
+
+    def add(condition, *values):
+        conditions.append(condition.replace('?', placeholder))
+        params.extend(values)
+
+    if type_plant is not None:
+        add(f'{prefix}type = ?', type_plant)
+    if disease is not None:
+        add(f'{prefix}disease = ?', disease)
+    if min_confidence is not None:
+        add(f'{prefix}confidence >= ?', min_confidence)
+    if max_confidence is not None:
+        add(f'{prefix}confidence <= ?', max_confidence)
+    if since is not None:
+        add(f'{prefix}timestamp >= ?', since)
+    if until is not None:
+        add(f'{prefix}timestamp < ?', until)
+    if cursor is not None:
+        timestamp, row_id = decode_cursor(cursor)
+        # So sánh row value dùng được index (timestamp, id)
+        add(f'({prefix}timestamp, {prefix}id) < (?, ?)', timestamp, row_id)
+
+    if not conditions:
+        return '', params
+    return 'WHERE ' + ' AND '.join(conditions), params
+
+
+def next_cursor(rows, limit, timestamp_index, id_index):
+    """Cursor cho trang tiếp theo, None nếu đã hết"""
+    if len(rows) < limit or not rows:
+        return None
+    last = rows[-1]
+    return encode_cursor(last[timestamp_index], last[id_index])
@@ -0,0 +1,222 @@
+import io
+import math
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from prediction_cache import PREDICTION_CACHE_DB, PREDICTION_CACHE_DB_SIZE, PREDICTION_CACHE_SIZE
+
+# Thuật toán hash: "dhash" (nhanh) hoặc "phash" (bền hơn với nén lại JPEG)
+PHASH_ALGORITHM = os.getenv("PHASH_ALGORITHM", "dhash")
+# Khoảng cách Hamming tối đa để coi hai ảnh là trùng, 0 để tắt
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", 4))
+# Số ảnh trong index mỗi model (khoảng 0.6 KB bộ nhớ mỗi mục). Mục trỏ tới
+# kết quả trong cache (bộ nhớ hoặc đĩa) nên mặc định bằng tầng cache lớn nhất
+PHASH_INDEX_SIZE = int(os.getenv(
+    "PHASH_INDEX_SIZE", PREDICTION_CACHE_DB_SIZE if PREDICTION_CACHE_DB else PREDICTION_CACHE_SIZE
+))
+# Hash có ít hơn số bit 1 (hoặc bit 0) này là ảnh gần như đồng màu / ít chi
+# tiết, nhiều ảnh khác nhau cho cùng hash nên không dùng để so trùng
+PHASH_MIN_BITS = int(os.getenv("PHASH_MIN_BITS", 8))
+
+HASH_BITS = 64
+
+_DCT_SIZE = 32
+_DCT_KEEP = 8
+_DCT_COS = [
+    [math.cos(math.pi * (2 * x + 1) * u / (2 * _DCT_SIZE)) for x in range(_DCT_SIZE)]
+    for u in range(_DCT_KEEP)
+]
+
+
+def _load_gray(image_bytes, size):
+    image = Image.open(io.BytesIO(image_bytes))
+    # Với JPEG, draft() giải mã ở độ phân giải giảm nên nhanh hơn nhiều
+    image.draft('L', (size[0] * 4, size[1] * 4))
+    return image.convert('L').resize(size, Image.BILINEAR)
+
+
+def dhash(image_bytes):
+    """Difference hash 64 bit"""
+    pixels = list(_load_gray(image_bytes, (9, 8)).getdata())
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def phash(image_bytes):
+    """Perceptual hash 64 bit dựa trên DCT 32x32"""
+    pixels = list(_load_gray(image_bytes, (_DCT_SIZE, _DCT_SIZE)).getdata())
+    rows = [pixels[y * _DCT_SIZE:(y + 1) * _DCT_SIZE] for y in range(_DCT_SIZE)]
+
+    # DCT theo hàng, chỉ giữ 8 hệ số tần số thấp
+    row_dct = [
+        [sum(c * p for c, p in zip(cos_v, row)) for cos_v in _DCT_COS]
+        for row in rows
+    ]
+    coefficients = [
+        sum(_DCT_COS[u][y] * row_dct[y][v] for y in range(_DCT_SIZE))
+        for u in range(_DCT_KEEP)
+        for v in range(_DCT_KEEP)
+    ]
+
+    median = sorted(coefficients[1:])[len(coefficients[1:]) // 2]
+    value = 0
+    for coefficient in coefficients:
+        value = (value << 1) | (coefficient > median)
+    return value
+
+
+def low_entropy(value_hash, min_bits=PHASH_MIN_BITS, bits=HASH_BITS):
+    ones = value_hash.bit_count()
+    return min(ones, bits - ones) < min_bits
+
+
+def image_hash(image_bytes, algorithm=PHASH_ALGORITHM):
+    """Tính hash cảm nhận, trả về None nếu không giải mã được ảnh"""
+    try:
+        if algorithm == "phash":
+            return phash(image_bytes)
+        return dhash(image_bytes)
+    except Exception:
+        return None
+
+
+class MultiIndexHash:
+    """Multi-index hashing: chia hash thành (d + 1) đoạn, hai hash cách nhau
+    không quá d bit chắc chắn trùng khớp ít nhất một đoạn"""
+
+    def __init__(self, max_distance=PHASH_MAX_DISTANCE, capacity=PHASH_INDEX_SIZE, bits=HASH_BITS):
+        self.max_distance = max_distance
+        self.capacity = capacity
+        chunks = max_distance + 1
+        width, extra = divmod(bits, chunks)
+        self._spans = []
+        shift = 0
+        for i in range(chunks):
+            size = width + (1 if i < extra else 0)
+            self._spans.append((shift, (1 << size) - 1))
+            shift += size
+        self._tables = [{} for _ in self._spans]
+        self._items = OrderedDict()  # hash -> value, theo thứ tự thêm vào
+        self._lock = threading.Lock()
+
+    def _chunks(self, value):
+        return [(value >> shift) & mask for shift, mask in self._spans]
+
+    def add(self, value_hash, value):
+        with self._lock:
+            if value_hash in self._items:
+                self._items[value_hash] = value
+                self._items.move_to_end(value_hash)
+                return
+            self._items[value_hash] = value
+            for table, chunk in zip(self._tables, self._chunks(value_hash)):
+                table.setdefault(chunk, set()).add(value_hash)
+            while len(self._items) > self.capacity:
+                oldest, _ = self._items.popitem(last=False)
+                self._unlink(oldest)
+
+    def _unlink(self, value_hash):
+        for table, chunk in zip(self._tables, self._chunks(value_hash)):
+            bucket = table.get(chunk)
+            if bucket is not None:
+                bucket.discard(value_hash)
+                if not bucket:
+                    del table[chunk]
+
+    def remove(self, value_hash):
+        with self._lock:
+            if self._items.pop(value_hash, None) is not None:
+                self._unlink(value_hash)
+
+    def search(self, value_hash):
+        """Trả về [(hash, value, khoảng cách)] trong ngưỡng, gần nhất trước"""
+        matches = {}
+        with self._lock:
+            for table, chunk in zip(self._tables, self._chunks(value_hash)):
+                for candidate in table.get(chunk, ()):
+                    if candidate not in matches:
+                        distance = (candidate ^ value_hash).bit_count()
+                        if distance <= self.max_distance:
+                            matches[candidate] = (candidate, self._items[candidate], distance)
+        return sorted(matches.values(), key=lambda match: match[2])
+
+    def __len__(self):
+        return len(self._items)
+
+
+class NearDuplicateIndex:
+    """Chỉ mục ảnh gần trùng theo từng model
+
+    Index nằm trong bộ nhớ của process: sau khi khởi động lại, ảnh chỉ được
+    so trùng với các ảnh đã chẩn đoán từ lúc đó, dù kết quả cũ vẫn còn trên đĩa.
+    """
+
+    def __init__(self, max_distance=PHASH_MAX_DISTANCE, capacity=PHASH_INDEX_SIZE,
+                 algorithm=PHASH_ALGORITHM, min_bits=PHASH_MIN_BITS):
+        self.max_distance = max_distance
+        self.capacity = capacity
+        self.algorithm = algorithm
+        self.min_bits = min_bits
+        self.enabled = max_distance > 0
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.low_entropy = 0
+
+    def compute(self, image_bytes):
+        """Hash của ảnh, None nếu không giải mã được hoặc ảnh quá ít chi tiết để so trùng"""
+        value_hash = image_hash(image_bytes, self.algorithm)
+        if value_hash is not None and low_entropy(value_hash, self.min_bits):
+            self.low_entropy += 1
+            return None
+        return value_hash
+
+    def _index(self, model_id):
+        with self._lock:
+            index = self._indexes.get(model_id)
+            if index is None:
+                index = MultiIndexHash(self.max_distance, self.capacity)
+                self._indexes[model_id] = index
+            return index
+
+    async def lookup(self, model_id, value_hash, resolve=None):
+        """Tìm ảnh gần trùng, thử lần lượt từ gần nhất; await resolve() đổi
+        value đã lưu thành kết quả (vd tra cache cả bộ nhớ lẫn đĩa), trả về
+        None nếu kết quả đó không còn (khi đó bản ghi bị xóa khỏi index)"""
+        index = self._index(model_id)
+        for candidate, value, _ in index.search(value_hash):
+            if resolve is not None:
+                value = await resolve(value)
+            if value is not None:
+                self.hits += 1
+                return value
+            index.remove(candidate)
+            self.stale += 1
+        self.misses += 1
+        return None
+
+    def add(self, model_id, value_hash, value):
+        self._index(model_id).add(value_hash, value)
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "algorithm": self.algorithm,
+            "max_distance": self.max_distance,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "low_entropy": self.low_entropy,
+            "capacity": self.capacity,
+            "entries": {model_id: len(index) for model_id, index in self._indexes.items()}
+        }
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import os
+import sqlite3
+
+# Số dòng ghi trong mỗi transaction
+PLANTS_BULK_CHUNK_SIZE = int(os.getenv("PLANTS_BULK_CHUNK_SIZE", 500))
+PLANTS_BULK_MAX_RECORDS = int(os.getenv("PLANTS_BULK_MAX_RECORDS", 200000))
+
+CONFLICT_MODES = ('skip', 'upsert')
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+INSERT_SQL = {
+    'skip': '''
+        INSERT INTO plants (name, scientific_name, description, care_instructions)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (name) DO NOTHING
+    ''',
+    'upsert': '''
+        INSERT INTO plants (name, scientific_name, description, care_instructions)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (name) DO UPDATE SET
+            scientific_name = excluded.scientific_name,
+            description = excluded.description,
+            care_instructions = excluded.care_instructions
+    '''
+}
+
+
+class BulkImportError(ValueError):
+    pass
+
+
+def is_ndjson(content_type):
+    return (content_type or '').split(';')[0].strip().lower() in NDJSON_CONTENT_TYPES
+
+
+async def read_records(stream, ndjson):
+    """Đọc body (async iterator các khối byte), yield (index, record)
+
+    NDJSON được tách dòng ngay khi nhận nên không phải giữ cả body trong bộ nhớ;
+    record là dòng bytes chưa parse (parse trong prepare_chunk, ngoài event loop).
+    JSON phải là mảng hoặc {"plants": [...]}, được parse trong thread.
+    """
+    if ndjson:
+        index = 0
+        buffer = b''
+        async for chunk in stream:
+            buffer += chunk
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                if line.strip():
+                    yield index, line
+                    index += 1
+        if buffer.strip():
+            yield index, buffer
+        return
+
+    body = b''.join([chunk async for chunk in stream])
+    data = await asyncio.to_thread(parse_array, body)
+    del body
+    for index, record in enumerate(data):
+        yield index, record
+
+
+def parse_array(body):
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise BulkImportError("Body must be a JSON array or NDJSON")
+    if isinstance(data, dict):
+        data = data.get('plants')
+    if not isinstance(data, list):
+        raise BulkImportError("Body must be a JSON array or an object with a 'plants' array")
+    return data
+
+
+def prepare_chunk(records, model):
+    """Parse dòng NDJSON và validate từng record bằng model (pydantic)
+
+    Trả về ([(index, plant)], [kết quả lỗi]).
+    """
+    valid = []
+    failed = []
+    for index, record in records:
+        try:
+            if isinstance(record, bytes):
+                try:
+                    record = json.loads(record)
+                except ValueError as e:
+                    raise BulkImportError(f"Invalid JSON line: {e}")
+            if not isinstance(record, dict):
+                raise BulkImportError("Record must be a JSON object")
+            valid.append((index, model(**record)))
+        except (TypeError, ValueError) as e:
+            # pydantic.ValidationError là lớp con của ValueError
+            failed.append({"index": index, "status": "failed", "error": str(e)})
+    return valid, failed
+
+
+def import_chunk(pool, records, mode, model):
+    """Validate rồi ghi một khối record, chạy trong threadpool"""
+    valid, outcomes = prepare_chunk(records, model)
+    if valid:
+        try:
+            outcomes.extend(write_chunk(pool, valid, mode))
+        except sqlite3.Error as e:
+            outcomes.extend(
+                {"index": index, "name": plant.name, "status": "failed", "error": str(e)}
+                for index, plant in valid
+            )
+    return outcomes
+
+
+def write_chunk(pool, chunk, mode):
+    """Ghi một khối [(index, PlantCreate)] trong một transaction
+
+    Trả về kết quả từng dòng: inserted / updated / skipped kèm id. Tên đã tồn
+    tại được đọc sau BEGIN IMMEDIATE nên không request nào chen vào giữa lúc
+    đọc và lúc ghi, số inserted / skipped luôn đúng khi import song song.
+    """
+    names = list(dict.fromkeys(plant.name for _, plant in chunk))
+    placeholders = ', '.join('?' for _ in names)
+
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute(f'SELECT name FROM plants WHERE name IN ({placeholders})', names)
+        existing = {row[0] for row in cursor.fetchall()}
+
+        cursor.executemany(INSERT_SQL[mode], [
+            (plant.name, plant.scientific_name, plant.description, plant.care_instructions)
+            for _, plant in chunk
+        ])
+        cursor.execute(f'SELECT name, id FROM plants WHERE name IN ({placeholders})', names)
+        ids = dict(cursor.fetchall())
+        conn.commit()
+
+    outcomes = []
+    for index, plant in chunk:
+        if plant.name in existing:
+            status = 'updated' if mode == 'upsert' else 'skipped'
+        else:
+            status = 'inserted'
+            # Tên lặp lại trong cùng request: lần sau coi như đã tồn tại
+            existing.add(plant.name)
+        outcomes.append({"index": index, "name": plant.name, "status": status, "id": ids.get(plant.name)})
+    return outcomes
+
+
+def summarize(outcomes):
+    summary = {"total": len(outcomes), "inserted": 0, "updated": 0, "skipped": 0, "failed": 0}
+    for outcome in outcomes:
+        summary[outcome["status"]] += 1
+    return summary
@@ -0,0 +1,276 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", 10000))
+PREDICTION_CACHE_MAX_BYTES = int(os.getenv("PREDICTION_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", 24 * 3600))
+# Đường dẫn file SQLite cho tầng cache trên đĩa, để trống để tắt
+PREDICTION_CACHE_DB = os.getenv("PREDICTION_CACHE_DB", "")
+PREDICTION_CACHE_DB_SIZE = int(os.getenv("PREDICTION_CACHE_DB_SIZE", 1000000))
+# Ghi xuống đĩa theo lô: tối đa số bản ghi mỗi transaction / thời gian chờ gom lô
+PREDICTION_CACHE_DB_BATCH = int(os.getenv("PREDICTION_CACHE_DB_BATCH", 500))
+PREDICTION_CACHE_DB_FLUSH_MS = float(os.getenv("PREDICTION_CACHE_DB_FLUSH_MS", 200))
+
+logger = logging.getLogger(__name__)
+
+
+def image_digest(image_bytes):
+    """Hash SHA-256 của nội dung ảnh"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def cache_key(model_id, digest):
+    return f"{model_id}:{digest}"
+
+
+class DiskCache:
+    """Tầng cache SQLite, giữ kết quả qua các lần khởi động lại
+
+    Không chặn event loop: get() chạy trong thread (PredictionCache.get gọi
+    qua asyncio.to_thread), mỗi thread một connection đọc; set() chỉ đưa vào
+    hàng đợi, một thread nền ghi theo lô trong một transaction và dọn bản ghi
+    hết hạn / vượt giới hạn.
+    """
+
+    def __init__(self, path, max_entries=PREDICTION_CACHE_DB_SIZE, prune_every=1000,
+                 batch_size=PREDICTION_CACHE_DB_BATCH, interval_ms=PREDICTION_CACHE_DB_FLUSH_MS):
+        self.path = path
+        self.max_entries = max_entries
+        self.prune_every = prune_every
+        self.batch_size = batch_size
+        self.interval = interval_ms / 1000.0
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+        self._pending = []
+        self._condition = threading.Condition()
+        self._stopping = False
+
+        self.writes = 0
+        self.commits = 0
+        self.entries = 0
+
+        conn = self._connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS prediction_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_prediction_cache_expires ON prediction_cache (expires_at)'
+        )
+        conn.commit()
+        self._thread = threading.Thread(target=self._run, name="prediction-cache-writer", daemon=True)
+        self._thread.start()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def get(self, key, now):
+        """Đọc một bản ghi (blocking, gọi từ thread); bản ghi hết hạn để thread ghi dọn"""
+        row = self._connection().execute(
+            'SELECT value, expires_at FROM prediction_cache WHERE key = ? AND expires_at > ?', (key, now)
+        ).fetchone()
+        return None if row is None else (row[0], row[1])
+
+    def set(self, key, value, expires_at):
+        """Đưa vào hàng đợi ghi, trả về ngay"""
+        with self._condition:
+            self._pending.append((key, value, expires_at))
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify()
+
+    def _run(self):
+        conn = self._connection()
+        self.entries = conn.execute('SELECT COUNT(*) FROM prediction_cache').fetchone()[0]
+        while True:
+            with self._condition:
+                if not self._stopping and len(self._pending) < self.batch_size:
+                    self._condition.wait(self.interval)
+                rows, self._pending = self._pending, []
+                stopping = self._stopping
+            if rows:
+                self._write(conn, rows)
+            if stopping:
+                return
+
+    def _write(self, conn, rows):
+        try:
+            conn.executemany(
+                'INSERT OR REPLACE INTO prediction_cache (key, value, expires_at) VALUES (?, ?, ?)', rows
+            )
+            conn.commit()
+        except sqlite3.Error:
+            # Cache trên đĩa chỉ là tối ưu: bỏ lô này, bản trong bộ nhớ vẫn còn
+            conn.rollback()
+            logger.exception("Prediction cache write failed for %d entries", len(rows))
+            return
+        before = self.writes
+        self.writes += len(rows)
+        self.commits += 1
+        self.entries += len(rows)
+        if self.writes // self.prune_every != before // self.prune_every:
+            self.prune(time.time())
+
+    def prune(self, now):
+        """Xóa bản ghi hết hạn và giữ số bản ghi trong giới hạn (chạy ở thread ghi)"""
+        conn = self._connection()
+        conn.execute('DELETE FROM prediction_cache WHERE expires_at <= ?', (now,))
+        count = conn.execute('SELECT COUNT(*) FROM prediction_cache').fetchone()[0]
+        if count > self.max_entries:
+            # Bỏ các bản ghi sắp hết hạn nhất, đi theo index expires_at
+            conn.execute('''
+                DELETE FROM prediction_cache WHERE key IN (
+                    SELECT key FROM prediction_cache ORDER BY expires_at LIMIT ?
+                )
+            ''', (count - self.max_entries,))
+            count = self.max_entries
+        conn.commit()
+        self.entries = count
+
+    def count(self):
+        """Số bản ghi ước lượng (không quét bảng)"""
+        return self.entries
+
+    def close(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self._thread.join()
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+
+
+class PredictionCache:
+    """Cache LRU có TTL cho kết quả dự đoán, khóa theo hash ảnh + model"""
+
+    def __init__(self, max_entries=PREDICTION_CACHE_SIZE, max_bytes=PREDICTION_CACHE_MAX_BYTES,
+                 ttl=PREDICTION_CACHE_TTL, db_path=PREDICTION_CACHE_DB):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.disk = DiskCache(db_path) if db_path else None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def peek(self, key):
+        """Chỉ tra tầng bộ nhớ, không tính vào hit / miss"""
+        now = time.time()
+        with self._lock:
+            return self._get_memory(key, now)
+
+    def _get_memory(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] > now:
+            self._entries.move_to_end(key)
+            return entry[1]
+        self._remove(key)
+        return None
+
+    async def get(self, key, record=True):
+        """Tra bộ nhớ rồi đến đĩa; đọc đĩa chạy trong thread để không chặn event loop"""
+        now = time.time()
+        with self._lock:
+            value = self._get_memory(key, now)
+            if value is not None:
+                if record:
+                    self.hits += 1
+                return value
+
+        if self.disk is not None:
+            stored = await asyncio.to_thread(self.disk.get, key, now)
+            if stored is not None:
+                value = json.loads(stored[0])
+                with self._lock:
+                    self._insert(key, value, stored[1], len(stored[0]))
+                    if record:
+                        self.hits += 1
+                        self.disk_hits += 1
+                return value
+
+        if record:
+            with self._lock:
+                self.misses += 1
+        return None
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl
+        encoded = json.dumps(value)
+        with self._lock:
+            self._insert(key, value, expires_at, len(encoded))
+        if self.disk is not None:
+            self.disk.set(key, encoded, expires_at)
+
+    def _insert(self, key, value, expires_at, size):
+        if key in self._entries:
+            self._remove(key)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (expires_at, value, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl
+            }
+            if self.disk is not None:
+                stats["disk_entries"] = self.disk.count()
+                stats["disk_writes"] = self.disk.writes
+                stats["disk_commits"] = self.disk.commits
+            return stats
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
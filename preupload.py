@@ -0,0 +1,37 @@
+import io
+import os
+
+from PIL import Image, ImageOps
+
+# Cạnh dài tối đa của ảnh gửi lên Roboflow, 0 để gửi nguyên ảnh gốc
+UPSTREAM_MAX_SIDE = int(os.getenv("UPSTREAM_MAX_SIDE", 0))
+UPSTREAM_JPEG_QUALITY = int(os.getenv("UPSTREAM_JPEG_QUALITY", 85))
+
+
+def downscale_image(image_bytes, max_side=UPSTREAM_MAX_SIDE, quality=UPSTREAM_JPEG_QUALITY):
+    """Thu nhỏ ảnh về cạnh dài max_side và nén lại JPEG
+
+    Với JPEG, draft() cho phép giải mã thẳng ở 1/2, 1/4 hoặc 1/8 kích thước
+    nên không phải giải mã toàn bộ ảnh 12MP. Trả về ảnh gốc nếu ảnh đã đủ
+    nhỏ, không đọc được, hoặc bản nén lại không nhỏ hơn.
+    """
+    if max_side <= 0:
+        return image_bytes
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        if max(image.size) <= max_side and image.format == 'JPEG':
+            return image_bytes
+        image.draft('RGB', (max_side, max_side))
+        # Ảnh điện thoại thường xoay bằng EXIF, thông tin này mất khi nén lại
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.thumbnail((max_side, max_side), Image.BICUBIC)
+
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=quality)
+    except Exception:
+        return image_bytes
+
+    resized = output.getvalue()
+    return resized if len(resized) < len(image_bytes) else image_bytes
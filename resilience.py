@@ -0,0 +1,303 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+# Thời gian tối đa cho mỗi lần gọi (giây)
+UPSTREAM_ATTEMPT_TIMEOUT = float(os.getenv("UPSTREAM_ATTEMPT_TIMEOUT", 10))
+# Gửi thêm một request dự phòng khi request đầu chậm hơn phân vị này
+UPSTREAM_HEDGE = os.getenv("UPSTREAM_HEDGE", "1") == "1"
+UPSTREAM_HEDGE_QUANTILE = float(os.getenv("UPSTREAM_HEDGE_QUANTILE", 0.95))
+# Độ trễ hedge khi chưa đủ mẫu, và mức tối thiểu (ms)
+UPSTREAM_HEDGE_DELAY_MS = float(os.getenv("UPSTREAM_HEDGE_DELAY_MS", 1000))
+UPSTREAM_HEDGE_MIN_DELAY_MS = float(os.getenv("UPSTREAM_HEDGE_MIN_DELAY_MS", 50))
+# Tổng số lần gửi cho một request (lần đầu + hedge / thử lại)
+UPSTREAM_MAX_ATTEMPTS = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", 2))
+# Số lần gửi thêm (hedge / thử lại) tối đa so với số request, vd 0.05 = thêm 5%
+UPSTREAM_HEDGE_BUDGET = float(os.getenv("UPSTREAM_HEDGE_BUDGET", 0.05))
+# Số lần gửi thêm được dồn lại khi ít request (cho phép hedge sớm sau khi khởi động)
+UPSTREAM_HEDGE_BURST = float(os.getenv("UPSTREAM_HEDGE_BURST", 5))
+
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", 0.5))
+BREAKER_MIN_REQUESTS = int(os.getenv("BREAKER_MIN_REQUESTS", 20))
+BREAKER_WINDOW = float(os.getenv("BREAKER_WINDOW", 30))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", 15))
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class RetryBudget:
+    """Token bucket cho các lần gửi thêm: mỗi request nạp `ratio` token, mỗi lần gửi thêm tốn một"""
+
+    def __init__(self, ratio=UPSTREAM_HEDGE_BUDGET, burst=UPSTREAM_HEDGE_BURST):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+        self.denied = 0
+
+    def deposit(self):
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def withdraw(self):
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        self.denied += 1
+        return False
+
+
+class LatencyTracker:
+    """Giữ độ trễ của các lần gọi thành công gần nhất để tính phân vị"""
+
+    def __init__(self, size=500):
+        self.samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def quantile(self, q):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class CircuitBreaker:
+    """closed -> open khi tỉ lệ lỗi trong cửa sổ vượt ngưỡng, half_open sau cooldown
+
+    Ở half_open chỉ cho một request thử; thành công thì đóng lại, lỗi thì mở tiếp.
+    """
+
+    def __init__(self, error_rate=BREAKER_ERROR_RATE, min_requests=BREAKER_MIN_REQUESTS,
+                 window=BREAKER_WINDOW, cooldown=BREAKER_COOLDOWN):
+        self.error_rate = error_rate
+        self.min_requests = min_requests
+        self.window = window
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.opened_at = 0
+        self.opens = 0
+        self.rejected = 0
+        self._events = deque()
+        self._probing = False
+
+    def _trim(self, now):
+        while self._events and now - self._events[0][0] > self.window:
+            self._events.popleft()
+
+    def allow(self):
+        now = time.monotonic()
+        if self.state == "open":
+            if now - self.opened_at < self.cooldown:
+                self.rejected += 1
+                return False
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._probing:
+                self.rejected += 1
+                return False
+            self._probing = True
+        return True
+
+    def record(self, success):
+        now = time.monotonic()
+        if self.state == "half_open":
+            self._probing = False
+            if success:
+                self.state = "closed"
+                self._events.clear()
+            else:
+                self._open(now)
+            return
+
+        self._events.append((now, success))
+        self._trim(now)
+        failures = sum(1 for _, ok in self._events if not ok)
+        if len(self._events) >= self.min_requests and failures / len(self._events) >= self.error_rate:
+            self._open(now)
+
+    def cancel(self):
+        """Request bị huỷ giữa chừng (client ngắt kết nối): không tính kết quả"""
+        if self.state == "half_open":
+            self._probing = False
+
+    def _open(self, now):
+        self.state = "open"
+        self.opened_at = now
+        self.opens += 1
+        self._events.clear()
+
+    def stats(self):
+        self._trim(time.monotonic())
+        failures = sum(1 for _, ok in self._events if not ok)
+        return {
+            "state": self.state,
+            "window_requests": len(self._events),
+            "window_errors": failures,
+            "opens": self.opens,
+            "rejected": self.rejected
+        }
+
+
+class ResilientCaller:
+    """Gọi hàm bất đồng bộ với deadline cho từng lần, hedge và circuit breaker
+
+    Nếu lần gọi đầu chưa xong sau phân vị p95 độ trễ, gửi thêm một lần nữa và
+    lấy kết quả nào về trước. Lần gọi lỗi sớm cũng được gửi lại ngay. Số lần
+    gửi thêm bị giới hạn bởi RetryBudget.
+
+    limiter (vd semaphore giới hạn số request đồng thời) được giữ trong lúc
+    gọi fn; deadline, độ trễ dùng cho p95 và mốc hedge chỉ tính từ khi đã có
+    chỗ, không tính thời gian xếp hàng. Khi limiter đã hết chỗ thì không hedge,
+    vì request dự phòng chỉ xếp hàng sau chính limiter đó.
+    """
+
+    def __init__(self, attempt_timeout=UPSTREAM_ATTEMPT_TIMEOUT, hedge=UPSTREAM_HEDGE,
+                 hedge_quantile=UPSTREAM_HEDGE_QUANTILE, hedge_delay_ms=UPSTREAM_HEDGE_DELAY_MS,
+                 hedge_min_delay_ms=UPSTREAM_HEDGE_MIN_DELAY_MS, max_attempts=UPSTREAM_MAX_ATTEMPTS,
+                 breaker=None, min_samples=20, on_error=None, limiter=None, budget=None):
+        self.attempt_timeout = attempt_timeout
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_delay = hedge_delay_ms / 1000.0
+        self.hedge_min_delay = hedge_min_delay_ms / 1000.0
+        self.max_attempts = max(1, max_attempts)
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.latency = LatencyTracker()
+        self.min_samples = min_samples
+        # Gọi với loại lỗi ("timeout", "circuit_open" hoặc tên exception)
+        self.on_error = on_error
+        self.limiter = limiter
+        self.budget = budget if budget is not None else RetryBudget()
+
+        self.calls = 0
+        self.attempts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def current_hedge_delay(self):
+        if len(self.latency.samples) < self.min_samples:
+            return self.hedge_delay
+        return max(self.hedge_min_delay, self.latency.quantile(self.hedge_quantile))
+
+    async def _attempt(self, fn, args, started):
+        if self.limiter is None:
+            return await self._timed(fn, args, started)
+        async with self.limiter:
+            return await self._timed(fn, args, started)
+
+    async def _timed(self, fn, args, started):
+        self.attempts += 1
+        started[0] = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(fn(*args), self.attempt_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self._report("timeout")
+            raise
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._report(type(e).__name__)
+            raise
+        self.latency.add(time.perf_counter() - started[0])
+        return result
+
+    def _report(self, kind):
+        if self.on_error is not None:
+            self.on_error(kind)
+
+    def _can_send_extra(self):
+        # Không hedge khi limiter hết chỗ: request thêm chỉ xếp hàng, làm tải nặng hơn
+        if self.limiter is not None and self.limiter.locked():
+            return False
+        return self.budget.withdraw()
+
+    async def call(self, fn, *args):
+        if not self.breaker.allow():
+            self._report("circuit_open")
+            raise CircuitOpenError("Upstream circuit is open")
+        self.calls += 1
+        self.budget.deposit()
+
+        # task -> (số thứ tự lần gửi, [thời điểm bắt đầu gọi fn]); 0 là request đầu tiên
+        tasks = {}
+        newest = [None]
+
+        def launch(number):
+            started = [None]
+            tasks[asyncio.ensure_future(self._attempt(fn, args, started))] = (number, started)
+            newest[0] = started
+
+        launch(0)
+        launched = 1
+        hedging = self.hedge
+        last_error = None
+        try:
+            while tasks:
+                timeout = None
+                if hedging and launched < self.max_attempts:
+                    # Mốc hedge tính từ lúc lần gửi mới nhất thực sự bắt đầu gọi
+                    delay = self.current_hedge_delay()
+                    started_at = newest[0][0]
+                    timeout = delay if started_at is None else max(0, delay - (time.perf_counter() - started_at))
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    if newest[0][0] is not None and self._can_send_extra():
+                        # Request đầu chậm hơn p95: gửi thêm một request dự phòng
+                        self.hedges += 1
+                        launch(launched)
+                        launched += 1
+                    elif newest[0][0] is not None:
+                        # Hết budget / limiter đầy: không hedge nữa, chờ các lần đang chạy
+                        hedging = False
+                    continue
+
+                for task in done:
+                    number, _ = tasks.pop(task)
+                    if task.exception() is None:
+                        if number > 0:
+                            self.hedge_wins += 1
+                        self.breaker.record(True)
+                        return task.result()
+                    last_error = task.exception()
+
+                # Lỗi nhanh: thử lại ngay nếu còn lượt và còn budget
+                if not tasks and launched < self.max_attempts and self.budget.withdraw():
+                    launch(launched)
+                    launched += 1
+        except asyncio.CancelledError:
+            self.breaker.cancel()
+            raise
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        self.errors += 1
+        self.breaker.record(False)
+        raise last_error
+
+    def stats(self):
+        p95 = self.latency.quantile(0.95)
+        return {
+            "calls": self.calls,
+            "attempts": self.attempts,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "p95_ms": p95 * 1000 if p95 is not None else None,
+            "hedge_delay_ms": self.current_hedge_delay() * 1000,
+            "hedge_budget": {
+                "ratio": self.budget.ratio,
+                "tokens": self.budget.tokens,
+                "denied": self.budget.denied
+            },
+            "attempt_timeout": self.attempt_timeout,
+            "breaker": self.breaker.stats()
+        }
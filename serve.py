@@ -0,0 +1,213 @@
+"""Chạy API với nhiều worker theo kiểu pre-fork
+
+Process cha mở socket, import trước các thư viện nặng (FastAPI, numpy,
+Pillow...) và nạp file model TFLite vào page cache, rồi fork ra các worker.
+Các worker dùng chung socket, chung phần bộ nhớ đã import (copy-on-write) và
+chung trọng số model: TFLiteBackend mmap cùng một file .tflite nên chỉ có
+một bản trong RAM dù chạy bao nhiêu worker. Worker chết sẽ được fork lại.
+
+Ứng dụng được import trong từng worker (không import ở process cha) để không
+chia sẻ connection SQLite / Postgres hay thread qua fork.
+
+Với nhiều worker, số liệu Prometheus chạy ở chế độ multiprocess: các worker
+ghi vào PROMETHEUS_MULTIPROC_DIR (tự tạo thư mục tạm nếu chưa đặt) và
+/metrics cộng gộp tất cả, nên counter không nhảy lùi giữa các lần scrape.
+
+Lưu ý: mỗi worker có cache và rate limit riêng. Backend
+keras vẫn load một bản model cho mỗi worker (TensorFlow không an toàn khi
+fork); dùng export_tflite.py + PLANT_BACKEND=tflite để chia sẻ trọng số.
+TFLite cần tflite-runtime (hoặc tensorflow) trong môi trường chạy.
+
+Sử dụng:
+    python serve.py --workers 4
+    WEB_CONCURRENCY=4 PLANT_BACKEND=tflite python serve.py --app api:app --port 8000
+"""
+import argparse
+import importlib
+import mmap
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+# Thư viện import sẵn ở process cha để các worker dùng chung bộ nhớ
+PRELOAD_MODULES = ("fastapi", "pydantic", "starlette", "httpx", "numpy", "PIL.Image", "prometheus_client")
+
+
+def preload_modules(names=PRELOAD_MODULES):
+    loaded = []
+    for name in names:
+        try:
+            importlib.import_module(name)
+            loaded.append(name)
+        except ImportError:
+            pass
+    return loaded
+
+
+def prepare_metrics_dir(workers):
+    """Bật chế độ multiprocess của prometheus_client, phải gọi trước khi import prometheus_client
+
+    Trả về (thư mục, đã tự tạo hay không); thư mục được làm trống vì file của
+    lần chạy trước sẽ bị cộng vào số liệu.
+    """
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not path:
+        if workers <= 1:
+            return None, False
+        path = tempfile.mkdtemp(prefix="plant_metrics_")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+        return path, True
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(path):
+        if name.endswith(".db"):
+            os.remove(os.path.join(path, name))
+    return path, False
+
+
+def map_model_files(paths):
+    """mmap các file model (chỉ đọc) và đọc qua một lượt để nạp vào page cache
+
+    Mapping được giữ suốt vòng đời process cha nên các trang không bị thu hồi
+    khi worker khởi động lại.
+    """
+    mappings = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        for offset in range(0, len(mapping), mmap.PAGESIZE):
+            mapping[offset]
+        mappings.append((path, mapping))
+    return mappings
+
+
+def bind_socket(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app_path, sock, worker_id, log_level):
+    """Chạy trong process con: import app và phục vụ trên socket chung"""
+    import uvicorn
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    os.environ["SERVE_WORKER_ID"] = str(worker_id)
+    # Mỗi worker ghi trace ra file riêng để không xoay vòng file chồng lên nhau
+    import tracing
+    root, ext = os.path.splitext(tracing.TRACE_FILE)
+    tracing.trace_writer = tracing.TraceWriter(f"{root}.w{worker_id}{ext}")
+
+    module_name, _, attr = app_path.partition(":")
+    app = getattr(importlib.import_module(module_name), attr or "app")
+    config = uvicorn.Config(app, log_level=log_level, lifespan="on")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Arbiter:
+    """Process cha: fork worker, fork lại khi worker chết, dừng tất cả khi nhận SIGTERM"""
+
+    def __init__(self, app_path, sock, workers, log_level):
+        self.app_path = app_path
+        self.sock = sock
+        self.workers = workers
+        self.log_level = log_level
+        self.children = {}  # pid -> worker_id
+        self.stopping = False
+        self.restarts = 0
+
+    def spawn(self, worker_id):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.app_path, self.sock, worker_id, self.log_level)
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = worker_id
+        return pid
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        # Tránh process con kế thừa phần log chưa flush
+        sys.stdout.flush()
+        for worker_id in range(self.workers):
+            self.spawn(worker_id)
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            worker_id = self.children.pop(pid, None)
+            if worker_id is None:
+                continue
+            if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+                # Bỏ gauge "live" của worker đã chết; counter / histogram vẫn được giữ
+                from prometheus_client import multiprocess
+                multiprocess.mark_process_dead(pid)
+            if self.stopping:
+                continue
+            print(f"⚠️  Worker {worker_id} (pid {pid}) thoát với mã {os.waitstatus_to_exitcode(status)}, fork lại")
+            self.restarts += 1
+            # Tránh fork liên tục khi app lỗi ngay lúc khởi động
+            time.sleep(min(5, 0.1 * self.restarts))
+            self.spawn(worker_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chạy API với nhiều worker (pre-fork)")
+    parser.add_argument("--app", default="api:app")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", 1)))
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.getcwd())
+    metrics_dir, created_metrics_dir = prepare_metrics_dir(args.workers)
+    preloaded = preload_modules()
+    # Import backends chỉ để lấy đường dẫn model, không tạo backend ở process cha
+    from backends import shared_model_paths
+    mappings = map_model_files(shared_model_paths())
+    sock = bind_socket(args.host, args.port)
+
+    print(f"🚀 {args.app} trên http://{args.host}:{args.port} với {args.workers} worker (pid {os.getpid()})")
+    print(f"📦 Đã import sẵn: {', '.join(preloaded)}")
+    for path, mapping in mappings:
+        print(f"🧠 Model dùng chung: {path} ({len(mapping) / 1024 / 1024:.1f} MB)")
+    if metrics_dir:
+        print(f"📈 Prometheus multiprocess: {metrics_dir}")
+
+    try:
+        Arbiter(args.app, sock, args.workers, args.log_level).run()
+    finally:
+        sock.close()
+        if created_metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Gộp các lời gọi trùng khóa đang chạy cùng lúc thành một
+
+    Lời gọi đầu tiên (leader) chạy hàm; các lời gọi sau với cùng khóa chờ
+    chung một task thay vì gọi lại. Task được shield nên client của leader
+    ngắt kết nối thì các request đang chờ vẫn nhận được kết quả. Vì task có
+    thể chạy lâu hơn request tạo ra nó, fn không được giữ tài nguyên của
+    request (vd file upload): đọc dữ liệu cần thiết trước khi gọi do().
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self._waiters = {}
+        self.leaders = 0
+        self.followers = 0
+        self.orphaned_errors = 0
+
+    async def do(self, key, fn):
+        task = self._inflight.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            self._waiters[task] = 0
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.followers += 1
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if task in self._waiters:
+                self._waiters[task] -= 1
+
+    def _finish(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        waiters = self._waiters.pop(task, 0)
+        if task.cancelled():
+            return
+        # Lấy exception để task không báo "Task exception was never retrieved"
+        # khi mọi request chờ nó đã bị hủy
+        error = task.exception()
+        if error is not None and waiters == 0:
+            self.orphaned_errors += 1
+            logger.warning("Single-flight task failed after all waiters left: %r", error)
+
+    def running(self, key):
+        return key in self._inflight
+
+    def stats(self):
+        return {
+            "in_flight": len(self._inflight),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "orphaned_errors": self.orphaned_errors
+        }
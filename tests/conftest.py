@@ -0,0 +1,30 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+# Các module của dự án nằm ở thư mục gốc, không phải package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def api_client(tmp_path_factory):
+    """TestClient cho api.py với database tạm (module api chỉ được import một lần)"""
+    from fastapi.testclient import TestClient
+
+    workdir = tmp_path_factory.mktemp("api")
+    env = {"DATABASE_PATH": str(workdir / "plants.db"), "TRACE_SAMPLE_RATE": "0", "DIAGNOSIS_WRITE_BEHIND": "0"}
+    saved = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    try:
+        api = importlib.import_module("api")
+        with TestClient(api.app) as client:
+            client.api = api
+            yield client
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
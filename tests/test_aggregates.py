@@ -0,0 +1,145 @@
+import random
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from aggregates import DiagnosisRollups, DiagnosisStats
+
+DISEASES = ["Tomato___Late_blight", "Apple___healthy", "brown spot", None]
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "stats.db"))
+    conn.execute('''
+        CREATE TABLE diagnoses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+            type TEXT,
+            disease TEXT,
+            confidence REAL
+        )
+    ''')
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def seed(conn, count, start):
+    rng = random.Random(count)
+    conn.executemany('INSERT INTO diagnoses (timestamp, type, disease, confidence) VALUES (?, ?, ?, ?)', [
+        ((start + timedelta(minutes=17 * i)).strftime('%Y-%m-%d %H:%M:%S'),
+         rng.choice(("plant", "rice", None)), rng.choice(DISEASES), rng.random())
+        for i in range(count)
+    ])
+    conn.commit()
+
+
+def recent():
+    return datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0) - timedelta(days=2)
+
+
+def test_triggers_match_rebuild(conn):
+    stats = DiagnosisStats(label_column='disease', success_expr='{row}.disease IS NOT NULL')
+    rollups = DiagnosisRollups(label_column='disease')
+    seed(conn, 50, recent())
+    # Cài đặt trên bảng đã có dữ liệu: tính lại từ đầu
+    stats.install(conn)
+    rollups.install(conn)
+
+    seed(conn, 200, recent())
+    conn.execute('DELETE FROM diagnoses WHERE id % 5 = 0')
+    conn.commit()
+
+    assert stats.check(conn) == {"consistent": True, "differences": []}
+    by_trigger = stats.read(conn)
+    series_by_trigger = {g: rollups.query(conn, granularity=g) for g in ("hour", "day")}
+    assert by_trigger["total"] == conn.execute('SELECT COUNT(*) FROM diagnoses').fetchone()[0]
+
+    stats.rebuild(conn)
+    rollups.rebuild(conn)
+    assert stats.read(conn) == by_trigger
+    for granularity, series in series_by_trigger.items():
+        rebuilt = rollups.query(conn, granularity=granularity)
+        assert [(p["bucket"], p["disease"], p["count"]) for p in rebuilt] == \
+            [(p["bucket"], p["disease"], p["count"]) for p in series]
+        assert all(a["mean_confidence"] == pytest.approx(b["mean_confidence"]) for a, b in zip(rebuilt, series))
+
+
+def test_check_reports_drift(conn):
+    stats = DiagnosisStats(label_column='disease', success_expr='{row}.disease IS NOT NULL')
+    stats.install(conn)
+    seed(conn, 20, recent())
+    conn.execute("UPDATE diagnosis_stats_type SET total = total + 1 WHERE type = 'rice'")
+    conn.commit()
+
+    result = stats.check(conn)
+    assert not result["consistent"]
+    assert [d["type"] for d in result["differences"]] == ["rice"]
+    stats.rebuild(conn)
+    assert stats.check(conn)["consistent"]
+
+
+def test_query_converts_aware_times_to_utc(conn):
+    rollups = DiagnosisRollups(label_column='disease')
+    rollups.install(conn)
+    conn.executemany('INSERT INTO diagnoses (timestamp, type, disease, confidence) VALUES (?, ?, ?, ?)', [
+        ("2026-01-01 00:30:00", "plant", "brown spot", 0.5),
+        ("2026-01-01 01:30:00", "plant", "brown spot", 0.7)
+    ])
+    conn.commit()
+
+    # 08:00 giờ Việt Nam = 01:00 UTC
+    since = datetime(2026, 1, 1, 8, 0, tzinfo=timezone(timedelta(hours=7)))
+    series = rollups.query(conn, granularity='day', since=since - timedelta(hours=8))
+    assert [(p["bucket"], p["count"]) for p in series] == [("2026-01-01 00:00:00", 2)]
+    series = rollups.query(conn, granularity='day', until=since)
+    assert [(p["bucket"], p["count"]) for p in series] == [("2026-01-01 00:00:00", 2)]
+    assert rollups.query(conn, granularity='day', since=since) == []
+
+
+def test_prune_keeps_hourly_rollups_inside_retention(conn):
+    rollups = DiagnosisRollups(label_column='disease', hourly_retention_days=1)
+    rollups.install(conn)
+    now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    conn.executemany('INSERT INTO diagnoses (timestamp, type, disease, confidence) VALUES (?, ?, ?, ?)', [
+        ((now - timedelta(days=3)).strftime('%Y-%m-%d %H:%M:%S'), "plant", "old", 0.5),
+        ((now - timedelta(hours=2)).strftime('%Y-%m-%d %H:%M:%S'), "plant", "new", 0.5)
+    ])
+    conn.commit()
+
+    assert rollups.prune(conn) == 1
+    assert [p["disease"] for p in rollups.query(conn, granularity='hour')] == ["new"]
+    assert sorted(p["disease"] for p in rollups.query(conn, granularity='day')) == ["new", "old"]
+
+
+def test_postgres_cutoff_uses_database_clock():
+    sql, params = DiagnosisRollups(dialect='postgres', hourly_retention_days=2)._cutoff()
+    assert sql.startswith("LOCALTIMESTAMP")
+    assert params == [2 * 86400.0]
+
+
+def test_changing_label_column_rebuilds_rollups(conn):
+    conn.execute('ALTER TABLE diagnoses ADD COLUMN disease_vietnamese TEXT')
+    conn.commit()
+
+    def insert(timestamp):
+        conn.execute("INSERT INTO diagnoses (timestamp, type, disease, disease_vietnamese, confidence) "
+                     "VALUES (?, 'rice', 'brown spot disease', 'Bệnh đốm nâu', 0.9)", (timestamp,))
+        conn.commit()
+
+    DiagnosisRollups(label_column='disease_vietnamese').install(conn)
+    insert("2026-01-01 00:00:00")
+    rollups = DiagnosisRollups(label_column='disease')
+    rollups.install(conn)
+    insert("2026-01-02 00:00:00")
+
+    series = rollups.query(conn, granularity='day')
+    assert [(p["bucket"][:10], p["disease"], p["count"]) for p in series] == [
+        ("2026-01-01", "brown spot disease", 1), ("2026-01-02", "brown spot disease", 1)
+    ]
+    # Khởi động lại với cùng cột: không tính lại, trigger vẫn dùng cột mới
+    rollups.install(conn)
+    insert("2026-01-02 01:00:00")
+    assert rollups.query(conn, granularity='day', disease='brown spot disease')[-1]["count"] == 2
@@ -0,0 +1,41 @@
+import pytest
+
+import backends
+
+
+def test_rice_local_backend_requires_class_names(monkeypatch):
+    monkeypatch.setenv("RICE_BACKEND", "keras")
+    monkeypatch.delenv("RICE_CLASS_NAMES", raising=False)
+    with pytest.raises(ValueError, match="RICE_CLASS_NAMES"):
+        backends.create_backend("rice")
+
+
+def test_rice_fallback_requires_class_names(monkeypatch):
+    monkeypatch.setenv("RICE_BACKEND", "roboflow")
+    monkeypatch.setenv("RICE_FALLBACK_MODEL_PATH", "rice_disease_model.h5")
+    monkeypatch.delenv("RICE_CLASS_NAMES", raising=False)
+    with pytest.raises(ValueError, match="RICE_CLASS_NAMES"):
+        backends.create_backend("rice")
+
+
+def test_class_names_loaded_from_file(monkeypatch, tmp_path):
+    names = tmp_path / "rice.txt"
+    names.write_text("brown spot\nleaf blast\n\nhealthy\n", encoding='utf-8')
+    monkeypatch.setenv("RICE_BACKEND", "keras")
+    monkeypatch.setenv("RICE_CLASS_NAMES", str(names))
+    backend = backends.create_backend("rice")
+    assert backend.class_names == ["brown spot", "leaf blast", "healthy"]
+
+
+def test_plant_backend_defaults_to_plantvillage_names(monkeypatch):
+    monkeypatch.setenv("PLANT_BACKEND", "keras")
+    monkeypatch.delenv("PLANT_CLASS_NAMES", raising=False)
+    assert backends.create_backend("plant").class_names is None
+
+
+def test_class_count_must_match_outputs():
+    backends.check_class_count("rice.h5", 3, ["a", "b", "c"])
+    with pytest.raises(ValueError, match="10 outputs but 38"):
+        backends.check_class_count("rice.h5", 10, ["x"] * 38)
+    with pytest.raises(ValueError, match="no class names"):
+        backends.check_class_count("rice.tflite", 10, None)
@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+from catalog import PLANT_FIELDS, CatalogError, PlantCatalog, etag_matches, parse_fields
+from db import SQLitePool
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = SQLitePool(str(tmp_path / "catalog.db"), size=2)
+    with pool.connection() as conn:
+        conn.execute('''
+            CREATE TABLE plants (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE NOT NULL,
+                scientific_name TEXT,
+                description TEXT,
+                care_instructions TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.executemany('INSERT INTO plants (name) VALUES (?)', [("Lúa",), ("Cà chua",), ("Ngô",)])
+        conn.commit()
+    yield pool
+    pool.close()
+
+
+def add_plant(pool, name):
+    with pool.connection() as conn:
+        conn.execute('INSERT INTO plants (name) VALUES (?)', (name,))
+        conn.commit()
+
+
+def test_etag_matches():
+    assert etag_matches('"abc-1"', '"abc-1"')
+    assert etag_matches('W/"abc-1"', '"abc-1"')
+    assert etag_matches('"x", "abc-1"', '"abc-1"')
+    assert etag_matches('*', '"abc-1"')
+    assert not etag_matches(None, '"abc-1"')
+    assert not etag_matches('"abc-2"', '"abc-1"')
+
+
+def test_parse_fields():
+    assert parse_fields(None) == PLANT_FIELDS
+    assert parse_fields("name, id,name") == ("name", "id")
+    with pytest.raises(CatalogError):
+        parse_fields("id,password")
+
+
+def test_variants_are_cached_until_invalidated(pool):
+    catalog = PlantCatalog(pool, ttl=3600)
+    body, etag, total = catalog.get()
+    assert total == 3
+    assert [plant["name"] for plant in json.loads(body)] == sorted(["Lúa", "Cà chua", "Ngô"])
+    assert catalog.get() == (body, etag, total)
+    assert catalog.stats()["hits"] == 1
+
+    page, page_etag, _ = catalog.get(offset=1, limit=1, fields=("id", "name"))
+    assert page_etag != etag
+    assert list(json.loads(page)[0]) == ["id", "name"]
+
+    add_plant(pool, "Khoai")
+    # Trong TTL, ghi không qua invalidate() thì chưa thấy
+    assert catalog.get()[1] == etag
+    catalog.invalidate()
+    body, new_etag, total = catalog.get()
+    assert total == 4 and new_etag != etag
+
+
+def test_unchanged_data_keeps_etag_after_reload(pool):
+    catalog = PlantCatalog(pool, ttl=0)
+    etag = catalog.get()[1]
+    catalog.invalidate()
+    assert catalog.get()[1] == etag
+    add_plant(pool, "Khoai")
+    # ttl=0: lần đọc nào cũng nạp lại từ database
+    assert catalog.get()[1] != etag
+
+
+def test_plants_not_modified_and_invalidation(api_client):
+    first = api_client.get("/plants")
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+
+    cached = api_client.get("/plants", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached.headers["etag"] == etag
+
+    created = api_client.post("/plants", json={"name": "Cây thử ETag"})
+    assert created.status_code == 200
+    changed = api_client.get("/plants", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert "Cây thử ETag" in [plant["name"] for plant in changed.json()]
+
+    api_client.delete(f"/plants/{created.json()['id']}")
+    assert api_client.get("/plants", headers={"If-None-Match": changed.headers["etag"]}).status_code == 200
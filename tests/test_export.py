@@ -0,0 +1,108 @@
+import asyncio
+import csv
+import io
+import threading
+
+import pytest
+
+import export
+from db import SQLitePool
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = SQLitePool(str(tmp_path / "export.db"), size=1)
+    with pool.connection() as conn:
+        conn.execute('CREATE TABLE diagnoses (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT, type TEXT)')
+        # Nhiều dòng cùng timestamp (ghi theo lô) nằm vắt qua ranh giới khối
+        conn.executemany('INSERT INTO diagnoses (timestamp, type) VALUES (?, ?)', [
+            (f"2026-01-01 00:00:{i // 7:02d}", "rice" if i % 3 == 0 else "plant") for i in range(100)
+        ])
+        conn.commit()
+    yield pool
+    pool.close()
+
+
+@pytest.mark.parametrize("batch_size", [1, 7, 10, 33, 100, 1000])
+def test_keyset_batches_cover_every_row_once(pool, batch_size):
+    reader = pool.keyset_batches('SELECT id, timestamp, type FROM diagnoses', '', [],
+                                 key=('timestamp', 'id'), key_indexes=(1, 0), batch_size=batch_size)
+    rows = [row for batch in reader.batches() for row in batch]
+    assert [row[0] for row in rows] == list(range(1, 101))
+    assert reader.conn is None
+
+
+def test_keyset_batches_with_filter(pool):
+    reader = pool.keyset_batches('SELECT id, timestamp, type FROM diagnoses', 'WHERE type = ?', ['rice'],
+                                 key=('timestamp', 'id'), key_indexes=(1, 0), batch_size=4)
+    rows = [row for batch in reader.batches() for row in batch]
+    assert [row[0] for row in rows] == [i + 1 for i in range(100) if i % 3 == 0]
+
+
+def test_export_does_not_hold_pool_connection(pool):
+    reader = pool.keyset_batches('SELECT id, timestamp, type FROM diagnoses', '', [],
+                                 key=('timestamp', 'id'), key_indexes=(1, 0), batch_size=10)
+    batches = reader.batches()
+    next(batches)
+    # Pool chỉ có một connection và vẫn dùng được khi export đang dở
+    with pool.connection() as conn:
+        conn.execute("INSERT INTO diagnoses (timestamp, type) VALUES ('2026-01-02 00:00:00', 'plant')")
+        conn.commit()
+    assert pool.stats()["waits"] == 0
+    assert sum(len(batch) for batch in batches) == 91
+
+
+def test_sql_error_raised_before_streaming(pool):
+    with pytest.raises(Exception):
+        pool.keyset_batches('SELECT missing FROM diagnoses', '', [], key=('timestamp', 'id'),
+                            key_indexes=(1, 0))
+
+
+def test_slots_released_after_response(pool, monkeypatch):
+    monkeypatch.setattr(export, "_export_slots", threading.BoundedSemaphore(1))
+    export.acquire_slot()
+    reader = pool.keyset_batches('SELECT id, timestamp, type FROM diagnoses', '', [],
+                                 key=('timestamp', 'id'), key_indexes=(1, 0), batch_size=30)
+    response = export.export_response("csv", [("id", "int"), ("timestamp", "datetime"), ("type", "str")],
+                                      reader.batches(), release=export.release_slot)
+
+    async def consume():
+        return b''.join([chunk async for chunk in response.body_iterator])
+
+    with pytest.raises(export.ExportBusy):
+        export.acquire_slot()
+    body = asyncio.run(consume()).decode()
+    assert len(list(csv.reader(io.StringIO(body)))) == 101
+    # Slot được trả lại khi response gửi xong
+    export.acquire_slot()
+    export.release_slot()
+
+
+def test_release_runs_when_client_disconnects_before_first_chunk(monkeypatch):
+    monkeypatch.setattr(export, "_export_slots", threading.BoundedSemaphore(1))
+    export.acquire_slot()
+    pulled = []
+    released = []
+
+    def batches():
+        pulled.append(True)
+        yield [(1,)]
+
+    def release():
+        released.append(True)
+        export.release_slot()
+
+    response = export.export_response("csv", [("id", "int")], batches(), release=release)
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        # Client ngắt trong lúc header còn đang gửi
+        await asyncio.sleep(1)
+
+    asyncio.run(response({"type": "http", "asgi": {"spec_version": "2.0"}}, receive, send))
+    assert pulled == []
+    assert released == [True]
+    export.acquire_slot()
+    export.release_slot()
@@ -0,0 +1,119 @@
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from pagination import CursorError, decode_cursor, diagnosis_filters, encode_cursor, next_cursor, sqlite_time
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor("2026-01-01 10:00:00", 42)
+    assert '=' not in cursor
+    assert decode_cursor(cursor) == ("2026-01-01 10:00:00", 42)
+    assert decode_cursor(encode_cursor(datetime(2026, 1, 1, 10), 7)) == ("2026-01-01 10:00:00", 7)
+
+
+@pytest.mark.parametrize("cursor", ["", "abc", encode_cursor("x", 1)[:-3], "W10", "WyJ4Il0"])
+def test_invalid_cursor(cursor):
+    with pytest.raises(CursorError):
+        decode_cursor(cursor)
+
+
+def test_sqlite_time_converts_to_utc():
+    assert sqlite_time(None) is None
+    assert sqlite_time(datetime(2026, 1, 1, 7, 30)) == "2026-01-01 07:30:00"
+    assert sqlite_time(datetime(2026, 1, 1, 7, 30, tzinfo=timezone(timedelta(hours=7)))) == "2026-01-01 00:30:00"
+    assert sqlite_time(datetime(2026, 1, 1, 0, 30, tzinfo=timezone.utc)) == "2026-01-01 00:30:00"
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.execute('CREATE TABLE diagnoses (id INTEGER PRIMARY KEY, timestamp TEXT, type TEXT)')
+    # Nhiều dòng cùng timestamp để trang bị cắt giữa một nhóm
+    conn.executemany('INSERT INTO diagnoses (id, timestamp, type) VALUES (?, ?, ?)', [
+        (i, f"2026-01-01 00:00:{i // 4:02d}", "rice" if i % 2 else "plant") for i in range(1, 31)
+    ])
+    yield conn
+    conn.close()
+
+
+def paginate(conn, limit, **filters):
+    pages = []
+    cursor = None
+    while True:
+        where, params = diagnosis_filters(cursor=cursor, **filters)
+        rows = conn.execute(
+            f'SELECT id, timestamp FROM diagnoses {where} ORDER BY timestamp DESC, id DESC LIMIT ?',
+            params + [limit]
+        ).fetchall()
+        pages.append(rows)
+        cursor = next_cursor(rows, limit, 1, 0)
+        if cursor is None:
+            return pages
+
+
+@pytest.mark.parametrize("limit", [1, 3, 4, 5, 30, 31])
+def test_keyset_pages_cover_every_row_once(conn, limit):
+    pages = paginate(conn, limit)
+    ids = [row[0] for page in pages for row in page]
+    assert ids == list(range(30, 0, -1))
+    assert all(len(page) == limit for page in pages[:-1])
+
+
+def test_keyset_pages_with_time_window(conn):
+    since = datetime(2026, 1, 1, 7, 0, 2, tzinfo=timezone(timedelta(hours=7)))
+    until = datetime(2026, 1, 1, 0, 0, 5)
+    pages = paginate(conn, 3, type_plant="rice", since=sqlite_time(since), until=sqlite_time(until))
+    ids = [row[0] for page in pages for row in page]
+    assert ids == [i for i in range(30, 0, -1) if i % 2 and 2 <= i // 4 < 5]
+
+
+def test_next_cursor_stops_on_short_page():
+    assert next_cursor([], 10, 1, 0) is None
+    assert next_cursor([(1, "2026-01-01 00:00:00")], 10, 1, 0) is None
+    assert decode_cursor(next_cursor([(2, "b"), (1, "a")], 2, 1, 0)) == ("a", 1)
+
+
+@pytest.mark.parametrize("threshold", [5, 10000])
+def test_diagnoses_pages_follow_next_cursor_header(api_client, monkeypatch, threshold):
+    api = api_client.api
+    # threshold nhỏ: trang được stream theo khối; lớn: một body
+    monkeypatch.setattr(api.jsonrows, "JSON_STREAM_THRESHOLD", threshold)
+    with api.db_pool.connection() as conn:
+        conn.execute("DELETE FROM diagnoses WHERE type = 'paging'")
+        conn.executemany('INSERT INTO diagnoses (timestamp, type, disease, confidence) VALUES (?, ?, ?, ?)', [
+            (f"2026-02-01 00:00:{i // 3:02d}", "paging", "brown spot", 0.5) for i in range(20)
+        ])
+        conn.commit()
+        expected = [row[0] for row in conn.execute(
+            "SELECT id FROM diagnoses WHERE type = 'paging' ORDER BY timestamp DESC, id DESC")]
+
+    seen = []
+    pages = 0
+    cursor = None
+    while True:
+        params = {"type": "paging", "limit": 7}
+        if cursor:
+            params["cursor"] = cursor
+        response = api_client.get("/diagnoses", params=params)
+        assert response.status_code == 200
+        seen += [item["id"] for item in response.json()]
+        pages += 1
+        cursor = response.headers.get("x-next-cursor")
+        if cursor is None:
+            break
+    assert seen == expected
+    assert pages == 3
+
+
+def test_diagnoses_no_cursor_when_page_is_exactly_the_rest(api_client):
+    api = api_client.api
+    with api.db_pool.connection() as conn:
+        conn.execute("DELETE FROM diagnoses WHERE type = 'exact'")
+        conn.executemany("INSERT INTO diagnoses (timestamp, type, disease, confidence) VALUES (?, 'exact', 'x', 0.5)",
+                         [("2026-03-01 00:00:00",)] * 4)
+        conn.commit()
+    response = api_client.get("/diagnoses", params={"type": "exact", "limit": 4})
+    assert len(response.json()) == 4
+    assert "x-next-cursor" not in response.headers
@@ -0,0 +1,85 @@
+import asyncio
+import functools
+import io
+
+from PIL import Image, ImageDraw
+
+from phash_index import NearDuplicateIndex
+from prediction_cache import PredictionCache
+
+
+def lookup(index, model_id, value_hash, resolve=None):
+    return asyncio.run(index.lookup(model_id, value_hash, resolve=resolve))
+
+
+def resolver(mapping):
+    async def resolve(value):
+        return mapping(value)
+    return resolve
+
+
+def image_bytes(color, pattern=False, size=(256, 192), quality=90):
+    image = Image.new('RGB', size, color)
+    if pattern:
+        draw = ImageDraw.Draw(image)
+        for i in range(0, size[0], 32):
+            draw.rectangle([i, (i * 3) % size[1], i + 16, size[1]], fill=(i % 255, 200 - i % 200, 90))
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def test_solid_color_images_are_not_matched():
+    index = NearDuplicateIndex(max_distance=4, capacity=10)
+    red = index.compute(image_bytes((255, 0, 0)))
+    green = index.compute(image_bytes((0, 255, 0)))
+    assert red is None and green is None
+    assert index.stats()["low_entropy"] == 2
+
+
+def test_recompressed_image_matches():
+    index = NearDuplicateIndex(max_distance=4, capacity=10)
+    original = index.compute(image_bytes((10, 120, 30), pattern=True))
+    again = index.compute(image_bytes((10, 120, 30), pattern=True, quality=60))
+    assert original is not None and again is not None
+    index.add("m", original, "key-a")
+    assert lookup(index, "m", again, resolve=resolver(lambda key: {"key": key})) == {"key": "key-a"}
+
+
+def test_lookup_skips_and_drops_stale_candidates():
+    index = NearDuplicateIndex(max_distance=4, capacity=10)
+    base = 0x0F0F_F0F0_3C3C_C3C3
+    index.add("m", base, "evicted")
+    index.add("m", base ^ 0b11, "alive")
+    cached = {"alive": {"predictions": []}}
+
+    # Ứng viên gần nhất đã hết trong cache, ứng viên kế tiếp vẫn dùng được
+    assert lookup(index, "m", base, resolve=resolver(cached.get)) == {"predictions": []}
+    assert index.stats()["stale"] == 1
+    assert index.stats()["entries"] == {"m": 1}
+
+
+def test_capacity_evicts_oldest():
+    index = NearDuplicateIndex(max_distance=2, capacity=2)
+    hashes = [0x0123_4567_89AB_CDEF, 0xFEDC_BA98_7654_3210, 0x0F0F_0F0F_F0F0_F0F0]
+    for i, value_hash in enumerate(hashes):
+        index.add("m", value_hash, i)
+    assert lookup(index, "m", hashes[0]) is None
+    assert lookup(index, "m", hashes[2]) == 2
+
+
+def test_candidates_resolve_from_disk_tier(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = PredictionCache(max_entries=1, db_path=path)
+    cache.set("m:a", {"predictions": ["a"]})
+    cache.set("m:b", {"predictions": ["b"]})
+    cache.close()
+
+    # "m:a" đã bị đẩy khỏi bộ nhớ nhưng vẫn còn trên đĩa
+    cache = PredictionCache(max_entries=1, db_path=path)
+    index = NearDuplicateIndex(max_distance=4, capacity=1000)
+    value_hash = 0x0F0F_F0F0_3C3C_C3C3
+    index.add("m", value_hash, "m:a")
+    assert lookup(index, "m", value_hash ^ 1, resolve=functools.partial(cache.get, record=False)) == {"predictions": ["a"]}
+    assert index.stats()["stale"] == 0
+    cache.close()
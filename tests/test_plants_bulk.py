@@ -0,0 +1,100 @@
+import asyncio
+import threading
+
+import pytest
+from pydantic import BaseModel
+from typing import Optional
+
+import plants_bulk
+from db import SQLitePool
+
+
+class Plant(BaseModel):
+    name: str
+    scientific_name: Optional[str] = None
+    description: Optional[str] = None
+    care_instructions: Optional[str] = None
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = SQLitePool(str(tmp_path / "plants.db"), size=4)
+    with pool.connection() as conn:
+        conn.execute('''
+            CREATE TABLE plants (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE NOT NULL,
+                scientific_name TEXT,
+                description TEXT,
+                care_instructions TEXT
+            )
+        ''')
+        conn.execute("INSERT INTO plants (name, description) VALUES ('Lúa', 'cũ')")
+        conn.commit()
+    yield pool
+    pool.close()
+
+
+def records(*names):
+    return [(i, {"name": name, "description": "mới"}) for i, name in enumerate(names)]
+
+
+def test_skip_keeps_existing_rows(pool):
+    outcomes = plants_bulk.import_chunk(pool, records("Lúa", "Cà chua", "Cà chua"), "skip", Plant)
+    assert [o["status"] for o in outcomes] == ["skipped", "inserted", "skipped"]
+    assert outcomes[1]["id"] == outcomes[2]["id"]
+    with pool.connection() as conn:
+        assert conn.execute("SELECT description FROM plants WHERE name = 'Lúa'").fetchone()[0] == "cũ"
+
+
+def test_upsert_updates_existing_rows(pool):
+    outcomes = plants_bulk.import_chunk(pool, records("Lúa", "Ngô"), "upsert", Plant)
+    assert [o["status"] for o in outcomes] == ["updated", "inserted"]
+    with pool.connection() as conn:
+        assert conn.execute("SELECT description FROM plants WHERE name = 'Lúa'").fetchone()[0] == "mới"
+    assert plants_bulk.summarize(outcomes) == {"total": 2, "inserted": 1, "updated": 1, "skipped": 0, "failed": 0}
+
+
+def test_invalid_records_fail_without_blocking_chunk(pool):
+    chunk = [(0, '{"name": "Ngô"}'.encode()), (1, b'{not json'), (2, {"description": "thiếu tên"}), (3, [1, 2])]
+    outcomes = plants_bulk.import_chunk(pool, chunk, "skip", Plant)
+    by_index = {o["index"]: o["status"] for o in outcomes}
+    assert by_index == {0: "inserted", 1: "failed", 2: "failed", 3: "failed"}
+
+
+def test_concurrent_imports_count_each_insert_once(pool):
+    names = [f"Cây {i}" for i in range(50)]
+    results = []
+    barrier = threading.Barrier(4)
+
+    def run():
+        barrier.wait()
+        results.append(plants_bulk.import_chunk(pool, records(*names), "skip", Plant))
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    inserted = sum(o["status"] == "inserted" for outcomes in results for o in outcomes)
+    skipped = sum(o["status"] == "skipped" for outcomes in results for o in outcomes)
+    assert inserted == len(names)
+    assert skipped == 3 * len(names)
+
+
+def test_read_records_json_and_ndjson():
+    async def collect(chunks, ndjson):
+        async def stream():
+            for chunk in chunks:
+                yield chunk
+        return [item async for item in plants_bulk.read_records(stream(), ndjson)]
+
+    assert asyncio.run(collect([b'{"plants": [{"name": "A"}', b', {"name": "B"}]}'], False)) == [
+        (0, {"name": "A"}), (1, {"name": "B"})
+    ]
+    assert asyncio.run(collect([b'{"name": "A"}\n\n{"na', b'me": "B"}'], True)) == [
+        (0, b'{"name": "A"}'), (1, b'{"name": "B"}')
+    ]
+    with pytest.raises(plants_bulk.BulkImportError):
+        asyncio.run(collect([b'{"name": "A"}'], False))
@@ -0,0 +1,40 @@
+import asyncio
+
+from prediction_cache import PredictionCache
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = PredictionCache(max_entries=10, db_path=path)
+    cache.set("m:a", {"predictions": [1]})
+    assert cache.peek("m:a") == {"predictions": [1]}
+    cache.close()
+
+    cache = PredictionCache(max_entries=10, db_path=path)
+    assert cache.peek("m:a") is None
+    assert asyncio.run(cache.get("m:a")) == {"predictions": [1]}
+    # Đã nạp lại vào bộ nhớ
+    assert cache.peek("m:a") == {"predictions": [1]}
+    stats = cache.stats()
+    assert stats["disk_hits"] == 1 and stats["misses"] == 0
+    cache.close()
+
+
+def test_expired_and_excess_entries_pruned(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = PredictionCache(max_entries=10, ttl=60, db_path=path)
+    cache.disk.max_entries = 3
+    for i in range(5):
+        cache.set(f"m:{i}", {"i": i})
+    cache.close()
+
+    cache = PredictionCache(max_entries=10, ttl=60, db_path=path)
+    cache.disk.max_entries = 3
+    cache.disk.prune(0)
+    assert cache.disk.count() == 3
+    assert asyncio.run(cache.get("m:0")) is None
+    assert asyncio.run(cache.get("m:4")) == {"i": 4}
+
+    cache.disk.prune(float("inf"))
+    assert cache.disk.count() == 0
+    cache.close()
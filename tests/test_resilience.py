@@ -0,0 +1,157 @@
+import asyncio
+import time
+
+import pytest
+
+import diagnosis
+from resilience import CircuitBreaker, CircuitOpenError, ResilientCaller, RetryBudget
+from upstream import UpstreamError
+
+
+def test_breaker_opens_on_error_rate():
+    breaker = CircuitBreaker(error_rate=0.5, min_requests=4, window=60, cooldown=60)
+    for success in (True, False, True):
+        assert breaker.allow()
+        breaker.record(success)
+    assert breaker.state == "closed"
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_breaker_half_open_allows_single_probe():
+    breaker = CircuitBreaker(error_rate=0.5, min_requests=1, window=60, cooldown=0.01)
+    breaker.record(False)
+    assert breaker.state == "open"
+    time.sleep(0.02)
+
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert breaker.opens == 2
+
+    time.sleep(0.02)
+    assert breaker.allow()
+    # Probe bị hủy thì request sau được thử
+    breaker.cancel()
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed"
+    assert breaker.allow() and breaker.allow()
+
+
+def test_budget_limits_extra_attempts():
+    budget = RetryBudget(ratio=0.5, burst=1)
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw()
+    assert budget.denied == 1
+
+
+def make_caller(**kwargs):
+    kwargs.setdefault("hedge_delay_ms", 20)
+    kwargs.setdefault("hedge_min_delay_ms", 1)
+    kwargs.setdefault("breaker", CircuitBreaker(min_requests=1000))
+    return ResilientCaller(**kwargs)
+
+
+def test_hedge_fires_for_slow_attempt():
+    async def scenario():
+        caller = make_caller(budget=RetryBudget(ratio=0, burst=1))
+        calls = []
+
+        async def fn():
+            calls.append(time.perf_counter())
+            await asyncio.sleep(0.2 if len(calls) == 1 else 0.01)
+            return len(calls)
+
+        return caller, await caller.call(fn)
+
+    caller, result = asyncio.run(scenario())
+    assert result == 2
+    assert caller.hedges == 1 and caller.hedge_wins == 1
+
+
+def test_no_hedge_without_budget():
+    async def scenario():
+        caller = make_caller(budget=RetryBudget(ratio=0, burst=0))
+
+        async def fn():
+            await asyncio.sleep(0.08)
+            return "slow"
+
+        return caller, await caller.call(fn)
+
+    caller, result = asyncio.run(scenario())
+    assert result == "slow"
+    assert caller.hedges == 0 and caller.attempts == 1
+    assert caller.budget.denied == 1
+
+
+def test_queueing_on_limiter_is_not_timed():
+    async def scenario():
+        limiter = asyncio.Semaphore(1)
+        caller = make_caller(attempt_timeout=0.05, limiter=limiter, budget=RetryBudget(ratio=0, burst=5))
+
+        async def fn():
+            await asyncio.sleep(0.01)
+            return "ok"
+
+        await limiter.acquire()
+        call = asyncio.ensure_future(caller.call(fn))
+        # Chờ chỗ lâu hơn cả deadline lẫn mốc hedge
+        await asyncio.sleep(0.15)
+        assert caller.attempts == 0
+        limiter.release()
+        return caller, await call
+
+    caller, result = asyncio.run(scenario())
+    assert result == "ok"
+    assert caller.timeouts == 0
+    assert caller.hedges == 0 and caller.attempts == 1
+    assert caller.latency.samples[0] < 0.05
+
+
+def test_fast_failure_retried_once_then_raised():
+    async def scenario():
+        caller = make_caller(max_attempts=2, budget=RetryBudget(ratio=0, burst=5))
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            raise UpstreamError("Roboflow returned 503")
+
+        with pytest.raises(UpstreamError):
+            await caller.call(fn)
+        return caller, calls
+
+    caller, calls = asyncio.run(scenario())
+    assert len(calls) == 2
+    assert caller.errors == 1
+
+
+def test_open_circuit_rejects_without_calling():
+    async def scenario():
+        breaker = CircuitBreaker(min_requests=1, cooldown=60)
+        breaker.record(False)
+        caller = make_caller(breaker=breaker)
+
+        async def fn():
+            raise AssertionError("should not be called")
+
+        with pytest.raises(CircuitOpenError):
+            await caller.call(fn)
+
+    asyncio.run(scenario())
+
+
+def test_error_status_mapping():
+    assert diagnosis.error_status(CircuitOpenError()) == 503
+    assert diagnosis.error_status(UpstreamError("Roboflow returned 500")) == 502
+    assert diagnosis.error_status(asyncio.TimeoutError()) == 502
+    assert diagnosis.error_status(ValueError("bug")) == 500
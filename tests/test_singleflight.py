@@ -0,0 +1,118 @@
+import asyncio
+import io
+
+import pytest
+
+import diagnosis
+from backends import InferenceBackend
+from prediction_cache import PredictionCache
+from singleflight import SingleFlight
+from uploads import spool_stream
+
+
+def test_concurrent_calls_share_one_run():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"ok": True}
+
+        results = await asyncio.gather(*(flight.do("k", work) for _ in range(5)))
+        return flight, calls, results
+
+    flight, calls, results = asyncio.run(scenario())
+    assert calls == [1]
+    assert results == [{"ok": True}] * 5
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "followers": 4, "orphaned_errors": 0}
+
+
+def test_followers_get_result_when_leader_cancelled():
+    async def scenario():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return 42
+
+        leader = asyncio.ensure_future(flight.do("k", work))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do("k", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        return await follower, leader.cancelled()
+
+    assert asyncio.run(scenario()) == (42, True)
+
+
+def test_errors_reach_waiters_and_orphans_are_retrieved(caplog):
+    async def scenario():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def fail():
+            await release.wait()
+            raise RuntimeError("upstream down")
+
+        with pytest.raises(RuntimeError):
+            await asyncio.gather(flight.do("a", fail), flight.do("a", fail), asyncio.sleep(0, release.set()))
+
+        # Request duy nhất bị hủy trước khi task lỗi
+        release.clear()
+        waiter = asyncio.ensure_future(flight.do("b", fail))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        release.set()
+        await asyncio.sleep(0.01)
+        return flight
+
+    flight = asyncio.run(scenario())
+    assert flight.stats()["orphaned_errors"] == 1
+    assert "never retrieved" not in caplog.text
+
+
+class SlowBackend(InferenceBackend):
+    name = "test"
+    model_id = "test/slow"
+
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def predict(self, image_bytes):
+        self.calls += 1
+        await self.release.wait()
+        return {"predictions": [{"class": "leaf", "confidence": 0.9, "size": len(image_bytes)}]}
+
+
+def test_followers_survive_leader_upload_closed(monkeypatch):
+    monkeypatch.setattr(diagnosis, "prediction_cache", PredictionCache(max_entries=10, db_path=""))
+    monkeypatch.setattr(diagnosis, "inflight", SingleFlight())
+    monkeypatch.setattr(diagnosis.near_duplicates, "enabled", False)
+    content = b"same image" * 100
+
+    async def scenario():
+        backend = SlowBackend()
+        monkeypatch.setitem(diagnosis.backends, "plant", backend)
+        leader_upload = spool_stream(io.BytesIO(content))
+        follower_upload = spool_stream(io.BytesIO(content))
+
+        leader = asyncio.ensure_future(diagnosis.diagnose("plant", leader_upload))
+        await asyncio.sleep(0.05)
+        follower = asyncio.ensure_future(diagnosis.diagnose("plant", follower_upload))
+        await asyncio.sleep(0)
+        # Client của leader ngắt kết nối: request bị hủy, file upload bị đóng
+        leader.cancel()
+        leader_upload.close()
+        follower_upload.close()
+        backend.release.set()
+        return backend, await follower
+
+    backend, result = asyncio.run(scenario())
+    assert backend.calls == 1
+    assert result["predictions"][0]["size"] == len(content)
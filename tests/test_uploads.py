@@ -0,0 +1,39 @@
+import io
+
+import pytest
+from PIL import Image
+
+import uploads
+
+
+def png(width=8, height=6):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_prepare_file_reads_header_and_hash():
+    image = uploads.prepare_file(io.BytesIO(png()))
+    assert (image.format, image.width, image.height) == ("PNG", 8, 6)
+    assert image.size == len(png())
+
+
+@pytest.mark.parametrize("data, status", [
+    (b"not an image at all", 415),
+    (png()[:40], 400),
+    (b"\xff\xd8\xff" + b"\x00" * 64, 400),
+])
+def test_invalid_images_rejected_even_without_pixel_cap(data, status):
+    with pytest.raises(uploads.InvalidImage) as error:
+        uploads.inspect_image(io.BytesIO(data), max_pixels=0)
+    assert error.value.status_code == status
+    with pytest.raises(uploads.InvalidImage):
+        uploads.UploadedImage(io.BytesIO(data), len(data), "x").inspect(max_pixels=0)
+
+
+def test_pixel_cap():
+    with pytest.raises(uploads.InvalidImage):
+        uploads.inspect_image(io.BytesIO(png(100, 100)), max_pixels=9999)
+    assert uploads.inspect_image(io.BytesIO(png(100, 100)), max_pixels=0) == ("PNG", 100, 100)
+    image = uploads.UploadedImage(io.BytesIO(png(100, 100)), 0, "x").inspect(max_pixels=0)
+    assert (image.width, image.height) == (100, 100)
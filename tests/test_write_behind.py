@@ -0,0 +1,145 @@
+import json
+import sqlite3
+
+import pytest
+
+from db import SQLitePool
+from write_behind import WriteBehindError, WriteBehindWriter
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = SQLitePool(str(tmp_path / "wb.db"))
+    with pool.connection() as conn:
+        conn.execute('''
+            CREATE TABLE diagnoses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                disease TEXT NOT NULL,
+                confidence REAL
+            )
+        ''')
+        conn.commit()
+    yield pool
+    pool.close()
+
+
+def make_writer(pool, tmp_path, **kwargs):
+    kwargs.setdefault("interval_ms", 1)
+    kwargs.setdefault("id_block_size", 10)
+    return WriteBehindWriter(pool, 'diagnoses', ('disease', 'confidence'),
+                             dead_letter_path=str(tmp_path / "dead.jsonl"), **kwargs)
+
+
+def rows_in_db(pool):
+    with pool.connection() as conn:
+        return conn.execute('SELECT id, disease, confidence FROM diagnoses ORDER BY id').fetchall()
+
+
+def test_ids_follow_submission_order(pool, tmp_path):
+    writer = make_writer(pool, tmp_path)
+    ids = [writer.submit((f"d{i}", i / 10)) for i in range(5)]
+    ids += writer.submit_many([("d5", 0.5), ("d6", 0.6)])
+    writer.close()
+
+    assert ids == sorted(ids) and len(set(ids)) == 7
+    assert rows_in_db(pool) == [(row_id, f"d{i}", i / 10) for i, row_id in enumerate(ids)]
+
+
+def test_poison_row_is_dead_lettered_and_rest_written(pool, tmp_path):
+    writer = make_writer(pool, tmp_path)
+    writer.submit_many([("ok1", 0.1), (None, 0.2), ("ok2", 0.3), ("ok3", 0.4)])
+    writer.close()
+
+    assert [row[1] for row in rows_in_db(pool)] == ["ok1", "ok2", "ok3"]
+    with open(tmp_path / "dead.jsonl", encoding='utf-8') as f:
+        dead = [json.loads(line) for line in f]
+    assert len(dead) == 1
+    assert dead[0]["row"][1:] == [None, 0.2]
+    assert "NOT NULL" in dead[0]["error"]
+    assert writer.stats()["dead_lettered"] == 1
+    assert writer.stats()["pending"] == 0
+
+
+def test_later_writes_not_blocked_by_failed_batch(pool, tmp_path):
+    writer = make_writer(pool, tmp_path)
+    writer.submit((None, 0.0))
+    writer.flush()
+    writer.submit(("after", 1.0))
+    writer.flush()
+    writer.close()
+
+    assert [row[1] for row in rows_in_db(pool)] == ["after"]
+
+
+def test_transient_errors_retried_then_dead_lettered(pool, tmp_path, monkeypatch):
+    writer = make_writer(pool, tmp_path, max_attempts=3)
+    calls = []
+
+    def locked(rows):
+        calls.append(len(rows))
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(writer, "_insert", locked)
+    writer.submit_many([("a", 0.1), ("b", 0.2)])
+    writer.flush()
+    assert writer.stats()["retrying"] == 2
+
+    writer.close()
+    # Lỗi tạm thời không chia đôi lô, chỉ thử lại đủ số lần
+    assert calls == [2, 2, 2]
+    assert writer.stats()["dead_lettered"] == 2
+    assert writer.pending() == 0
+
+
+def test_transient_error_recovers(pool, tmp_path, monkeypatch):
+    writer = make_writer(pool, tmp_path, max_attempts=3)
+    insert = writer._insert
+    failures = iter([True])
+
+    def flaky(rows):
+        if next(failures, False):
+            raise sqlite3.OperationalError("database is locked")
+        insert(rows)
+
+    monkeypatch.setattr(writer, "_insert", flaky)
+    writer.submit(("retry", 0.5))
+    writer.close()
+
+    assert [row[1] for row in rows_in_db(pool)] == ["retry"]
+    assert writer.stats()["dead_lettered"] == 0
+
+
+def test_close_raises_when_rows_cannot_be_persisted(pool, tmp_path, monkeypatch):
+    writer = make_writer(pool, tmp_path, max_attempts=1)
+    writer.dead_letter_path = str(tmp_path / "missing" / "dead.jsonl")
+    monkeypatch.setattr(writer, "_insert", lambda rows: (_ for _ in ()).throw(sqlite3.OperationalError("disk I/O error")))
+    writer.submit(("x", 0.1))
+
+    with pytest.raises(WriteBehindError):
+        writer.close()
+
+
+def test_plain_inserts_do_not_reuse_reserved_ids(pool, tmp_path):
+    writer = make_writer(pool, tmp_path, id_block_size=100)
+    reserved = writer.submit(("behind", 0.1))
+
+    # Process khác ghi trực tiếp (DIAGNOSIS_WRITE_BEHIND=0)
+    with pool.connection() as conn:
+        plain_id = conn.execute("INSERT INTO diagnoses (disease) VALUES ('plain')").lastrowid
+        conn.commit()
+    more = writer.submit_many([("behind", 0.2)] * 3)
+    writer.close()
+
+    assert plain_id >= reserved + 100
+    assert plain_id not in more
+    assert len(rows_in_db(pool)) == 5
+
+
+def test_allocator_requires_autoincrement(tmp_path):
+    pool = SQLitePool(str(tmp_path / "plain.db"))
+    with pool.connection() as conn:
+        conn.execute('CREATE TABLE diagnoses (id INTEGER PRIMARY KEY, disease TEXT, confidence REAL)')
+        conn.commit()
+    with pytest.raises(WriteBehindError):
+        make_writer(pool, tmp_path)
+    pool.close()
@@ -0,0 +1,125 @@
+"""Tổng hợp trace request (traces.jsonl do TracingMiddleware ghi) theo từng bước
+
+Sử dụng:
+    python trace_summary.py traces.jsonl --path /predict/plant --slowest 5
+    python trace_summary.py traces.jsonl --json > summary.json
+    python trace_summary.py traces.w*.jsonl   # nhiều worker (serve.py)
+"""
+import argparse
+import glob
+import json
+import statistics
+
+
+def load_traces(path, include_rotated=True):
+    """Đọc file trace và các file đã xoay vòng (traces.jsonl.1, .2, ...)"""
+    files = [path]
+    if include_rotated:
+        rotated = glob.glob(f"{glob.escape(path)}.*")
+        files = sorted(rotated, key=lambda name: int(name.rsplit('.', 1)[-1]) if name.rsplit('.', 1)[-1].isdigit() else 0,
+                       reverse=True) + files
+    traces = []
+    for name in files:
+        try:
+            with open(name, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        try:
+                            traces.append(json.loads(line))
+                        except ValueError:
+                            continue
+        except FileNotFoundError:
+            continue
+    return traces
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(traces):
+    """Thống kê thời gian (ms) theo bước: số lần, trung bình, p50/p95/p99, max, tỉ trọng"""
+    durations = sorted(trace["duration_ms"] for trace in traces)
+    total_time = sum(durations)
+    stages = {}
+    for trace in traces:
+        for name, value in trace.get("stages", {}).items():
+            stages.setdefault(name, []).append(value)
+
+    summary = {
+        "requests": len(traces),
+        "duration_ms": _describe(durations) if durations else None,
+        "stages": {}
+    }
+    for name, values in sorted(stages.items(), key=lambda item: -sum(item[1])):
+        values.sort()
+        stat = _describe(values)
+        stat["share"] = sum(values) / total_time if total_time > 0 else 0
+        summary["stages"][name] = stat
+    return summary
+
+
+def _describe(values):
+    return {
+        "count": len(values),
+        "mean": statistics.fmean(values),
+        "p50": percentile(values, 0.5),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": values[-1]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tổng hợp trace request theo từng bước")
+    parser.add_argument("files", nargs="*", default=["traces.jsonl"],
+                        help="File trace, vd traces.w*.jsonl khi chạy nhiều worker (serve.py)")
+    parser.add_argument("--path", help="Chỉ lấy trace của endpoint này, vd /predict/plant")
+    parser.add_argument("--model", help="Chỉ lấy trace của model này")
+    parser.add_argument("--status", type=int, help="Chỉ lấy trace có status này")
+    parser.add_argument("--slowest", type=int, default=5, help="Số request chậm nhất in chi tiết")
+    parser.add_argument("--no-rotated", action="store_true", help="Bỏ qua các file đã xoay vòng")
+    parser.add_argument("--json", action="store_true", help="In kết quả dạng JSON")
+    args = parser.parse_args()
+
+    traces = []
+    for path in args.files:
+        traces.extend(load_traces(path, include_rotated=not args.no_rotated))
+    if args.path:
+        traces = [t for t in traces if t.get("path") == args.path]
+    if args.model:
+        traces = [t for t in traces if t.get("model") == args.model]
+    if args.status is not None:
+        traces = [t for t in traces if t.get("status") == args.status]
+
+    summary = summarize(traces)
+    slowest = sorted(traces, key=lambda t: t["duration_ms"], reverse=True)[:args.slowest]
+
+    if args.json:
+        print(json.dumps({"summary": summary, "slowest": slowest}, indent=2, ensure_ascii=False))
+        return
+
+    if not traces:
+        print("❌ Không có trace nào")
+        return
+
+    overall = summary["duration_ms"]
+    print(f"📊 {summary['requests']} request - p50 {overall['p50']:.1f}ms, p95 {overall['p95']:.1f}ms, "
+          f"p99 {overall['p99']:.1f}ms, max {overall['max']:.1f}ms")
+    print(f"\n{'bước':16s} {'số lần':>7s} {'mean':>9s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'max':>9s} {'tỉ trọng':>9s}")
+    for name, stat in summary["stages"].items():
+        print(f"{name:16s} {stat['count']:7d} {stat['mean']:9.2f} {stat['p50']:9.2f} {stat['p95']:9.2f} "
+              f"{stat['p99']:9.2f} {stat['max']:9.2f} {stat['share'] * 100:8.1f}%")
+
+    if slowest:
+        print(f"\n🐢 {len(slowest)} request chậm nhất:")
+        for trace in slowest:
+            stages = ", ".join(f"{name} {value:.1f}" for name, value in
+                               sorted(trace.get("stages", {}).items(), key=lambda item: -item[1]))
+            print(f"  {trace['ts']} {trace.get('path')} {trace['duration_ms']:.1f}ms "
+                  f"[{trace.get('model', '-')}, cache {trace.get('cache', '-')}] {stages}")
+
+
+if __name__ == "__main__":
+    main()
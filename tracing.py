@@ -0,0 +1,136 @@
+import json
+import logging
+import os
+import queue
+import random
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Tỉ lệ request được ghi trace ra file (0 để tắt)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.01))
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", 10 * 1024 * 1024))
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", 5))
+# Các đường dẫn có header Server-Timing, phân cách bằng dấu phẩy
+TRACE_PATHS = tuple(path for path in os.getenv("TRACE_PATHS", "/predict").split(",") if path)
+
+current_trace = ContextVar("current_trace", default=None)
+
+
+class RequestTrace:
+    """Thời gian từng bước của một request, cộng dồn theo tên bước"""
+
+    __slots__ = ("started", "stages", "attrs")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.attrs = {}
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def server_timing(self):
+        parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.stages.items()]
+        parts.append(f"app;dur={(time.perf_counter() - self.started) * 1000:.2f}")
+        return ", ".join(parts)
+
+
+def record(name, seconds):
+    """Gọi từ metrics.stage(): ghi thêm thời gian bước vào trace của request hiện tại"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+def annotate(**attrs):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+
+class TraceWriter:
+    """Ghi trace dạng JSON lines ra file xoay vòng, từ một thread riêng
+
+    Request chỉ đẩy bản ghi vào hàng đợi nên không chờ ghi đĩa.
+    """
+
+    def __init__(self, path=TRACE_FILE, max_bytes=TRACE_MAX_BYTES, backups=TRACE_BACKUPS):
+        self.path = path
+        self.logger = logging.getLogger(f"{__name__}.{path}")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self._queue = queue.SimpleQueue()
+        self._listener = None
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.written = 0
+
+    def _start(self):
+        handler = RotatingFileHandler(self.path, maxBytes=self.max_bytes, backupCount=self.backups, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self._queue_handler = QueueHandler(self._queue)
+        self.logger.addHandler(self._queue_handler)
+        self._listener = QueueListener(self._queue, handler)
+        self._listener.start()
+
+    def write(self, record):
+        if self._listener is None:
+            self._start()
+        self.logger.info(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+        self.written += 1
+
+    def close(self):
+        if self._listener is not None:
+            self.logger.removeHandler(self._queue_handler)
+            self._listener.stop()
+            for handler in self._listener.handlers:
+                handler.close()
+            self._listener = None
+
+
+trace_writer = TraceWriter()
+
+
+class TracingMiddleware:
+    """Thêm header Server-Timing cho /predict/* và lấy mẫu trace ghi ra file"""
+
+    def __init__(self, app, sample_rate=TRACE_SAMPLE_RATE, paths=TRACE_PATHS, writer=None):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.paths = paths
+        self.writer = writer if writer is not None else trace_writer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace()
+        token = current_trace.set(trace)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing().encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_trace.reset(token)
+            if self.sample_rate > 0 and random.random() < self.sample_rate:
+                self.writer.write({
+                    "ts": datetime.now(timezone.utc).isoformat(),
+                    "path": scope["path"],
+                    "method": scope["method"],
+                    "status": status[0],
+                    "duration_ms": round((time.perf_counter() - trace.started) * 1000, 3),
+                    "stages": {name: round(seconds * 1000, 3) for name, seconds in trace.stages.items()},
+                    **trace.attrs
+                })
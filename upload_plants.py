@@ -1,49 +1,176 @@
-import requests
+import argparse
 import json
+import os
+import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
 
 # Thay URL này bằng URL Railway của bạn
 API_URL = "https://your-railway-url.railway.app"
 
-def upload_plants():
-    """Upload tất cả plants từ file JSON lên API"""
-    
-    # Đọc dữ liệu từ file
-    with open('sample_plants.json', 'r', encoding='utf-8') as f:
-        plants_data = json.load(f)
-    
-    print(f"🌱 Bắt đầu upload {len(plants_data)} cây trồng...")
-    
-    success_count = 0
-    error_count = 0
-    
-    for i, plant in enumerate(plants_data, 1):
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", 8))
+# Số request tối đa mỗi giây (0 = không giới hạn)
+UPLOAD_RATE = float(os.getenv("UPLOAD_RATE", 20))
+UPLOAD_RETRIES = int(os.getenv("UPLOAD_RETRIES", 5))
+UPLOAD_TIMEOUT = float(os.getenv("UPLOAD_TIMEOUT", 30))
+CHECKPOINT_FILE = os.getenv("UPLOAD_CHECKPOINT", "upload_plants.checkpoint")
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class RateLimiter:
+    """Token bucket dùng chung cho các worker thay cho time.sleep cố định"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Checkpoint:
+    """File ghi tên các cây đã upload thành công, mỗi dòng một JSON"""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        self.done.add(json.loads(line)["name"])
+        self.file = open(path, 'a', encoding='utf-8') if path else None
+
+    def mark(self, name, status):
+        with self.lock:
+            self.done.add(name)
+            if self.file is not None:
+                self.file.write(json.dumps({"name": name, "status": status}, ensure_ascii=False) + "\n")
+                self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def make_session(workers):
+    """Session dùng lại connection (keep-alive) cho tất cả các worker"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Content-Type": "application/json"})
+    return session
+
+
+def backoff_delay(attempt, response=None):
+    """Exponential backoff có jitter, ưu tiên Retry-After của server"""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+    return min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def upload_one(session, limiter, plant, retries=UPLOAD_RETRIES, timeout=UPLOAD_TIMEOUT):
+    """Upload một cây, trả về (status, chi tiết); status là created / exists / error"""
+    for attempt in range(retries + 1):
+        limiter.acquire()
+        response = None
         try:
-            response = requests.post(
-                f"{API_URL}/plants",
-                json=plant,
-                headers={"Content-Type": "application/json"}
-            )
-            
+            response = session.post(f"{API_URL}/plants", json=plant, timeout=timeout)
+        except requests.RequestException as e:
+            detail = str(e)
+        else:
             if response.status_code == 200:
-                success_count += 1
-                print(f"✅ {i:3d}. {plant['name']} - Thành công")
-            else:
-                error_count += 1
-                print(f"❌ {i:3d}. {plant['name']} - Lỗi: {response.status_code}")
-                print(f"    {response.text}")
-                
-        except Exception as e:
-            error_count += 1
-            print(f"❌ {i:3d}. {plant['name']} - Exception: {str(e)}")
-        
-        # Delay nhỏ để tránh spam API
-        time.sleep(0.1)
-    
+                return "created", None
+            if response.status_code == 400 and "already exists" in response.text:
+                return "exists", None
+            detail = f"{response.status_code}: {response.text[:200]}"
+            if response.status_code not in RETRY_STATUS:
+                return "error", detail
+        if attempt < retries:
+            time.sleep(backoff_delay(attempt, response))
+    return "error", detail
+
+
+def upload_plants(path='sample_plants.json', workers=UPLOAD_WORKERS, rate=UPLOAD_RATE,
+                  checkpoint_path=CHECKPOINT_FILE, retries=UPLOAD_RETRIES):
+    """Upload song song tất cả plants từ file JSON lên API, bỏ qua cây đã có trong checkpoint"""
+
+    # Đọc dữ liệu từ file
+    with open(path, 'r', encoding='utf-8') as f:
+        plants_data = json.load(f)
+
+    checkpoint = Checkpoint(checkpoint_path)
+    pending = [(i, plant) for i, plant in enumerate(plants_data, 1) if plant['name'] not in checkpoint.done]
+    skipped = len(plants_data) - len(pending)
+
+    print(f"🌱 Bắt đầu upload {len(pending)} cây trồng ({workers} worker, tối đa {rate or '∞'} req/s)...")
+    if skipped:
+        print(f"⏭️  Bỏ qua {skipped} cây đã upload (checkpoint: {checkpoint_path})")
+
+    session = make_session(workers)
+    limiter = RateLimiter(rate)
+    counts = {"created": 0, "exists": 0, "error": 0}
+    started = time.perf_counter()
+    last_report = started
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(upload_one, session, limiter, plant, retries): (i, plant)
+                for i, plant in pending
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                i, plant = futures[future]
+                status, detail = future.result()
+                counts[status] += 1
+                if status == "error":
+                    print(f"❌ {i:3d}. {plant['name']} - Lỗi: {detail}")
+                else:
+                    checkpoint.mark(plant['name'], status)
+
+                now = time.perf_counter()
+                if now - last_report >= 2 or done == len(pending):
+                    last_report = now
+                    print(f"📦 {done}/{len(pending)} - {done / (now - started):.1f} cây/s, lỗi {counts['error']}")
+    finally:
+        checkpoint.close()
+        session.close()
+
+    elapsed = time.perf_counter() - started
+    success_count = counts["created"] + counts["exists"]
     print(f"\n📊 Kết quả:")
-    print(f"✅ Thành công: {success_count}")
-    print(f"❌ Lỗi: {error_count}")
-    print(f"📈 Tỷ lệ thành công: {success_count/(success_count+error_count)*100:.1f}%")
+    print(f"✅ Thành công: {counts['created']} (đã tồn tại: {counts['exists']}, bỏ qua theo checkpoint: {skipped})")
+    print(f"❌ Lỗi: {counts['error']}")
+    if pending:
+        print(f"📈 Tỷ lệ thành công: {success_count/len(pending)*100:.1f}%")
+        print(f"⏱️  {elapsed:.1f}s - {len(pending)/max(elapsed, 1e-9):.1f} cây/s")
+    if counts["error"]:
+        print("💡 Chạy lại để thử upload các cây bị lỗi")
+    return counts
+
 
 def test_api():
     """Test API trước khi upload"""
@@ -51,11 +178,11 @@ def test_api():
         # Test root endpoint
         response = requests.get(f"{API_URL}/")
         print(f"Root endpoint: {response.status_code}")
-        
+
         # Test plants endpoint
         response = requests.get(f"{API_URL}/plants")
         print(f"Plants endpoint: {response.status_code}")
-        
+
         if response.status_code == 200:
             print("✅ API có endpoint /plants")
             return True
@@ -67,26 +194,38 @@ def test_api():
         print(f"❌ Không thể kết nối API: {str(e)}")
         return False
 
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upload cây trồng từ file JSON lên API")
+    parser.add_argument("--url", help="URL API (bỏ trống để nhập khi chạy)")
+    parser.add_argument("--file", default="sample_plants.json")
+    parser.add_argument("--workers", type=int, default=UPLOAD_WORKERS)
+    parser.add_argument("--rate", type=float, default=UPLOAD_RATE, help="Số request tối đa mỗi giây, 0 = không giới hạn")
+    parser.add_argument("--retries", type=int, default=UPLOAD_RETRIES)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE, help="File checkpoint, rỗng để tắt")
+    parser.add_argument("-y", "--yes", action="store_true", help="Không hỏi xác nhận")
+    args = parser.parse_args()
+
     print("🚀 UPLOAD PLANTS TO API")
     print("=" * 50)
-    
+
     # Nhập URL API
-    api_url = input("Nhập URL API Railway (hoặc Enter để dùng localhost): ").strip()
+    api_url = args.url if args.url is not None else input("Nhập URL API Railway (hoặc Enter để dùng localhost): ").strip()
     if api_url:
         API_URL = api_url.rstrip('/')
     else:
         API_URL = "http://localhost:8000"
-    
+
     print(f"🔗 API URL: {API_URL}")
-    
+
     # Test API
     if test_api():
         # Xác nhận upload
-        confirm = input("\n🤔 Bạn có muốn upload 100 cây trồng? (y/N): ").strip().lower()
+        confirm = "y" if args.yes else input("\n🤔 Bạn có muốn upload cây trồng? (y/N): ").strip().lower()
         if confirm in ['y', 'yes']:
-            upload_plants()
+            upload_plants(args.file, workers=args.workers, rate=args.rate,
+                          checkpoint_path=args.checkpoint, retries=args.retries)
         else:
             print("❌ Hủy upload")
     else:
-        print("❌ Không thể kết nối API. Kiểm tra lại URL.")
\ No newline at end of file
+        print("❌ Không thể kết nối API. Kiểm tra lại URL.")
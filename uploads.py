@@ -0,0 +1,235 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+
+from fastapi import HTTPException
+from PIL import Image
+
+import metrics
+
+# Kích thước tối đa của một ảnh upload (byte)
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 10 * 1024 * 1024))
+# Tổng dung lượng tối đa của một request /predict/batch (byte)
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", 200 * 1024 * 1024))
+# Dung lượng tối đa của body /plants/bulk (byte)
+PLANTS_BULK_MAX_BYTES = int(os.getenv("PLANTS_BULK_MAX_BYTES", 50 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 64 * 1024))
+# Phần vượt quá ngưỡng này được ghi ra file tạm thay vì giữ trong RAM
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", 1024 * 1024))
+# Header multipart, boundary, các field form nhỏ
+MULTIPART_OVERHEAD = 64 * 1024
+# Số pixel tối đa (chống decompression bomb), 0 để bỏ giới hạn số pixel
+# (định dạng và header ảnh vẫn luôn được kiểm tra)
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", 40_000_000))
+
+# Magic bytes -> định dạng PIL; WEBP cần thêm "WEBP" ở byte 8-12
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+    (b'BM', 'BMP'),
+    (b'II*\x00', 'TIFF'),
+    (b'MM\x00*', 'TIFF'),
+    (b'RIFF', 'WEBP')
+)
+
+
+class UploadTooLarge(HTTPException):
+    def __init__(self, max_bytes):
+        super().__init__(status_code=413, detail=f"Upload exceeds {max_bytes} bytes")
+
+
+class InvalidImage(HTTPException):
+    def __init__(self, detail, status_code=400):
+        super().__init__(status_code=status_code, detail=detail)
+
+
+def sniff_format(head):
+    """Đoán định dạng từ vài byte đầu, None nếu không hỗ trợ"""
+    for signature, image_format in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            if image_format == 'WEBP' and head[8:12] != b'WEBP':
+                return None
+            return image_format
+    return None
+
+
+def inspect_image(file, max_pixels=IMAGE_MAX_PIXELS):
+    """Kiểm tra nhanh ảnh: magic bytes + header PIL (không giải mã pixel)
+
+    Trả về (format, width, height); raise InvalidImage nếu không hợp lệ.
+    """
+    file.seek(0)
+    expected = sniff_format(file.read(16))
+    if expected is None:
+        raise InvalidImage("Unsupported image format", status_code=415)
+
+    file.seek(0)
+    try:
+        # Image.open chỉ đọc header, pixel chưa được giải mã
+        with Image.open(file, formats=[expected]) as image:
+            width, height = image.size
+    except Image.DecompressionBombError:
+        raise InvalidImage("Image dimensions too large")
+    except Exception:
+        raise InvalidImage(f"Corrupt {expected} image")
+    finally:
+        file.seek(0)
+
+    if width <= 0 or height <= 0:
+        raise InvalidImage("Image has zero size")
+    if max_pixels > 0 and width * height > max_pixels:
+        raise InvalidImage(f"Image dimensions too large: {width}x{height}")
+    return expected, width, height
+
+
+class UploadedImage:
+    """Ảnh đã upload: sha256, kích thước và nội dung nằm trong file tạm
+
+    Với stream (spool_stream, vd ảnh trong zip) sha256 được tính trong lúc
+    chép. Với UploadFile, Starlette đã ghi phần upload ra file tạm khi parse
+    multipart nên sha256 được tính ở một lượt đọc tuần tự sau đó (hash_file,
+    trong thread, không chép lại). Nội dung chỉ được đọc vào bộ nhớ (read())
+    khi cache không có kết quả.
+    """
+
+    def __init__(self, file, size, digest, filename=None):
+        self.file = file
+        self.size = size
+        self.digest = digest
+        self.filename = filename
+        self.format = None
+        self.width = None
+        self.height = None
+
+    def inspect(self, max_pixels=IMAGE_MAX_PIXELS):
+        self.format, self.width, self.height = inspect_image(self.file, max_pixels)
+        return self
+
+    def read_sync(self):
+        self.file.seek(0)
+        return self.file.read()
+
+    async def read(self):
+        return await asyncio.to_thread(self.read_sync)
+
+    def close(self):
+        self.file.close()
+
+
+def spool_stream(source, max_bytes=UPLOAD_MAX_BYTES, chunk_size=UPLOAD_CHUNK_SIZE, filename=None):
+    """Chép stream sang file tạm theo từng khối, vừa chép vừa hash, dừng ngay khi quá max_bytes"""
+    target = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(max_bytes)
+            digest.update(chunk)
+            target.write(chunk)
+    except BaseException:
+        target.close()
+        raise
+    return UploadedImage(target, size, digest.hexdigest(), filename)
+
+
+def hash_file(file, max_bytes=UPLOAD_MAX_BYTES, chunk_size=UPLOAD_CHUNK_SIZE, filename=None):
+    """Hash file đã có sẵn (file tạm của Starlette) theo từng khối, không chép lại"""
+    file.seek(0, os.SEEK_END)
+    if file.tell() > max_bytes:
+        raise UploadTooLarge(max_bytes)
+    file.seek(0)
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLarge(max_bytes)
+        digest.update(chunk)
+    return UploadedImage(file, size, digest.hexdigest(), filename)
+
+
+async def read_upload(upload, max_bytes=UPLOAD_MAX_BYTES):
+    """UploadFile -> UploadedImage, từ chối sớm nếu kích thước đã biết vượt giới hạn
+
+    Starlette đã lưu phần upload vào SpooledTemporaryFile (ra đĩa khi > 1MB)
+    trước khi handler chạy, nên không hash được trong lúc nhận; ở đây đọc lại
+    từng khối để hash, bộ nhớ dùng không phụ thuộc kích thước file.
+    """
+    if upload.size is not None and upload.size > max_bytes:
+        raise UploadTooLarge(max_bytes)
+    return await asyncio.to_thread(prepare_file, upload.file, max_bytes, upload.filename)
+
+
+def prepare_file(file, max_bytes=UPLOAD_MAX_BYTES, filename=None):
+    """Kiểm tra header ảnh trước (rẻ), rồi mới hash toàn bộ nội dung"""
+    with metrics.stage("validate"):
+        header = inspect_image(file)
+    with metrics.stage("read_upload"):
+        image = hash_file(file, max_bytes, UPLOAD_CHUNK_SIZE, filename)
+    image.format, image.width, image.height = header
+    return image
+
+
+class BodySizeLimitMiddleware:
+    """Giới hạn kích thước body của các endpoint upload và /plants/bulk
+
+    Từ chối ngay theo Content-Length; với body chunked thì đếm byte khi nhận
+    và dừng parse multipart khi vượt giới hạn.
+    """
+
+    def __init__(self, app, limits=None):
+        self.app = app
+        # Prefix cụ thể hơn đặt trước
+        self.limits = limits or [
+            ("/predict/batch", BATCH_MAX_BYTES + MULTIPART_OVERHEAD),
+            ("/predict", UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD),
+            ("/plants/bulk", PLANTS_BULK_MAX_BYTES)
+        ]
+
+    def _limit(self, path):
+        for prefix, limit in self.limits:
+            if path.startswith(prefix):
+                return limit
+        return None
+
+    async def __call__(self, scope, receive, send):
+        limit = self._limit(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            body = json.dumps({"detail": f"Request body exceeds {limit} bytes"}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 413,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise UploadTooLarge(limit)
+            return message
+
+        await self.app(scope, limited_receive, send)
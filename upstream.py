@@ -0,0 +1,96 @@
+import asyncio
+import os
+
+import httpx
+
+import metrics
+
+# Roboflow hosted inference
+ROBOFLOW_URL = os.getenv("ROBOFLOW_URL", "https://detect.roboflow.com")
+ROBOFLOW_API_KEY = os.getenv("ROBOFLOW_API_KEY", "y0YKSebPyue0doYszJEU")
+
+PLANT_MODEL = "plantvillage-dataset/1"
+RICE_MODEL = "rice-diseases-qzjka/3"
+
+# Số request tối đa đang gửi lên Roboflow cùng lúc (mỗi worker)
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", 32))
+# Số kết nối keep-alive giữ lại trong pool
+UPSTREAM_KEEPALIVE = int(os.getenv("UPSTREAM_KEEPALIVE", 16))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", 5))
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", 30))
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class UpstreamClient:
+    """Client bất đồng bộ dùng chung cho các API Roboflow"""
+
+    def __init__(self, base_url=ROBOFLOW_URL, api_key=ROBOFLOW_API_KEY,
+                 concurrency=UPSTREAM_CONCURRENCY, keepalive=UPSTREAM_KEEPALIVE,
+                 connect_timeout=UPSTREAM_CONNECT_TIMEOUT, timeout=UPSTREAM_TIMEOUT):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.concurrency = concurrency
+        self.keepalive = keepalive
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self._client = None
+        # Giới hạn số request đồng thời; ResilientCaller giữ semaphore này ngoài phần tính deadline
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    def _get_client(self):
+        # Tạo lười để client gắn với event loop đang chạy
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.concurrency,
+                    max_keepalive_connections=self.keepalive
+                ),
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout)
+            )
+        return self._client
+
+    async def predict(self, model_id, image_bytes, timeout=None):
+        """Gửi ảnh lên model Roboflow và trả về JSON kết quả"""
+        async with self.semaphore:
+            return await self.post(model_id, image_bytes, timeout)
+
+    async def post(self, model_id, image_bytes, timeout=None):
+        """Như predict() nhưng không giữ semaphore, người gọi tự giới hạn số request đồng thời"""
+        url = f"{self.base_url}/{model_id}"
+        request_timeout = httpx.USE_CLIENT_DEFAULT
+        if timeout is not None:
+            request_timeout = httpx.Timeout(timeout, connect=min(timeout, self.connect_timeout))
+
+        with metrics.stage("upstream", model=model_id):
+            response = await self._get_client().post(
+                url,
+                params={"api_key": self.api_key},
+                files={"file": image_bytes},
+                timeout=request_timeout
+            )
+        # Lỗi phía Roboflow (quá tải, 5xx) được tính cho circuit breaker
+        if response.status_code >= 500 or response.status_code == 429:
+            raise UpstreamError(f"Roboflow returned {response.status_code}")
+        with metrics.stage("parse", model=model_id):
+            return response.json()
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+client = UpstreamClient()
+
+
+async def call_plant_api(image_bytes, timeout=None):
+    """API chẩn đoán bệnh cây trồng tổng quát"""
+    return await client.predict(PLANT_MODEL, image_bytes, timeout=timeout)
+
+
+async def call_rice_api(image_bytes, timeout=None):
+    """API chẩn đoán bệnh lúa"""
+    return await client.predict(RICE_MODEL, image_bytes, timeout=timeout)
@@ -0,0 +1,287 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+# Bật ghi trễ (write-behind) cho bảng diagnoses; tắt mặc định vì dòng vừa
+# chẩn đoán chỉ xuất hiện trong /diagnoses, /history, /stats sau khi được flush
+DIAGNOSIS_WRITE_BEHIND = os.getenv("DIAGNOSIS_WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", 200))
+WRITE_BEHIND_INTERVAL_MS = float(os.getenv("WRITE_BEHIND_INTERVAL_MS", 100))
+# Số id mỗi lần xin trước từ database
+ID_BLOCK_SIZE = int(os.getenv("ID_BLOCK_SIZE", 1000))
+# Số lần thử ghi một lô khi database lỗi tạm thời (locked, I/O) trước khi bỏ vào dead-letter
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", 5))
+# File JSONL giữ các dòng không ghi được, để kiểm tra / ghi lại bằng tay
+WRITE_BEHIND_DEAD_LETTER = os.getenv("WRITE_BEHIND_DEAD_LETTER", "write_behind_dead_letter.jsonl")
+
+logger = logging.getLogger(__name__)
+
+
+def sqlite_timestamp():
+    """Thời điểm hiện tại theo định dạng của CURRENT_TIMESTAMP trong SQLite (UTC)"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class WriteBehindError(RuntimeError):
+    pass
+
+
+class IdAllocator:
+    """Cấp phát trước id cho bảng, theo từng khối lấy từ bảng id_allocator
+
+    Khối được xin trong transaction BEGIN IMMEDIATE nên nhiều process dùng
+    chung database không bao giờ nhận trùng id. Bảng phải dùng AUTOINCREMENT:
+    sqlite_sequence được đẩy lên cuối khối, nên INSERT thường (process chạy với
+    DIAGNOSIS_WRITE_BEHIND=0) cũng không lấy id nằm trong khối đã cấp.
+    """
+
+    def __init__(self, pool, table, block_size=ID_BLOCK_SIZE):
+        self.pool = pool
+        self.table = table
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+        with self.pool.connection() as conn:
+            sql = conn.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+            ).fetchone()
+            if sql is None or 'AUTOINCREMENT' not in sql[0].upper():
+                raise WriteBehindError(f"{table} must have an INTEGER PRIMARY KEY AUTOINCREMENT id")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS id_allocator (
+                    name TEXT PRIMARY KEY,
+                    next_id INTEGER NOT NULL
+                )
+            ''')
+            conn.commit()
+
+    def _reserve(self, count):
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT next_id FROM id_allocator WHERE name = ?', (self.table,)).fetchone()
+            # Không cấp id đã bị dùng bởi INSERT thường (AUTOINCREMENT)
+            max_id = conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {self.table}').fetchone()[0]
+            sequence = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (self.table,)).fetchone()
+            start = max(row[0] if row else 1, max_id + 1, (sequence[0] if sequence else 0) + 1)
+            end = start + count
+            conn.execute(
+                'INSERT OR REPLACE INTO id_allocator (name, next_id) VALUES (?, ?)',
+                (self.table, end)
+            )
+            # INSERT thường sẽ nhận id từ end trở đi, không đụng vào khối này
+            if sequence:
+                conn.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ?', (end - 1, self.table))
+            else:
+                conn.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (self.table, end - 1))
+            conn.commit()
+        return start
+
+    def allocate(self, count=1):
+        """Trả về danh sách `count` id liên tiếp hoặc không"""
+        with self._lock:
+            ids = []
+            while len(ids) < count:
+                if self._next >= self._end:
+                    size = max(self.block_size, count - len(ids))
+                    self._next = self._reserve(size)
+                    self._end = self._next + size
+                take = min(count - len(ids), self._end - self._next)
+                ids.extend(range(self._next, self._next + take))
+                self._next += take
+            return ids
+
+
+class WriteBehindWriter:
+    """Gom các dòng INSERT và ghi bằng executemany trong một transaction
+
+    submit() cấp id trước và trả về ngay; một thread nền ghi dữ liệu khi đủ
+    batch_size dòng hoặc sau interval_ms. close() ghi nốt phần còn lại.
+
+    Lô lỗi do database (OperationalError: locked, I/O...) được thử lại tối đa
+    max_attempts lần. Lô lỗi do dữ liệu (vd vi phạm ràng buộc) được chia đôi
+    đến khi tìm ra dòng lỗi, các dòng còn lại vẫn được ghi. Dòng không ghi
+    được ghi vào file dead-letter (JSONL) thay vì chặn các lần ghi sau.
+    """
+
+    def __init__(self, pool, table, columns, batch_size=WRITE_BEHIND_BATCH_SIZE,
+                 interval_ms=WRITE_BEHIND_INTERVAL_MS, id_block_size=ID_BLOCK_SIZE,
+                 max_attempts=WRITE_BEHIND_MAX_ATTEMPTS, dead_letter_path=WRITE_BEHIND_DEAD_LETTER):
+        self.pool = pool
+        self.table = table
+        self.columns = tuple(columns)
+        self.batch_size = batch_size
+        self.interval = interval_ms / 1000.0
+        self.max_attempts = max(1, max_attempts)
+        self.dead_letter_path = dead_letter_path
+        self.ids = IdAllocator(pool, table, id_block_size)
+        placeholders = ', '.join('?' for _ in range(len(self.columns) + 1))
+        self.sql = f"INSERT INTO {table} (id, {', '.join(self.columns)}) VALUES ({placeholders})"
+
+        self._buffer = []
+        self._retry = []  # [(số lần đã thử, lô dòng)]
+        self._lost = []  # dòng không ghi được vào cả database lẫn file dead-letter
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stopping = False
+        self._thread = None
+
+        self.flushes = 0
+        self.rows_written = 0
+        self.largest_flush = 0
+        self.failures = 0
+        self.dead_lettered = 0
+
+    def start(self):
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name=f"write-behind-{self.table}", daemon=True)
+            self._thread.start()
+
+    def submit(self, row):
+        return self.submit_many([row])[0]
+
+    def submit_many(self, rows):
+        """Đưa nhiều dòng vào hàng đợi, trả về id đã cấp theo đúng thứ tự"""
+        if self._thread is None:
+            self.start()
+        ids = self.ids.allocate(len(rows))
+        with self._condition:
+            self._buffer.extend((row_id,) + tuple(row) for row_id, row in zip(ids, rows))
+            if len(self._buffer) >= self.batch_size:
+                self._condition.notify()
+        return ids
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._stopping and len(self._buffer) < self.batch_size:
+                    self._condition.wait(self.interval)
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+    def _insert(self, rows):
+        with self.pool.connection() as conn:
+            conn.executemany(self.sql, rows)
+            conn.commit()
+
+    def _write(self, rows, attempts):
+        """Ghi một lô, trả về số dòng đã ghi; phần lỗi vào _retry hoặc dead-letter"""
+        try:
+            self._insert(rows)
+            return len(rows)
+        except sqlite3.OperationalError as e:
+            # Lỗi phía database, không phải do dữ liệu: thử lại cả lô ở lần flush sau
+            self.failures += 1
+            attempts += 1
+            if attempts < self.max_attempts:
+                logger.warning("Write-behind flush failed for %d rows (attempt %d/%d): %s",
+                               len(rows), attempts, self.max_attempts, e)
+                with self._condition:
+                    self._retry.append((attempts, rows))
+            else:
+                self._dead_letter(rows, e)
+            return 0
+        except Exception as e:
+            self.failures += 1
+            if len(rows) == 1:
+                self._dead_letter(rows, e)
+                return 0
+            # Chia đôi để tách dòng lỗi khỏi phần còn lại của lô
+            middle = len(rows) // 2
+            return self._write(rows[:middle], attempts) + self._write(rows[middle:], attempts)
+
+    def _dead_letter(self, rows, error):
+        logger.error("Write-behind dropped %d rows into %s: %s", len(rows), self.dead_letter_path, error)
+        try:
+            with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+                for row in rows:
+                    f.write(json.dumps({
+                        "table": self.table,
+                        "columns": ("id",) + self.columns,
+                        "row": row,
+                        "error": str(error),
+                        "at": sqlite_timestamp()
+                    }, ensure_ascii=False, default=str) + '\n')
+        except OSError:
+            logger.exception("Cannot write dead-letter file %s", self.dead_letter_path)
+            with self._condition:
+                self._lost.extend(rows)
+            return
+        self.dead_lettered += len(rows)
+
+    def flush(self):
+        """Ghi các lô đang chờ thử lại rồi đến hàng đợi, trả về số dòng đã ghi"""
+        with self._flush_lock:
+            with self._condition:
+                retry, self._retry = self._retry, []
+                rows, self._buffer = self._buffer, []
+            if rows:
+                retry.append((0, rows))
+            written = 0
+            for attempts, batch in retry:
+                count = self._write(batch, attempts)
+                if count:
+                    self.flushes += 1
+                    self.rows_written += count
+                    self.largest_flush = max(self.largest_flush, count)
+                written += count
+            with self._condition:
+                retrying = bool(self._retry)
+            if retrying:
+                # Chờ database hết lỗi tạm thời trước lần thử sau
+                time.sleep(self.interval)
+            return written
+
+    def pending(self):
+        with self._condition:
+            return len(self._buffer) + sum(len(rows) for _, rows in self._retry)
+
+    def close(self):
+        """Dừng thread nền và ghi hết dữ liệu còn trong hàng đợi
+
+        Thử lại đến khi mọi dòng đã vào database hoặc file dead-letter; nếu
+        vẫn còn dòng không lưu được ở đâu thì raise WriteBehindError.
+        """
+        if self._thread is not None:
+            with self._condition:
+                self._stopping = True
+                self._condition.notify()
+            self._thread.join()
+            self._thread = None
+        # Mỗi lô chỉ được thử max_attempts lần nên vòng lặp luôn dừng
+        while self.pending():
+            self.flush()
+        with self._condition:
+            lost, self._lost = self._lost, []
+        if lost:
+            raise WriteBehindError(
+                f"{len(lost)} {self.table} rows could not be written to the database "
+                f"or {self.dead_letter_path}"
+            )
+
+    def stats(self):
+        with self._condition:
+            pending = len(self._buffer)
+            retrying = sum(len(rows) for _, rows in self._retry)
+            lost = len(self._lost)
+        return {
+            "pending": pending,
+            "retrying": retrying,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "mean_flush_size": self.rows_written / self.flushes if self.flushes > 0 else 0,
+            "largest_flush": self.largest_flush,
+            "failures": self.failures,
+            "dead_lettered": self.dead_lettered,
+            "lost": lost,
+            "batch_size": self.batch_size,
+            "interval_ms": self.interval * 1000
+        }